@@ -1,6 +1,6 @@
 # agentsServer.py
 
-from agent import Car, Road, Traffic_Light, Destination, Obstacle  # Explicit imports
+from agent import Road, Traffic_Light, Destination, Obstacle  # Explicit imports
 from model import CityModel
 from mesa.visualization import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
@@ -43,18 +43,29 @@ def agent_portrayal(agent):
         portrayal["w"] = 0.8
         portrayal["h"] = 0.8
 
-    elif isinstance(agent, Car):
-        portrayal = {
-            "Shape": "rect",
-            "Color": "pink",
-            "Filled": True,
-            "Layer": 3,  # Upper layer to be above Road and other agents on Layer 0
-            "w": 0.8,
-            "h": 0.8
-        }
-
     return portrayal
 
+def car_portrayal():
+    return {
+        "Shape": "rect",
+        "Color": "pink",
+        "Filled": True,
+        "Layer": 3,  # Upper layer to be above Road and other agents on Layer 0
+        "w": 0.8,
+        "h": 0.8
+    }
+
+class CityCanvasGrid(CanvasGrid):
+    """CanvasGrid that also draws the cars, they are kept by the model instead of being agents on the grid."""
+    def render(self, model):
+        grid_state = super().render(model)
+        for _, (x, y) in model.car_positions():
+            portrayal = car_portrayal()
+            portrayal["x"] = x
+            portrayal["y"] = y
+            grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
 # Define grid dimensions based on the map file
 width = 0
 height = 0
@@ -69,7 +80,7 @@ with open('city_files/2024_base.txt') as baseFile:
 model_params = {"N": 5}
 
 print(width, height)
-grid = CanvasGrid(agent_portrayal, width, height, 500, 500)
+grid = CityCanvasGrid(agent_portrayal, width, height, 500, 500)
 
 # Remove or comment out the ChartModule to avoid datacollector errors
 # chart = ChartModule([{"Label": "Número de Coches", "Color": "Pink"}],
@@ -0,0 +1,115 @@
+# batch.py
+"""
+Runs many simulations without a server, in parallel worker processes, and writes one row of
+metrics per run as soon as it finishes.
+
+Example:
+    python batch.py --maps 2021_base.txt 2024_base.txt --spawn-intervals 5 10 --light-times 3 5 8 \\
+        --seeds 1 2 3 --steps 1000 --output results.csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from city_map import CITY_FILES
+from sessions import create_model
+
+# Columns of the output, in order
+FIELDS = ["map", "engine", "signals", "update", "spawn_interval", "light_time", "seed", "steps",
+          "total_arrived", "throughput", "mean_travel_time", "cars_in_flight", "queue_delay", "wall_time"]
+
+def run_simulation(config):
+    """
+    Runs one simulation and returns its metrics.
+    Args:
+        config: Dictionary with map, engine, signals, update (None for the numpy engine), spawn_interval,
+            light_time, seed and steps
+    """
+    start = time.perf_counter()
+    options = {"update": config["update"]} if config["engine"] == "mesa" else {}
+    model = create_model(config["engine"],
+                         map_file=os.path.join(CITY_FILES, config["map"]),
+                         spawn_interval=config["spawn_interval"],
+                         light_time=config["light_time"],
+                         signals=config["signals"],
+                         seed=config["seed"],
+                         **options)
+    model.advance(config["steps"])
+
+    return dict(config,
+                total_arrived=model.total_arrived,
+                throughput=model.total_arrived / config["steps"] if config["steps"] else 0,
+                mean_travel_time=model.total_travel_time / model.total_arrived if model.total_arrived else None,
+                cars_in_flight=len(model.car_positions()),
+                # Car-steps spent waiting in the approaches of the traffic lights
+                queue_delay=sum(junction["delay"] for junction in model.signal_stats()),
+                wall_time=round(time.perf_counter() - start, 4))
+
+def sweep(maps, engines, spawn_intervals, light_times, seeds, steps, signals=("fixed",), updates=("random",)):
+    """Every combination of the parameters, as configs for run_simulation."""
+    for map_name, engine, signal, update, spawn_interval, light_time, seed in itertools.product(
+            maps, engines, signals, updates, spawn_intervals, light_times, seeds):
+        if engine == "numpy":
+            # The numpy engine always moves every car at once, update doesn't apply to it
+            if update != updates[0]:
+                continue
+            update = None
+        yield {"map": map_name, "engine": engine, "signals": signal, "update": update, "spawn_interval": spawn_interval,
+               "light_time": light_time, "seed": seed, "steps": steps}
+
+def run_batch(configs, workers=None):
+    """Runs the simulations in a pool of processes, yielding the results in the order they finish."""
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(run_simulation, configs)
+
+class ResultWriter:
+    """Writes the results as CSV, or as JSON lines when the file ends with .jsonl. Every row is flushed."""
+    def __init__(self, file):
+        self.file = file
+        self.jsonl = getattr(file, "name", "").endswith(".jsonl")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(file, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.jsonl:
+            self.file.write(json.dumps(result) + "\n")
+        else:
+            self.writer.writerow(result)
+        self.file.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a sweep of traffic simulations without a server.")
+    parser.add_argument("--maps", nargs="+", default=sorted(name for name in os.listdir(CITY_FILES) if name.endswith(".txt")),
+                        help="Map files inside city_files (all of them by default)")
+    parser.add_argument("--engines", nargs="+", default=["mesa"], choices=["mesa", "numpy"])
+    parser.add_argument("--signals", nargs="+", default=["fixed"], choices=["fixed", "green_wave", "adaptive"])
+    parser.add_argument("--updates", nargs="+", default=["random"], choices=["random", "synchronous"],
+                        help="How the cars of the mesa engine move (see CityModel)")
+    parser.add_argument("--spawn-intervals", nargs="+", type=int, default=[10])
+    parser.add_argument("--light-times", nargs="+", type=int, default=[None],
+                        help="timeToChange of the traffic lights (the one from mapDictionary.json by default)")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (one per core by default)")
+    parser.add_argument("--output", default=None, help="Output file (.csv or .jsonl), standard output by default")
+    args = parser.parse_args(argv)
+
+    configs = list(sweep(args.maps, args.engines, args.spawn_intervals, args.light_times, args.seeds, args.steps, args.signals, args.updates))
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = ResultWriter(output)
+        for done, result in enumerate(run_batch(configs, args.workers), start=1):
+            writer.write(result)
+            print(f"{done}/{len(configs)} runs finished", file=sys.stderr)
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# benchmark.py
+"""
+Measures where the time goes: building the model, routing a car, stepping the model and
+serializing /getAgents. Every run uses fixed seeds, so two revisions can be compared:
+
+    python benchmark.py --output before.json
+    (change the code)
+    python benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from city_map import CITY_FILES
+from mapgen import generate_map
+from sessions import create_model
+
+BASE_MAPS = ["2021_base.txt", "2022_base.txt", "2023_base.txt", "2024_base.txt"]
+
+def percentile(values, p):
+    """p-th percentile (0-100) of a list of numbers, by nearest rank."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def synthetic_map(size, folder):
+    """Writes a generated size x size map (always with the same seed) and returns its path."""
+    path = os.path.join(folder, f"synthetic_{size}.txt")
+    with open(path, "w") as mapFile:
+        mapFile.write("\n".join(generate_map(size, size, seed=0)) + "\n")
+    return path
+
+def model_options(engine, routing):
+    # The numpy engine always routes with distance fields
+    return {} if engine == "numpy" else {"routing": routing}
+
+def time_construction(engine, map_file, repeat, routing="astar"):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        create_model(engine, map_file=map_file, seed=0, **model_options(engine, routing))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def time_routing(model):
+    """
+    Milliseconds of a route search (without cache) from every corner to every destination, on the
+    contraction hierarchy of the model if it has one or with A*.
+    """
+    hierarchy = getattr(model, "hierarchy", None)
+    search = hierarchy.shortest_path if hierarchy is not None else model.road_graph.a_star_search
+    times = []
+    for corner in model.corners:
+        for goal in model.road_graph.destinations:
+            start = time.perf_counter()
+            search(corner, goal)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def time_steps(model, steps):
+    """Steps per second, and the milliseconds per car of every spawn."""
+    spawn_times = []
+    create_cars_in_corners = model.create_cars_in_corners
+
+    def timed_create_cars_in_corners():
+        before = len(model.car_positions())
+        start = time.perf_counter()
+        create_cars_in_corners()
+        elapsed = time.perf_counter() - start
+        created = len(model.car_positions()) - before
+        if created > 0:
+            spawn_times.extend([elapsed * 1000 / created] * created)
+
+    # The model looks the method up on the instance, so this wraps every spawn of the run
+    model.create_cars_in_corners = timed_create_cars_in_corners
+    start = time.perf_counter()
+    model.advance(steps)
+    elapsed = time.perf_counter() - start
+    del model.create_cars_in_corners
+    return steps / elapsed, spawn_times
+
+def time_serialization(model, repeat):
+    """Milliseconds to answer /getAgents, or None if Flask is not installed."""
+    try:
+        import server
+    except ImportError:
+        return None
+    server.cityModel = model
+    client = server.app.test_client()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get('/getAgents')
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def peak_memory(engine, map_file, steps, routing="astar"):
+    """Peak memory in MB allocated while building the model and running it."""
+    gc.collect()
+    tracemalloc.start()
+    model = create_model(engine, map_file=map_file, seed=0, **model_options(engine, routing))
+    model.advance(steps)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+def benchmark_map(engine, map_file, steps, repeat, routing="astar"):
+    model = create_model(engine, map_file=map_file, seed=0, **model_options(engine, routing))
+    route_times = time_routing(model)
+    steps_per_second, spawn_times = time_steps(model, steps)
+    return {
+        "map": os.path.basename(map_file),
+        "size": f"{model.width}x{model.height}",
+        "construction_ms": time_construction(engine, map_file, repeat, routing) * 1000,
+        "route_p50_ms": percentile(route_times, 50),
+        "route_p99_ms": percentile(route_times, 99),
+        "spawn_p50_ms": percentile(spawn_times, 50),
+        "spawn_p90_ms": percentile(spawn_times, 90),
+        "spawn_p99_ms": percentile(spawn_times, 99),
+        "steps_per_second": steps_per_second,
+        "get_agents_ms": time_serialization(model, repeat),
+        "peak_memory_mb": peak_memory(engine, map_file, steps, routing),
+    }
+
+def compare(baseline, results):
+    """Prints the change of every metric against a baseline (ratio new / old)."""
+    old_rows = {row["map"]: row for row in baseline}
+    for row in results:
+        old = old_rows.get(row["map"])
+        if old is None:
+            continue
+        print(row["map"])
+        for key, value in row.items():
+            if isinstance(value, (int, float)) and isinstance(old.get(key), (int, float)) and old[key]:
+                print(f"    {key:18} {old[key]:12.3f} -> {value:12.3f}  x{value / old[key]:.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model construction, routing, stepping and serialization.")
+    parser.add_argument("--engine", default="mesa", choices=["mesa", "numpy"])
+    parser.add_argument("--routing", default="astar", choices=["astar", "ch", "field"],
+                        help="Routing of the mesa engine")
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the short measurements")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[60, 120],
+                        help="Also benchmark generated maps of N x N cells")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON file of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        map_files = [os.path.join(CITY_FILES, name) for name in BASE_MAPS]
+        map_files += [synthetic_map(size, folder) for size in args.sizes]
+        for map_file in map_files:
+            print(f"Benchmarking {os.path.basename(map_file)}", file=sys.stderr)
+            results.append(benchmark_map(args.engine, map_file, args.steps, args.repeat, args.routing))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump({"engine": args.engine, "routing": args.routing, "steps": args.steps, "results": results}, outputFile, indent=2)
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            compare(json.load(baselineFile)["results"], results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# car_store.py
+
+from array import array
+
+# Serial of the free slots
+FREE = -1
+
+class CarStore:
+    """
+    Cars of a CityModel, as parallel arrays indexed by slot instead of one agent object per car.
+    The car in a slot has a serial (its id), a cell, a goal (index in city_map.destinations), a route
+    and a cursor, the step it was created, the moves it made (travelled) and the steps it has been
+    waiting. A route is a tuple of cell indexes shared by every car with the same trip (see RouteCache),
+    and the cursor is the position of the next cell in it, so moving never copies nor shortens a list.
+    The slots of arrived cars are reused by the next cars, so the arrays only grow when there are more
+    cars at the same time than ever before.
+    """
+    def __init__(self):
+        self.serials = array("q")
+        self.cells = array("q")
+        self.goals = array("q")
+        # Route of every slot, None for cars that follow the distance fields
+        self.routes = []
+        self.cursors = array("q")
+        self.spawn_steps = array("q")
+        self.travelled = array("q")
+        self.waited = array("q")
+        self.free = []
+        # Slot of every car by serial, in the order they were added
+        self.slots = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, serial, cell, goal, route, spawn_step, cursor=0, travelled=0, waited=0):
+        """Puts a car in a free slot (or a new one) and returns the slot."""
+        if self.free:
+            slot = self.free.pop()
+            self.serials[slot] = serial
+            self.cells[slot] = cell
+            self.goals[slot] = goal
+            self.routes[slot] = route
+            self.cursors[slot] = cursor
+            self.spawn_steps[slot] = spawn_step
+            self.travelled[slot] = travelled
+            self.waited[slot] = waited
+        else:
+            slot = len(self.serials)
+            self.serials.append(serial)
+            self.cells.append(cell)
+            self.goals.append(goal)
+            self.routes.append(route)
+            self.cursors.append(cursor)
+            self.spawn_steps.append(spawn_step)
+            self.travelled.append(travelled)
+            self.waited.append(waited)
+        self.slots[serial] = slot
+        return slot
+
+    def remove(self, slot):
+        """Frees the slot of a car."""
+        del self.slots[self.serials[slot]]
+        self.serials[slot] = FREE
+        # Don't keep the route alive
+        self.routes[slot] = None
+        self.free.append(slot)
+
+    def route_left(self, slot):
+        """Cells of the route that the car in slot still has to go through (None without route)."""
+        route = self.routes[slot]
+        return None if route is None else route[self.cursors[slot]:]
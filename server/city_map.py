@@ -0,0 +1,323 @@
+# city_map.py
+"""
+Static layer of the city, read from a text map (city_files/*.txt with mapDictionary.json) or from
+a compiled map (.cmap). Compiled maps are made with:
+
+    python city_map.py city_files/2024_base.txt --output city_files/2024_base.cmap
+
+A compiled map is a little endian binary file:
+    header: "CMAP", uint32 version, width, height, lights, destinations, edges
+    cells: one uint8 per cell in RoadGraph index order (column major), kind | direction << 3,
+           padded to a multiple of 4 bytes
+    lights: cell index (uint32), light group (uint32), timeToChange (uint16), initial state (uint8), padding
+    destinations: cell index (uint32) of each destination
+    successors: offsets (uint32, cells + 1) and targets (uint32, edges) of the road graph
+The file is memory-mapped, so loading it only reads the header and the small tables, and worker
+processes that open the same file share its pages.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from functools import cached_property
+from types import MappingProxyType
+from routing import ROAD, TRAFFIC_LIGHT, OBSTACLE, DESTINATION, MOORE_OFFSETS, RoadGraph
+
+# Folder with the maps, so they are found from any working directory
+CITY_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "city_files")
+DEFAULT_MAP = os.path.join(CITY_FILES, "2024_base.txt")
+DEFAULT_DICTIONARY = os.path.join(CITY_FILES, "mapDictionary.json")
+
+# Compiled map format
+MAGIC = b"CMAP"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIIII")
+LIGHT = struct.Struct("<IIHBx")
+# Cell codes: the kind in the low 3 bits and the direction of roads in the rest (0 means nothing)
+KIND_CODES = (None, ROAD, TRAFFIC_LIGHT, OBSTACLE, DESTINATION)
+DIRECTION_CODES = (None, "Left", "Right", "Up", "Down", "Vertical", "Horizontal")
+
+def group_lights(lights):
+    """
+    Groups the traffic lights that touch each other: the lights of one junction, where the "S"
+    lights of one road and the "s" lights of the crossing road meet.
+    Returns the group of every light, in the order of lights.
+    """
+    positions = {pos: i for i, (_, pos, _, _) in enumerate(lights)}
+    groups = [None] * len(lights)
+    group = 0
+    for i, (_, pos, _, _) in enumerate(lights):
+        if groups[i] is not None:
+            continue
+        groups[i] = group
+        pending = [pos]
+        while pending:
+            x, y = pending.pop()
+            for dx, dy in MOORE_OFFSETS:
+                j = positions.get((x + dx, y + dy))
+                if j is not None and groups[j] is None:
+                    groups[j] = group
+                    pending.append(lights[j][1])
+        group += 1
+    return tuple(groups)
+
+class CityMap:
+    """
+    Static layer of the city: roads, traffic lights, obstacles and destinations read from a map file.
+    It never changes after it is loaded, so it can be shared and queried without touching the grid.
+    """
+    def __init__(self, lines, dataDictionary):
+        """
+        Reads a map.
+        Args:
+            lines: Lines of the map file, each character represents a cell
+            dataDictionary: Dictionary that maps the characters to directions and light times
+        """
+        self.width = len(lines[0].strip())
+        self.height = len(lines)
+
+        cells = {}
+        roads = []
+        lights = []
+        obstacles = []
+        destinations = []
+        for r, row in enumerate(lines):
+            for c, col in enumerate(row.strip()):
+                pos = (c, self.height - r - 1)
+                if col in [">", "<", "v", "^"]:
+                    cells[pos] = (ROAD, dataDictionary[col])
+                    roads.append((f"r_{r*self.width+c}", pos, dataDictionary[col]))
+                elif col in ["S", "s"]:
+                    cells[pos] = (TRAFFIC_LIGHT, None)
+                    # (id, position, initial state, timeToChange)
+                    lights.append((f"tl_{r*self.width+c}", pos, False if col == "S" else True, int(dataDictionary[col])))
+                elif col == "#":
+                    cells[pos] = (OBSTACLE, None)
+                    obstacles.append((f"ob_{r*self.width+c}", pos))
+                elif col == "D":
+                    cells[pos] = (DESTINATION, None)
+                    destinations.append((f"d_{r*self.width+c}", pos))
+
+        self.cells = MappingProxyType(cells)
+        self.roads = tuple(roads)
+        self.lights = tuple(lights)
+        self.obstacles = tuple(obstacles)
+        self.destinations = tuple(destinations)
+        self.destination_index = MappingProxyType({pos: i for i, (_, pos) in enumerate(destinations)})
+        # Lights that touch each other share a group, one per junction
+        self.light_groups = group_lights(self.lights)
+
+    @classmethod
+    def load(cls, map_file=DEFAULT_MAP, dictionary_file=DEFAULT_DICTIONARY):
+        """Reads a map file and its dictionary. Compiled maps (.cmap) don't need the dictionary."""
+        if map_file.endswith(".cmap"):
+            return CompiledCityMap(map_file)
+        with open(dictionary_file) as dictionaryFile:
+            dataDictionary = json.load(dictionaryFile)
+        with open(map_file) as baseFile:
+            return cls(baseFile.readlines(), dataDictionary)
+
+    def road_graph(self):
+        """Builds the road graph of the map."""
+        return RoadGraph(self.width, self.height, self.cells)
+
+    @cached_property
+    def static_layer(self):
+        """
+        What clients draw and never changes, as sent by /getMap:
+        {"version", "width", "height", "obstacles", "destinations", "lights"}, each cell as {"id", "x", "y", "z"}.
+        The lights are in the order of self.lights, so their states can be sent as a plain list.
+        The version is a hash of the rest, the same map always has the same version.
+        """
+        def cells(items):
+            return [{"id": str(item[0]), "x": item[1][0], "y": 1, "z": item[1][1]} for item in items]
+
+        layer = {"width": self.width, "height": self.height, "obstacles": cells(self.obstacles),
+                 "destinations": cells(self.destinations), "lights": cells(self.lights)}
+        layer["version"] = hashlib.sha1(json.dumps(layer, sort_keys=True).encode()).hexdigest()[:16]
+        return layer
+
+    def save_compiled(self, path):
+        """Writes the map, with its road graph, as a compiled map file."""
+        graph = self.road_graph()
+        cell_codes = bytearray(self.width * self.height)
+        for pos, (kind, direction) in self.cells.items():
+            if direction not in DIRECTION_CODES:
+                raise ValueError(f"Direction {direction!r} at {pos} can't be compiled")
+            cell_codes[graph.index(pos)] = KIND_CODES.index(kind) | DIRECTION_CODES.index(direction) << 3
+        cell_codes.extend(bytes(-len(cell_codes) % 4))
+
+        offsets, targets = graph.pack_successors()
+        destinations = array("I", [graph.index(pos) for _, pos in self.destinations])
+        if sys.byteorder != "little":
+            for values in (offsets, targets, destinations):
+                values.byteswap()
+
+        with open(path, "wb") as mapFile:
+            mapFile.write(HEADER.pack(MAGIC, VERSION, self.width, self.height,
+                                      len(self.lights), len(self.destinations), len(targets)))
+            mapFile.write(cell_codes)
+            for (_, pos, state, timeToChange), group in zip(self.lights, self.light_groups):
+                mapFile.write(LIGHT.pack(graph.index(pos), group, timeToChange, state))
+            mapFile.write(destinations.tobytes())
+            mapFile.write(offsets.tobytes())
+            mapFile.write(targets.tobytes())
+
+    def kind_at(self, pos):
+        """Kind of the cell at pos (ROAD, TRAFFIC_LIGHT, OBSTACLE, DESTINATION or None)."""
+        return self.cells.get(pos, (None, None))[0]
+
+    def direction_at(self, pos):
+        """Direction of the road at pos, or None if there is no road."""
+        return self.cells.get(pos, (None, None))[1]
+
+    def is_road(self, pos):
+        return self.kind_at(pos) == ROAD
+
+    def is_obstacle(self, pos):
+        return self.kind_at(pos) == OBSTACLE
+
+    def is_destination(self, pos):
+        return self.kind_at(pos) == DESTINATION
+
+
+class CellView(Mapping):
+    """Read-only {pos: (kind, direction)} view over the cell codes of a compiled map."""
+    def __init__(self, codes, width, height):
+        self.codes = codes
+        self.width = width
+        self.height = height
+
+    def __getitem__(self, pos):
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise KeyError(pos)
+        code = self.codes[x * self.height + y]
+        if code == 0:
+            raise KeyError(pos)
+        return KIND_CODES[code & 7], DIRECTION_CODES[code >> 3]
+
+    def __iter__(self):
+        for index, code in enumerate(self.codes):
+            if code:
+                yield divmod(index, self.height)
+
+    def __len__(self):
+        return len(self.codes) - bytes(self.codes).count(0)
+
+
+class CompiledCityMap(CityMap):
+    """
+    CityMap read from a compiled map file. Only the header, the lights and the destinations are
+    read when it is opened; the cells and the road graph are read from the mapped file when used.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as mapFile:
+            self._mmap = mmap.mmap(mapFile.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, version, self.width, self.height, n_lights, n_destinations, n_edges = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled map (version {VERSION})")
+        n_cells = self.width * self.height
+
+        start = HEADER.size
+        self.codes = view[start:start + n_cells]
+        start += n_cells + (-n_cells % 4)
+
+        lights = []
+        light_groups = []
+        for cell, group, timeToChange, state in LIGHT.iter_unpack(view[start:start + n_lights * LIGHT.size]):
+            pos = divmod(cell, self.height)
+            lights.append((self._cell_id("tl", pos), pos, bool(state), timeToChange))
+            light_groups.append(group)
+        start += n_lights * LIGHT.size
+
+        destination_cells = self._uint32(view, start, n_destinations)
+        start += n_destinations * 4
+        self._offsets = self._uint32(view, start, n_cells + 1)
+        start += (n_cells + 1) * 4
+        self._targets = self._uint32(view, start, n_edges)
+
+        destinations = []
+        for cell in destination_cells:
+            pos = divmod(cell, self.height)
+            destinations.append((self._cell_id("d", pos), pos))
+
+        self.cells = CellView(self.codes, self.width, self.height)
+        self.lights = tuple(lights)
+        self.light_groups = tuple(light_groups)
+        self.destinations = tuple(destinations)
+        self.destination_index = MappingProxyType({pos: i for i, (_, pos) in enumerate(destinations)})
+
+    def __reduce__(self):
+        # The mapped file can't be pickled, but it can be opened again
+        return CompiledCityMap, (self.path,)
+
+    @staticmethod
+    def _uint32(view, start, count):
+        values = view[start:start + count * 4]
+        if sys.byteorder == "little":
+            return values.cast("I")
+        values = array("I", values)
+        values.byteswap()
+        return values
+
+    def _cell_id(self, prefix, pos):
+        """Same ids as the text map, which numbers the cells by row from the top."""
+        x, y = pos
+        return f"{prefix}_{(self.height - y - 1) * self.width + x}"
+
+    def _cells_of_kind(self, kind):
+        code = KIND_CODES.index(kind)
+        for index, cell_code in enumerate(self.codes):
+            if cell_code & 7 == code:
+                yield divmod(index, self.height), cell_code
+
+    @cached_property
+    def roads(self):
+        return tuple((self._cell_id("r", pos), pos, DIRECTION_CODES[code >> 3])
+                     for pos, code in sorted(self._cells_of_kind(ROAD), key=self._reading_order))
+
+    @cached_property
+    def obstacles(self):
+        return tuple((self._cell_id("ob", pos), pos)
+                     for pos, _ in sorted(self._cells_of_kind(OBSTACLE), key=self._reading_order))
+
+    def _reading_order(self, item):
+        """Sort key that gives the cells in the order of the text map (by row from the top)."""
+        (x, y), _ = item
+        return -y, x
+
+    def road_graph(self):
+        """The road graph stored in the file, nothing is computed."""
+        return RoadGraph.from_packed(self.width, self.height, [pos for _, pos in self.destinations],
+                                     self._offsets, self._targets)
+
+    def kind_at(self, pos):
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        return KIND_CODES[self.codes[x * self.height + y] & 7]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a text map into a compiled map (.cmap).")
+    parser.add_argument("map_file")
+    parser.add_argument("--dictionary", default=DEFAULT_DICTIONARY)
+    parser.add_argument("--output", default=None, help="Compiled map to write (the map file with .cmap by default)")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.map_file)[0] + ".cmap"
+    CityMap.load(args.map_file, args.dictionary).save_compiled(output)
+    print(f"Compiled {args.map_file} into {output}")
+
+if __name__ == "__main__":
+    main()
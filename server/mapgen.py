@@ -0,0 +1,164 @@
+# mapgen.py
+"""
+Generates city maps of any size in the same format as city_files/*_base.txt.
+
+The city is a grid of blocks ("#") surrounded by a two lane ring road, with two lane one-way
+streets and avenues between the blocks. Avenues end at traffic lights ("S") where they join a
+street, and the street has its own lights ("s") just before the junction. Destinations ("D")
+are placed in the blocks next to the roads, and only the ones that can be reached from the
+corners where cars are created are kept.
+
+Example:
+    python mapgen.py 500 500 --seed 1 --output city_files/synthetic_500.txt
+"""
+
+import argparse
+import json
+import random
+from collections import deque
+from city_map import CityMap, DEFAULT_DICTIONARY
+from routing import RoadGraph
+
+def road_lines(size, rng, block_min, block_max):
+    """First index of each interior two lane road, leaving blocks of block_min to block_max cells between them."""
+    lines = []
+    pos = 2  # After the ring road
+    while True:
+        block = rng.randint(block_min, block_max)
+        # There must be room for this road and a last block before the ring road
+        if pos + block + 2 + block_min > size - 2:
+            return lines
+        pos += block
+        lines.append(pos)
+        pos += 2
+
+def ring_direction(r, c, width, height):
+    """Direction of the ring road at row r, column c (counter-clockwise, like 2024_base.txt), or None."""
+    top, bottom = r < 2, r >= height - 2
+    left, right = c < 2, c >= width - 2
+    if top and left:
+        return "v"
+    if top and right:
+        return "<"
+    if bottom and left:
+        return ">"
+    if bottom and right:
+        return "^"
+    if top:
+        return "<"
+    if bottom:
+        return ">"
+    if left:
+        return "v"
+    if right:
+        return "^"
+    return None
+
+def generate_map(width, height, seed=None, block_min=3, block_max=8, destination_rate=0.05):
+    """
+    Generates a map and returns its lines (without line breaks).
+    Args:
+        width: Columns of the map
+        height: Rows of the map
+        seed: Seed for the random numbers, the same seed always gives the same map
+        block_min: Minimum size of a block
+        block_max: Maximum size of a block
+        destination_rate: Probability of a block cell next to a road being a destination
+    """
+    if width < 4 + block_min or height < 4 + block_min:
+        raise ValueError(f"The map must be at least {4 + block_min}x{4 + block_min}")
+    rng = random.Random(seed)
+
+    # Interior streets (rows) and avenues (columns), alternating their direction
+    street_rows = road_lines(height, rng, block_min, block_max)
+    avenue_cols = road_lines(width, rng, block_min, block_max)
+    streets = {}
+    for i, row in enumerate(street_rows):
+        streets[row] = streets[row + 1] = ">" if i % 2 == 0 else "<"
+    avenues = {}
+    for i, col in enumerate(avenue_cols):
+        avenues[col] = avenues[col + 1] = "^" if i % 2 == 0 else "v"
+
+    def street_at(r):
+        """Direction of the street (or ring row) at row r."""
+        if r < 2:
+            return "<"
+        if r >= height - 2:
+            return ">"
+        return streets.get(r)
+
+    cells = [["#"] * width for _ in range(height)]
+    for r in range(height):
+        for c in range(width):
+            direction = ring_direction(r, c, width, height) or street_at(r) or avenues.get(c)
+            if direction:
+                cells[r][c] = direction
+
+    # Traffic lights where each avenue segment joins the next street, and on that street just before the junction
+    for col in avenue_cols:
+        rows = [r for r in range(2, height - 2) if street_at(r) is None]
+        for r in rows:
+            exit_row = r - 1 if avenues[col] == "^" else r + 1
+            if street_at(exit_row) is None:
+                continue
+            cells[r][col] = cells[r][col + 1] = "S"
+            # The street lanes are two rows starting at exit_row (going down) or ending at it (going up)
+            lanes = [exit_row, exit_row + 1] if avenues[col] == "v" else [exit_row - 1, exit_row]
+            upstream = col + 2 if street_at(exit_row) == "<" else col - 1
+            if 2 <= upstream < width - 2:
+                for lane in lanes:
+                    cells[lane][upstream] = "s"
+
+    # Destinations in the block cells next to a road
+    for r in range(1, height - 1):
+        for c in range(1, width - 1):
+            if cells[r][c] == "#" and rng.random() < destination_rate:
+                neighbours = [cells[r + dr][c + dc] for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+                if any(cell in "<>^v" for cell in neighbours):
+                    cells[r][c] = "D"
+
+    lines = ["".join(row) for row in cells]
+    return remove_unreachable_destinations(lines)
+
+def remove_unreachable_destinations(lines):
+    """Turns into obstacles the destinations that can't be reached from any corner."""
+    with open(DEFAULT_DICTIONARY) as dictionaryFile:
+        city_map = CityMap(lines, json.load(dictionaryFile))
+    graph = RoadGraph(city_map.width, city_map.height, city_map.cells)
+
+    corners = [(0, 0), (city_map.width - 1, 0), (0, city_map.height - 1), (city_map.width - 1, city_map.height - 1)]
+    reached = {graph.index(corner) for corner in corners}
+    queue = deque(reached)
+    while queue:
+        for successor in graph.successors[queue.popleft()]:
+            if successor not in reached:
+                reached.add(successor)
+                queue.append(successor)
+
+    rows = [list(line) for line in lines]
+    for _, (x, y) in city_map.destinations:
+        if graph.index((x, y)) not in reached:
+            rows[city_map.height - y - 1][x] = "#"
+    return ["".join(row) for row in rows]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a city map.")
+    parser.add_argument("width", type=int)
+    parser.add_argument("height", type=int)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--block-min", type=int, default=3)
+    parser.add_argument("--block-max", type=int, default=8)
+    parser.add_argument("--destination-rate", type=float, default=0.05)
+    parser.add_argument("--output", default=None, help="Map file to write (standard output by default)")
+    args = parser.parse_args(argv)
+
+    lines = generate_map(args.width, args.height, args.seed, args.block_min, args.block_max, args.destination_rate)
+    text = "\n".join(lines) + "\n"
+    if args.output:
+        with open(args.output, "w") as mapFile:
+            mapFile.write(text)
+    else:
+        print(text, end="")
+
+if __name__ == "__main__":
+    main()
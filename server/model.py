@@ -1,63 +1,109 @@
 # model.py
 
 from mesa import Model
-from mesa.time import RandomActivation
 from mesa.space import MultiGrid
-from agent import Car, Road, Traffic_Light, Destination, Obstacle  # Explicit imports
-import json
-import random
-import heapq  # Import heapq for A* implementation
+import sys
+from collections import deque
+from array import array
+from agent import Road, Traffic_Light, Destination, Obstacle  # Explicit imports
+from car_store import CarStore
+from routing import RoadGraph, RouteCache, DistanceFields, ContractionHierarchy
+from city_map import CityMap, DEFAULT_MAP
+from traffic_control import SignalController
+from telemetry import Telemetry
+from profiling import Profiler
+from snapshot import dump_snapshot, snapshot_params, restore_params
+from model_base import CityModelMixin
 
-class CityModel(Model):
+# Number of steps of car changes kept for the clients that ask for changes only
+CHANGE_HISTORY = 100
+
+class CityModel(CityModelMixin, Model):
     """ 
         Creates a model based on a city map.
 
         Args:
             N: Number of agents in the simulation (no se usa actualmente)
+            routing: How cars find their way, "astar" (a path per car), "ch" (a path per car, searched on a
+                contraction hierarchy built with the model, for big maps) or "field" (distance fields per destination)
+            map_file: Path of the map file (text or compiled .cmap)
+            spawn_interval: Every how many steps new cars are created in the corners
+            light_time: timeToChange of every traffic light (None keeps the one from mapDictionary.json)
+            seed: Seed for the random numbers (used by Mesa)
+            signals: How traffic lights are switched, "fixed" (every junction on the same steps),
+                "green_wave" (junction offsets that make green waves) or "adaptive" (greens follow the queues)
+            update: How cars move in a step, "random" (one after the other in random order) or "synchronous"
+                (every car proposes a move, conflicts are solved by priority and all the moves happen at once)
+            static_agents: Place Road and Obstacle agents on the grid, only needed to draw them with Mesa
+            telemetry_file: File where the telemetry of every step and trip is appended (optional, not kept in snapshots)
     """
-    def __init__(self, N):
+    def __init__(self, N, routing="astar", map_file=DEFAULT_MAP, spawn_interval=10, light_time=None, seed=None,
+                 signals="fixed", update="random", static_agents=True, telemetry_file=None):
         # Call the base class constructor
         super().__init__()
 
-        # Load the map dictionary. Maps characters to agents.
-        dataDictionary = json.load(open("city_files/mapDictionary.json"))
+        # Parameters needed to build the same model again (see snapshot)
+        self.params = {"routing": routing, "map_file": map_file, "spawn_interval": spawn_interval, "light_time": light_time,
+                       "signals": signals, "update": update, "static_agents": static_agents}
 
+        self.routing = routing
+        if update not in ("random", "synchronous"):
+            raise ValueError(f"Unknown update {update!r}")
+        self.update = update
+        self.static_agents = static_agents
+        self.spawn_interval = spawn_interval
         self.traffic_lights = []
         self.total_arrived = 0
+        # Sum of the steps that the arrived cars took to reach their destination
+        self.total_travel_time = 0
+
+        # Load the map file into the static layer. Each character represents a cell.
+        self.city_map = CityMap.load(map_file)
+        self.width = self.city_map.width
+        self.height = self.city_map.height
+        # The grid only holds the static agents, cars live in the car store (see CarStore)
+        self.grid = MultiGrid(self.width, self.height, torus=False)  # Grid without torus
+        self.agentsArrived = 0
+
+        # Static agents are only placed on the grid (so they can be drawn), they are never scheduled.
+        # Everything else reads the static layer from city_map.
+        if static_agents:
+            for agent_id, pos, direction in self.city_map.roads:
+                self.grid.place_agent(Road(agent_id, self, direction), pos)
+
+            for agent_id, pos in self.city_map.obstacles:
+                self.grid.place_agent(Obstacle(agent_id, self), pos)
 
-        # Load the map file. Each character represents an agent.
-        with open('city_files/2024_base.txt') as baseFile:
-            lines = baseFile.readlines()
-            self.width = len(lines[0].strip())
-            self.height = len(lines)
-            self.grid = MultiGrid(self.width, self.height, torus=False)  # Grid without torus
-            self.schedule = RandomActivation(self)  # Random agent activation
-            self.agentsArrived = 0
-
-            # Iterate through each character in the map and create the corresponding agent.
-            for r, row in enumerate(lines):
-                for c, col in enumerate(row.strip()):
-                    pos = (c, self.height - r - 1)
-                    if col in [">", "<", "v", "^"]:
-                        agent = Road(f"r_{r*self.width+c}", self, dataDictionary[col])
-                        self.grid.place_agent(agent, pos)
-                        self.schedule.add(agent)  # Add Road agents to the schedule if they have step methods
-
-                    elif col in ["S", "s"]:
-                        agent = Traffic_Light(f"tl_{r*self.width+c}", self, False if col == "S" else True, int(dataDictionary[col]))
-                        self.grid.place_agent(agent, pos)
-                        self.schedule.add(agent)
-                        self.traffic_lights.append(agent)
-
-                    elif col == "#":
-                        agent = Obstacle(f"ob_{r*self.width+c}", self)
-                        self.grid.place_agent(agent, pos)
-                        self.schedule.add(agent)
-
-                    elif col == "D":
-                        agent = Destination(f"d_{r*self.width+c}", self)
-                        self.grid.place_agent(agent, pos)
-                        self.schedule.add(agent)
+        # Same order as city_map.destinations, so city_map.destination_index works on this list too
+        self.destinations = []
+        for agent_id, pos in self.city_map.destinations:
+            agent = Destination(agent_id, self)
+            self.grid.place_agent(agent, pos)
+            self.destinations.append(agent)
+
+        # Lights are switched by the signal controller, so they are not scheduled either.
+        # Same order as city_map.lights, which is the order of the controller states.
+        for agent_id, pos, state, timeToChange in self.city_map.lights:
+            agent = Traffic_Light(agent_id, self, state, light_time or timeToChange)
+            self.grid.place_agent(agent, pos)
+            self.traffic_lights.append(agent)
+
+        # Precompute the road graph once, every car routes over it instead of the grid
+        self.road_graph = self.city_map.road_graph()
+        self.signal_controller = SignalController(self.city_map, light_time, self.road_graph, signals)
+
+        # Dense state of every cell (by RoadGraph index), so moving and spawning never look at the grid:
+        # occupied is 1 where there is a car and red is 1 where there is a red light
+        n_cells = self.width * self.height
+        self.occupied = bytearray(n_cells)
+        self.red = bytearray(n_cells)
+        self.light_cells = [self.road_graph.index(pos) for _, pos, _, _ in self.city_map.lights]
+        for cell, state in zip(self.light_cells, self.signal_controller.states):
+            self.red[cell] = not state
+        self.hierarchy = ContractionHierarchy(self.road_graph) if routing == "ch" else None
+        self.route_cache = RouteCache(self.road_graph, self.hierarchy.shortest_path if self.hierarchy is not None else None)
+        self.distance_fields = DistanceFields(self.road_graph) if routing == "field" else None
+        self.goal_fields = self.build_goal_fields()
 
         # Define the coordinates of the four corners
         self.corners = [
@@ -66,9 +112,24 @@ class CityModel(Model):
             (0, self.height - 1),  # Top Left
             (self.width - 1, self.height - 1)  # Top Right
         ]
+        self.corner_cells = [self.road_graph.index(corner) for corner in self.corners]
 
-        # Initialize step counter
+        # Initialize step counters: step_count is increased when a step starts, steps (the tick used by the lights) when the cars moved
         self.step_count = 0
+        self.steps = 0
+
+        # Cars, with their serial as id
+        self.cars = CarStore()
+        self.next_car_serial = 0
+        # Change tracking: a log of (step, car id) for every car that was added, moved or removed
+        # during the last CHANGE_HISTORY steps
+        self.change_log = deque()
+        self.history_start = 0
+
+        # Per step counters and finished trips, with fixed memory
+        self.telemetry = Telemetry(telemetry_file)
+        # Phase timers, disabled until set_profiling is called
+        self.profiler = Profiler()
 
         # Create a car in each corner at the start
         self.create_cars_in_corners()
@@ -77,27 +138,431 @@ class CityModel(Model):
 
     def step(self):
         '''Advance the model by one step.'''
-        self.schedule.step()
+        # Counted before the agents move so their changes are recorded with this step
         self.step_count += 1
+        profiler = self.profiler
+        with profiler.phase("lights"):
+            self.update_traffic_lights()
+        with profiler.phase("cars"):
+            if self.update == "synchronous":
+                self.step_synchronous()
+            else:
+                self.step_random()
+        self.steps += 1
+
+        # Every spawn_interval steps, create a new car in each available corner
+        if self.step_count % self.spawn_interval == 0:
+            with profiler.phase("spawn"):
+                self.create_cars_in_corners()
+
+        # Forget the changes that are too old, clients behind them get every car again
+        self.history_start = max(self.history_start, self.step_count - CHANGE_HISTORY)
+        while self.change_log and self.change_log[0][0] <= self.history_start:
+            self.change_log.popleft()
+
+        self.telemetry.end_step(self.step_count, len(self.cars))
+        profiler.end_step(self.step_count)
+
+    def update_traffic_lights(self):
+        """Applies the phase changes of this step to the light agents, before the cars move."""
+        if self.signal_controller.next_change > self.steps:
+            return
+        states = self.signal_controller.states
+        for light in self.signal_controller.step(self.steps):
+            self.traffic_lights[light].state = bool(states[light])
+            self.red[self.light_cells[light]] = not states[light]
+
+    def step_random(self):
+        """Moves the cars one after the other, in a random order (like Mesa's RandomActivation)."""
+        order = list(self.cars.slots.values())
+        self.random.shuffle(order)
+        for slot in order:
+            self.step_car(slot)
+
+    def step_car(self, slot):
+        """Moves a car one cell along its route (or its distance field), or takes it out if it arrived."""
+        cars = self.cars
+        route = cars.routes[slot]
+        if route is not None:
+            cursor = cars.cursors[slot]
+            if cursor == len(route):
+                self.arrive(slot)
+                return
+            cell = route[cursor]
+            if self.occupied[cell] or self.red[cell]:
+                self.count_blocked((cell,))
+                return
+            cars.cursors[slot] = cursor + 1
+            self.move_car(slot, cell)
+            return
+
+        field = self.goal_fields[cars.goals[slot]]
+        cell = cars.cells[slot]
+        # 0 on the destination, UNREACHABLE if it can't be reached anymore: both end the trip
+        if field[cell] <= 0:
+            self.arrive(slot)
+            return
+        # Any free neighbour one move closer to the destination is as good as the others,
+        # so a car blocked in one lane can take another one right away
+        options = self.closer_cells(cell, field)
+        free = [option for option in options if not (self.occupied[option] or self.red[option])]
+        if not free:
+            self.count_blocked(options)
+            return
+        self.move_car(slot, self.random.choice(free))
+
+    def closer_cells(self, cell, field):
+        """Cells next to cell that are one move closer to the destination of a distance field."""
+        closer = field[cell] - 1
+        return [successor for successor in self.road_graph.successors[cell] if field[successor] == closer]
+
+    def has_arrived(self, slot):
+        """Checks if the car in slot is done with its trip."""
+        route = self.cars.routes[slot]
+        if route is not None:
+            return self.cars.cursors[slot] == len(route)
+        return self.goal_fields[self.cars.goals[slot]][self.cars.cells[slot]] <= 0
+
+    def propose_move(self, slot):
+        """
+        Synchronous update: returns the cell the car in slot wants to move to in this step, or None.
+        Other cars are not checked here, the model solves the conflicts after every car proposed.
+        """
+        cars = self.cars
+        route = cars.routes[slot]
+        if route is not None:
+            cell = route[cars.cursors[slot]]
+            return None if self.red[cell] else cell
+
+        options = [cell for cell in self.closer_cells(cars.cells[slot], self.goal_fields[cars.goals[slot]]) if not self.red[cell]]
+        if not options:
+            return None
+        # The first free option, or the first one hoping that its car moves on
+        free = [cell for cell in options if not self.occupied[cell]]
+        return (free or options)[0]
+
+    def step_synchronous(self):
+        """
+        Moves every car at once:
+        1. Cars on their destination leave.
+        2. Every car proposes a cell (propose_move).
+        3. Each cell goes to the car that waited longest for it, then to the oldest car (lowest serial).
+        4. A winner moves if its cell is empty or the car on it moves too, so a whole queue advances together
+           (a ring of three or more cars rotates, two cars can't swap their cells).
+        The result only depends on the state at the start of the step, not on an activation order.
+        """
+        cars = self.cars
+        for slot in list(cars.slots.values()):
+            if self.has_arrived(slot):
+                self.arrive(slot)
+
+        serials, waited = cars.serials, cars.waited
+        claims = {}
+        proposed = set()
+        for slot in cars.slots.values():
+            cell = self.propose_move(slot)
+            if cell is None:
+                self.telemetry.blocked_light += 1
+                continue
+            proposed.add(slot)
+            best = claims.get(cell)
+            if best is None or (-waited[slot], serials[slot]) < (-waited[best], serials[best]):
+                claims[cell] = slot
+
+        claimed_cell = {slot: cell for cell, slot in claims.items()}
+        occupant = {cars.cells[slot]: slot for slot in cars.slots.values()}
+        moves = {}  # slot -> whether the car moves
+        for slot in claims.values():
+            # Follow the queue ahead of the car until a car that doesn't move or an empty cell
+            queue, seen = [], set()
+            current = slot
+            while True:
+                if current in moves:
+                    result = moves[current]
+                    break
+                if current in seen:
+                    # A ring of cars, each one moves into the cell of the next. Two cars that want
+                    # each other's cell would have to go through each other, they are blocked.
+                    result = len(queue) - queue.index(current) > 2
+                    break
+                cell = claimed_cell.get(current)
+                if cell is None:
+                    result = False
+                    break
+                queue.append(current)
+                seen.add(current)
+                current = occupant.get(cell)
+                if current is None:
+                    result = True
+                    break
+            for queued in queue:
+                moves[queued] = result
+
+        moving = []
+        for slot in cars.slots.values():
+            if moves.get(slot):
+                waited[slot] = 0
+                if cars.routes[slot] is not None:
+                    cars.cursors[slot] += 1
+                moving.append((slot, claimed_cell[slot]))
+            else:
+                waited[slot] += 1
+                if slot in proposed:
+                    self.telemetry.blocked_car += 1  # Lost its cell or the car ahead didn't move
+        self.move_cars(moving)
+
+    def place_car(self, cell, goal, route):
+        """
+        Puts a new car in the car store and returns its slot.
+        Args:
+            cell: Cell index where the car starts
+            goal: Index of its destination in city_map.destinations
+            route: Tuple of the cells to its destination (shared, see RouteCache), None to follow the distance fields
+        """
+        serial = self.next_car_serial
+        self.next_car_serial += 1
+        slot = self.cars.add(serial, cell, goal, route, self.step_count)
+        self.telemetry.spawns += 1
+        self.change_log.append((self.step_count, serial))
+        self.occupied[cell] = 1
+        self.signal_controller.car_entered(cell, self.step_count)
+        return slot
+
+    def move_car(self, slot, cell):
+        """Moves the car in slot to another cell."""
+        cars = self.cars
+        old_cell = cars.cells[slot]
+        self.occupied[old_cell] = 0
+        self.occupied[cell] = 1
+        cars.cells[slot] = cell
+        cars.travelled[slot] += 1
+        self.telemetry.moves += 1
+        self.signal_controller.car_left(old_cell, self.step_count)
+        self.change_log.append((self.step_count, cars.serials[slot]))
+        self.signal_controller.car_entered(cell, self.step_count)
+
+    def move_cars(self, moves):
+        """Moves many cars at once, a car can move into the cell another one leaves. moves is a list of (slot, cell)."""
+        cars = self.cars
+        for slot, cell in moves:
+            old_cell = cars.cells[slot]
+            self.occupied[old_cell] = 0
+            self.signal_controller.car_left(old_cell, self.step_count)
+        self.telemetry.moves += len(moves)
+        for slot, cell in moves:
+            cars.cells[slot] = cell
+            cars.travelled[slot] += 1
+            self.occupied[cell] = 1
+            self.change_log.append((self.step_count, cars.serials[slot]))
+            self.signal_controller.car_entered(cell, self.step_count)
+
+    def arrive(self, slot):
+        """Takes the car in slot out of the model, counting its trip."""
+        cars = self.cars
+        spawn_step = cars.spawn_steps[slot]
+        self.total_arrived += 1
+        self.total_travel_time += self.step_count - spawn_step
+        self.telemetry.arrivals += 1
+        self.telemetry.trip(cars.serials[slot], spawn_step, self.step_count, cars.travelled[slot])
+        self.remove_car(slot)
+
+    def remove_car(self, slot):
+        """Takes a car out of the simulation, its slot is reused by the next car."""
+        cell = self.cars.cells[slot]
+        self.occupied[cell] = 0
+        self.signal_controller.car_left(cell, self.step_count)
+        self.change_log.append((self.step_count, self.cars.serials[slot]))
+        self.cars.remove(slot)
+
+    def car_changes(self, since=None):
+        """
+        Returns the cars that changed after the step since.
+        Returns (step, full, added, moved, removed): added and moved are lists of (id, pos) and removed
+        a list of ids. When since is None, older than the kept history or ahead of step_count (a client
+        of a model that was initialized again or restored to an earlier step), full is True and every
+        car is returned as added.
+        """
+        if since is None or since < self.history_start or since > self.step_count:
+            return self.step_count, True, self.car_positions(), [], []
 
-        # Every 10 steps, create a new car in each available corner
-        if self.step_count % 10 == 0:
-            self.create_cars_in_corners()
+        added, moved, removed = [], [], []
+        seen = set()
+        for step, car_id in reversed(self.change_log):
+            if step <= since:
+                break
+            if car_id in seen:
+                continue
+            seen.add(car_id)
+            slot = self.cars.slots.get(car_id)
+            if slot is None:
+                removed.append(car_id)
+            elif self.cars.spawn_steps[slot] > since:
+                added.append((car_id, self.road_graph.position(self.cars.cells[slot])))
+            else:
+                moved.append((car_id, self.road_graph.position(self.cars.cells[slot])))
+        return self.step_count, False, added, moved, removed
+
+    def invalidate_routes(self, city_map=None):
+        """
+        Rebuilds the road graph, forgets the cached routes and routes the cars with a route again.
+        Call it after adding or removing roads or obstacles, either on the grid (with static_agents)
+        or by passing the new map in city_map. The new map must have the same size, destinations
+        and traffic lights, the cars, corners and lights of the model depend on them.
+        """
+        if city_map is not None:
+            old_map = self.city_map
+            if (city_map.width, city_map.height) != (old_map.width, old_map.height):
+                raise ValueError("The new map must have the same size")
+            if list(city_map.destinations) != list(old_map.destinations):
+                raise ValueError("The new map must have the same destinations")
+            if [light[:2] for light in city_map.lights] != [light[:2] for light in old_map.lights]:
+                raise ValueError("The new map must have the same traffic lights")
+            self.city_map = city_map
+            self.road_graph = city_map.road_graph()
+        elif self.static_agents:
+            self.road_graph = RoadGraph.from_grid(self.grid)
+        else:
+            self.road_graph = self.city_map.road_graph()
+        if self.hierarchy is not None:
+            # Contracting in the previous order is much cheaper than choosing a new one
+            self.hierarchy = self.hierarchy.rebuild(self.road_graph)
+            self.route_cache.invalidate(self.road_graph, self.hierarchy.shortest_path)
+        else:
+            self.route_cache.invalidate(self.road_graph)
+        if self.distance_fields is not None:
+            self.distance_fields = DistanceFields(self.road_graph)
+        self.goal_fields = self.build_goal_fields()
+
+        # Live cars go on from where they are, the rest of their old route may be gone
+        cars = self.cars
+        destinations = self.city_map.destinations
+        for slot in cars.slots.values():
+            if cars.routes[slot] is not None:
+                cars.routes[slot] = self.route_cache.get_route(self.road_graph.position(cars.cells[slot]),
+                                                               destinations[cars.goals[slot]][1])
+                cars.cursors[slot] = 0
+
+    def build_goal_fields(self):
+        """Distance field of every destination, in the order of city_map.destinations (None without distance fields)."""
+        if self.distance_fields is None:
+            return None
+        return [self.distance_fields.fields[pos] for _, pos in self.city_map.destinations]
+
+    def count_blocked(self, cells):
+        """Counts a car that can't move to any of the cells: blocked by a car if one is there, by a light otherwise."""
+        if any(self.occupied[cell] for cell in cells):
+            self.telemetry.blocked_car += 1
+        else:
+            self.telemetry.blocked_light += 1
 
     def create_cars_in_corners(self):
         """
         Creates a new car in each available corner.
         """
-        for corner in self.corners:
-            cell_agents = self.grid.get_cell_list_contents([corner])
-            occupied = any(isinstance(agent, Car) for agent in cell_agents)
-
-            if not occupied:
-                # Create a new car
-                car_id = f"car_{self.step_count //10}_{corner}"
-                car = Car(car_id, self, corner)
-                self.grid.place_agent(car, corner)
-                self.schedule.add(car)
-            #     print(f"Se creó un nuevo coche: {car_id} en {corner}")
+        destinations = self.city_map.destinations
+        if not destinations:
+            print("No hay destinos disponibles para asignar.")
+            return
+        for corner, cell in zip(self.corners, self.corner_cells):
+            if not self.occupied[cell]:
+                # Create a new car with a random destination
+                goal = self.random.randrange(len(destinations))
+                route = None
+                if self.routing != "field":
+                    with self.profiler.phase("routing"):
+                        route = self.route_cache.get_route(corner, destinations[goal][1])
+                self.place_car(cell, goal, route)
+            #     print(f"Se creó un nuevo coche en {corner}")
             # else:
-            #     print(f"Esquina {corner} ya está ocupada. No se puede crear un coche aquí.")
\ No newline at end of file
+            #     print(f"Esquina {corner} ya está ocupada. No se puede crear un coche aquí.")
+
+    def car_positions(self):
+        """Returns (id, pos) for every car in the simulation."""
+        cells = self.cars.cells
+        position = self.road_graph.position
+        return [(serial, position(cells[slot])) for serial, slot in self.cars.slots.items()]
+
+    def frame_arrays(self):
+        """
+        Returns the state of the cars and lights as flat arrays that can be sent as they are:
+        car serials (little endian uint32), car positions as x, y, z triples (little endian float32,
+        y is always 1) and light states in the order of traffic_light_states (uint8).
+        """
+        serials = array("I", self.cars.slots)
+        positions = array("f")
+        cells = self.cars.cells
+        for slot in self.cars.slots.values():
+            x, z = divmod(cells[slot], self.height)
+            positions.extend((x, 1, z))
+        if sys.byteorder == "big":
+            serials.byteswap()
+            positions.byteswap()
+        states = array("B", self.signal_controller.states)
+        return serials, positions, states
+
+    def snapshot(self):
+        """
+        Returns the complete state of the model as a compact snapshot (see snapshot.py).
+        CityModel.restore(snapshot) gives a model that continues exactly like this one.
+        """
+        store = self.cars
+        cars = []
+        for serial, slot in store.slots.items():
+            route = store.route_left(slot)
+            cars.append([serial, store.cells[slot], store.goals[slot], None if route is None else list(route),
+                         store.spawn_steps[slot], store.waited[slot], store.travelled[slot]])
+        return dump_snapshot({
+            "engine": "mesa",
+            "params": snapshot_params(self.params),
+            "step_count": self.step_count,
+            "steps": self.steps,
+            "total_arrived": self.total_arrived,
+            "total_travel_time": self.total_travel_time,
+            "next_car_serial": self.next_car_serial,
+            "random": self.random.getstate(),
+            # In the order of the store, which is the order that the random update shuffles
+            "cars": cars,
+            "signals": self.signal_controller.state(),
+            "telemetry": self.telemetry.state()})
+
+    @classmethod
+    def from_state(cls, state, telemetry_file=None):
+        """
+        Creates a model from the state of a snapshot (already read with load_snapshot).
+        The telemetry file is not part of the snapshot, every restored model can have its own.
+        """
+        model = cls(5, **restore_params(state), telemetry_file=telemetry_file)
+
+        # Drop the cars created by the constructor
+        model.cars = CarStore()
+        model.occupied[:] = bytes(len(model.occupied))
+
+        model.step_count = state["step_count"]
+        model.steps = state["steps"]
+        model.total_arrived = state["total_arrived"]
+        model.total_travel_time = state["total_travel_time"]
+        model.next_car_serial = state["next_car_serial"]
+
+        for serial, cell, goal, route, spawn_step, waited, travelled in state["cars"]:
+            model.cars.add(serial, cell, goal, None if route is None else tuple(route), spawn_step,
+                           travelled=travelled, waited=waited)
+            model.occupied[cell] = 1
+
+        model.signal_controller.load_state(state["signals"])
+        for agent, cell, light_state in zip(model.traffic_lights, model.light_cells, model.signal_controller.states):
+            agent.state = bool(light_state)
+            model.red[cell] = not light_state
+        model.telemetry.load_state(state["telemetry"])
+
+        # Clients that ask for changes get every car again
+        model.change_log.clear()
+        model.history_start = model.step_count
+
+        version, internal, gauss_next = state["random"]
+        model.random.setstate((version, tuple(internal), gauss_next))
+        return model
+
+    def traffic_light_states(self):
+        """Returns (id, pos, state) for every traffic light."""
+        return [(light_id, pos, bool(state))
+                for (light_id, pos, _, _), state in zip(self.city_map.lights, self.signal_controller.states)]
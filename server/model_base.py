@@ -0,0 +1,60 @@
+# model_base.py
+
+from snapshot import load_snapshot
+
+class CityModelMixin:
+    """
+    Methods shared by every engine (CityModel, ArrayCityModel and TiledCityModel).
+    They only use what every engine has: city_map, signal_controller, telemetry, profiler and step_count.
+    """
+    def advance(self, steps):
+        """Advance the model a number of steps."""
+        for _ in range(steps):
+            self.step()
+
+    def static_layer(self):
+        """Returns the static layer of the map (see CityMap.static_layer), built only once."""
+        return self.city_map.static_layer
+
+    def static_version(self):
+        """Version of the static layer, to know if a client already has it."""
+        return self.city_map.static_layer["version"]
+
+    def signal_states(self):
+        """Returns the state of every light, in the order of the static layer (1 is green)."""
+        return list(self.signal_controller.states)
+
+    def signal_stats(self):
+        """Returns the queue and delay stats of every junction (see SignalController.junction_stats)."""
+        return self.signal_controller.junction_stats(self.step_count)
+
+    def telemetry_window(self, since=None):
+        """Returns the telemetry steps and trips after the step since (see Telemetry.window)."""
+        return self.telemetry.window(since)
+
+    def set_profiling(self, enabled=None, sampling=None):
+        """Turns the phase timers and the sampling profiler on or off (None leaves them as they are)."""
+        if enabled is not None:
+            self.profiler.enable(enabled)
+        if sampling is not None:
+            if sampling:
+                self.profiler.start_sampling()
+            else:
+                self.profiler.stop_sampling()
+
+    def profile_stats(self):
+        """Returns the phase times of the model (see Profiler.stats)."""
+        return self.profiler.stats()
+
+    def profile_folded(self):
+        """Returns the stacks of the sampling profiler in folded format (see Profiler.folded)."""
+        return self.profiler.folded()
+
+    def close(self):
+        """Closes the telemetry file, the model doesn't write it anymore."""
+        self.telemetry.close()
+
+    @classmethod
+    def restore(cls, snapshot, telemetry_file=None):
+        """Creates a model from a snapshot taken with snapshot(), appending its telemetry to telemetry_file (optional)."""
+        return cls.from_state(load_snapshot(snapshot), telemetry_file)
@@ -0,0 +1,162 @@
+# profiling.py
+"""
+Opt-in instrumentation of the hot paths.
+
+Code that wants to be measured wraps a phase in `with profiler.phase("name"):`. While the profiler
+is disabled, phase() returns a shared context manager that does nothing, so the cost is a method
+call. When it is enabled, every phase adds its calls and wall time to the totals and to the
+current step, and the last STEP_HISTORY steps are kept. Phases can be nested (spawn includes
+routing), and their times are inclusive. Each thread has its own current step, so threads that
+are measured at the same time (the requests of the server) don't mix their phases.
+
+The sampling profiler is a thread that looks at the stack of every other thread of the process
+every interval seconds. folded() returns the stacks in the format of flamegraph.pl and speedscope:
+one line per stack, "outer;inner;innermost count".
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import nullcontext
+
+# Steps whose phase times are kept
+STEP_HISTORY = 100
+# Seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# Different stacks kept by the sampling profiler, the rest are counted together
+MAX_STACKS = 5000
+
+NULL_PHASE = nullcontext()
+
+class PhaseTimer:
+    """Measures one run of a phase."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Sampler:
+    """Thread that counts the stacks of the other threads of the process."""
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                if key not in self.counts and len(self.counts) >= MAX_STACKS:
+                    key = "[other stacks]"
+                self.counts[key] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Profiler:
+    """Phase timers of a model (or of the server), disabled until enable() is called."""
+    def __init__(self):
+        self.enabled = False
+        self.sampler = None
+        # Guards the totals and the history, shared by every thread
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets every measure."""
+        with self.lock:
+            self.totals = {}  # name -> [calls, seconds]
+            self.history = deque(maxlen=STEP_HISTORY)
+            # Phases of the current step, per thread
+            self.local = threading.local()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def phase(self, name):
+        """Context manager that measures a phase, or does nothing if the profiler is disabled."""
+        if not self.enabled:
+            return NULL_PHASE
+        return PhaseTimer(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            total = self.totals.get(name)
+            if total is None:
+                total = self.totals[name] = [0, 0.0]
+            total[0] += 1
+            total[1] += seconds
+        phases = self.local.__dict__.setdefault("phases", {})
+        current = phases.get(name)
+        if current is None:
+            current = phases[name] = [0, 0.0]
+        current[0] += 1
+        current[1] += seconds
+
+    def end_step(self, step):
+        """Closes the phases of a step (measured in the calling thread)."""
+        phases = self.local.__dict__.get("phases")
+        if phases:
+            self.local.phases = {}
+            with self.lock:
+                self.history.append((step, phases))
+
+    def start_sampling(self, interval=SAMPLE_INTERVAL):
+        """Starts the sampling profiler (the previous samples are dropped)."""
+        self.stop_sampling()
+        self.sampler = Sampler(interval)
+
+    def stop_sampling(self):
+        """Stops the sampling profiler, its samples are kept until it starts again."""
+        if self.sampler is not None and not self.sampler.stopped.is_set():
+            self.sampler.stop()
+
+    @property
+    def sampling(self):
+        return self.sampler is not None and not self.sampler.stopped.is_set()
+
+    def folded(self):
+        """Stacks counted by the sampling profiler, one "frame;frame;frame count" line per stack."""
+        if self.sampler is None:
+            return ""
+        return "".join(f"{stack} {count}\n" for stack, count in self.sampler.counts.most_common())
+
+    def stats(self):
+        """Returns the totals and the recent steps of every phase, in milliseconds."""
+        def phases(values):
+            return {name: {"calls": calls, "total_ms": seconds * 1000, "mean_ms": seconds * 1000 / calls}
+                    for name, (calls, seconds) in values.items()}
+
+        with self.lock:
+            totals = phases(self.totals)
+            history = list(self.history)
+        return {
+            "enabled": self.enabled,
+            "sampling": self.sampling,
+            "samples": self.sampler.samples if self.sampler is not None else 0,
+            "phases": totals,
+            "steps": [dict(step=step, phases=phases(values)) for step, values in history]}
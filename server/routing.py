@@ -0,0 +1,508 @@
+# routing.py
+
+import heapq  # Import heapq for A* implementation
+from array import array
+from collections import deque
+from functools import cached_property
+
+# Kinds of static cells found in the map
+ROAD = "road"
+TRAFFIC_LIGHT = "traffic_light"
+OBSTACLE = "obstacle"
+DESTINATION = "destination"
+
+# Distance of the cells from where a destination can't be reached
+UNREACHABLE = -1
+
+# Cells a witness search of the contraction hierarchy settles before giving up
+WITNESS_SETTLED = 50
+
+# Moore neighbourhood offsets (every cell around the current one)
+MOORE_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def direction_allows(direction, dx, dy):
+    """
+    Checks if a move of (dx, dy) follows the direction of a road.
+    Unknown directions do not restrict the movement.
+    """
+    directions = {
+        "Left": dx < 0,
+        "Right": dx > 0,
+        "Up": dy > 0,
+        "Down": dy < 0,
+        "Vertical": dx == 0,
+        "Horizontal": dy == 0
+    }
+    return directions.get(direction, True)
+
+
+class RoadGraph:
+    """
+    Directed graph of the moves a car can make on the static map.
+    It is built once per map and shared by every car, so routing never has to look at the grid.
+    """
+    def __init__(self, width, height, cells):
+        """
+        Creates the graph.
+        Args:
+            width: Width of the map
+            height: Height of the map
+            cells: Dictionary {pos: (kind, direction)} with the static cells of the map
+        """
+        self.width = width
+        self.height = height
+        self.destinations = sorted(pos for pos, (kind, _) in cells.items() if kind == DESTINATION)
+        # successors[i] holds the cells a car can move to from cell i
+        self.successors = [self._build_successors(pos, cells) for pos in self.positions()]
+
+    @classmethod
+    def from_packed(cls, width, height, destinations, offsets, targets):
+        """
+        Creates the graph from successors already packed by pack_successors (for example read from
+        a compiled map), without looking at any cell.
+        """
+        graph = cls.__new__(cls)
+        graph.width = width
+        graph.height = height
+        graph.destinations = sorted(destinations)
+        graph.successors = PackedSuccessors(offsets, targets)
+        return graph
+
+    def pack_successors(self):
+        """
+        Returns the successors as two flat uint32 arrays (offsets, targets):
+        the successors of cell i are targets[offsets[i]:offsets[i + 1]].
+        """
+        offsets = array("I", [0])
+        targets = array("I")
+        for successors in self.successors:
+            targets.extend(successors)
+            offsets.append(len(targets))
+        return offsets, targets
+
+    @cached_property
+    def predecessors(self):
+        """predecessors[i] holds the cells from where a car can move to cell i (only built if needed)."""
+        predecessors = [[] for _ in range(self.width * self.height)]
+        for cell, successors in enumerate(self.successors):
+            for successor in successors:
+                predecessors[successor].append(cell)
+        return [tuple(cells) for cells in predecessors]
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Builds the graph from the static agents placed on a Mesa grid."""
+        # Imported here to avoid a circular import with agent.py
+        from agent import Road, Traffic_Light, Obstacle, Destination
+
+        cells = {}
+        for content, pos in grid.coord_iter():
+            for agent in content:
+                if isinstance(agent, Road):
+                    cells[pos] = (ROAD, agent.direction)
+                elif isinstance(agent, Traffic_Light):
+                    cells[pos] = (TRAFFIC_LIGHT, None)
+                elif isinstance(agent, Obstacle):
+                    cells[pos] = (OBSTACLE, None)
+                elif isinstance(agent, Destination):
+                    cells[pos] = (DESTINATION, None)
+        return cls(grid.width, grid.height, cells)
+
+    def index(self, pos):
+        """Converts a grid position into a cell index (column major, like the Mesa grid)."""
+        return pos[0] * self.height + pos[1]
+
+    def position(self, index):
+        """Converts a cell index into a grid position."""
+        return divmod(index, self.height)
+
+    def positions(self):
+        """Iterates over every position of the map, in index order."""
+        for x in range(self.width):
+            for y in range(self.height):
+                yield (x, y)
+
+    def _build_successors(self, pos, cells):
+        x, y = pos
+        kind, direction = cells.get(pos, (None, None))
+
+        # Destinations are the end of a trip, cars never drive through them
+        if kind in (OBSTACLE, DESTINATION):
+            return ()
+
+        successors = []
+        for dx, dy in MOORE_OFFSETS:
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < self.width and 0 <= ny < self.height):
+                continue
+            next_kind, next_direction = cells.get((nx, ny), (None, None))
+            if next_kind == OBSTACLE:
+                continue
+            # Only roads restrict the movement, both the current one and the next one
+            if kind == ROAD:
+                if not direction_allows(direction, dx, dy):
+                    continue
+                if next_kind == ROAD and not direction_allows(next_direction, dx, dy):
+                    continue
+            successors.append(nx * self.height + ny)
+        return tuple(successors)
+
+    def heuristic(self, a, b):
+        """Calculate the Manhattan distance between two cell indexes a and b."""
+        ax, ay = divmod(a, self.height)
+        bx, by = divmod(b, self.height)
+        return abs(ax - bx) + abs(ay - by)
+
+    def a_star_search(self, start, goal):
+        """
+        Finds a route between two positions with A* (Manhattan heuristic).
+        Returns the list of positions from start (excluded) to goal, or [] if there is no route.
+        """
+        start = self.index(start)
+        goal = self.index(goal)
+        successors = self.successors
+
+        open_set = []
+        heapq.heappush(open_set, (0, start))
+        came_from = {}
+        g_score = {start: 0}
+
+        while open_set:
+            current = heapq.heappop(open_set)[1]
+
+            if current == goal:
+                # Reconstruct path
+                path = []
+                while current in came_from:
+                    path.append(self.position(current))
+                    current = came_from[current]
+                path.reverse()
+                return path
+
+            tentative_g_score = g_score[current] + 1  # Assuming cost=1 for movement
+            for neighbor in successors[current]:
+                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    heapq.heappush(open_set, (tentative_g_score + self.heuristic(neighbor, goal), neighbor))
+
+        return []  # No path found
+
+
+class ContractionHierarchy:
+    """
+    Index of a road graph for fast shortest paths on big maps.
+    Every cell is contracted in order of importance: it is taken out of the graph, and a shortcut
+    (with the length of the two moves) is added between a predecessor and a successor when the
+    only shortest path between them went through the cell. A query is then a search from the start
+    and another from the goal (backwards), both only going up in the order, which meet after
+    settling a few hundred cells even on maps where A* looks at most of the grid.
+    """
+    def __init__(self, graph, order=None):
+        """
+        Contracts a road graph.
+        Args:
+            graph: RoadGraph of the map
+            order: Contraction order of the cells (the order of a previous hierarchy). Without it
+                the order is chosen while contracting, which is slower.
+        """
+        self.graph = graph
+        n_cells = len(graph.successors)
+        if order is not None and len(order) != n_cells:
+            order = None
+
+        successors = [dict.fromkeys(cells, 1) for cells in graph.successors]
+        predecessors = [dict.fromkeys(cells, 1) for cells in graph.predecessors]
+        for cell in range(n_cells):
+            # Waiting in place is never part of a shortest path
+            successors[cell].pop(cell, None)
+            predecessors[cell].pop(cell, None)
+
+        # middle[(a, b)] is the cell a shortcut from a to b skips
+        self.middle = {}
+        self.upward = [()] * n_cells
+        self.downward = [()] * n_cells
+        contracted = bytearray(n_cells)
+        contracted_neighbours = [0] * n_cells
+        self.order = array("I")
+
+        def contract(cell):
+            for a, b, length in self._shortcuts(cell, successors, predecessors):
+                if successors[a].get(b, length + 1) <= length:
+                    continue
+                successors[a][b] = length
+                predecessors[b][a] = length
+                self.middle[(a, b)] = cell
+            contracted[cell] = 1
+            self.order.append(cell)
+            # What is left of its edges goes to cells contracted later (upper in the order)
+            self.upward[cell] = tuple(successors[cell].items())
+            self.downward[cell] = tuple(predecessors[cell].items())
+            for neighbour in successors[cell]:
+                del predecessors[neighbour][cell]
+                contracted_neighbours[neighbour] += 1
+            for neighbour in predecessors[cell]:
+                del successors[neighbour][cell]
+                contracted_neighbours[neighbour] += 1
+
+        if order is not None:
+            for cell in order:
+                contract(cell)
+            return
+
+        def priority(cell):
+            # Edge difference, plus the neighbours already contracted to spread the contraction over the map
+            added = len(self._shortcuts(cell, successors, predecessors))
+            return added - len(successors[cell]) - len(predecessors[cell]) + contracted_neighbours[cell]
+
+        queue = [(priority(cell), cell) for cell in range(n_cells)]
+        heapq.heapify(queue)
+        while queue:
+            _, cell = heapq.heappop(queue)
+            if contracted[cell]:
+                continue
+            # Lazy update: the priority may have grown since it was pushed
+            current = priority(cell)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, cell))
+                continue
+            contract(cell)
+
+    @staticmethod
+    def _shortcuts(cell, successors, predecessors, max_settled=WITNESS_SETTLED):
+        """
+        Shortcuts (a, b, length) needed to contract a cell: one for every predecessor a and successor b
+        that aren't joined by a path of the same length or shorter that avoids the cell (a witness).
+        The witness search gives up after max_settled cells, adding a shortcut that may not be needed.
+        """
+        shortcuts = []
+        outgoing = successors[cell]
+        if not outgoing:
+            return shortcuts
+        longest_out = max(outgoing.values())
+        for a, to_cell in predecessors[cell].items():
+            targets = {b: to_cell + length for b, length in outgoing.items() if b != a}
+            if not targets:
+                continue
+            limit = to_cell + longest_out
+            distances = {a: 0}
+            queue = [(0, a)]
+            settled = 0
+            while queue and settled < max_settled:
+                distance, current = heapq.heappop(queue)
+                if distance > distances[current]:
+                    continue
+                if distance > limit:
+                    break
+                settled += 1
+                for successor, length in successors[current].items():
+                    if successor == cell:
+                        continue
+                    new_distance = distance + length
+                    if new_distance <= limit and new_distance < distances.get(successor, new_distance + 1):
+                        distances[successor] = new_distance
+                        heapq.heappush(queue, (new_distance, successor))
+            for b, length in targets.items():
+                if distances.get(b, length + 1) > length:
+                    shortcuts.append((a, b, length))
+        return shortcuts
+
+    def shortest_path(self, start, goal):
+        """
+        Finds a shortest route between two positions.
+        Returns the list of positions from start (excluded) to goal, or [] if there is no route (like RoadGraph.a_star_search).
+        """
+        start = self.graph.index(start)
+        goal = self.graph.index(goal)
+        if start == goal:
+            return []
+
+        forward = {start: 0}
+        backward = {goal: 0}
+        forward_parent = {}
+        backward_parent = {}
+        forward_queue = [(0, start)]
+        backward_queue = [(0, goal)]
+        best = float("inf")
+        meeting = None
+        upward, downward = self.upward, self.downward
+
+        while forward_queue or backward_queue:
+            # Advance the search with the closest cell; a search stops when it can't improve the best route
+            if forward_queue and (not backward_queue or forward_queue[0][0] <= backward_queue[0][0]):
+                distance, current = heapq.heappop(forward_queue)
+                if distance >= best:
+                    forward_queue = []
+                    continue
+                distances, queue, parents, edges, stall_edges, other = forward, forward_queue, forward_parent, upward, downward, backward
+            else:
+                distance, current = heapq.heappop(backward_queue)
+                if distance >= best:
+                    backward_queue = []
+                    continue
+                distances, queue, parents, edges, stall_edges, other = backward, backward_queue, backward_parent, downward, upward, forward
+            if distance > distances[current]:
+                continue
+            if current in other and distance + other[current] < best:
+                best = distance + other[current]
+                meeting = current
+            # Stall on demand: a cell reached more cheaply through an upper cell isn't on a shortest path
+            if any(distances.get(upper, best) + length < distance for upper, length in stall_edges[current]):
+                continue
+            for neighbour, length in edges[current]:
+                new_distance = distance + length
+                if new_distance < distances.get(neighbour, new_distance + 1):
+                    distances[neighbour] = new_distance
+                    parents[neighbour] = current
+                    heapq.heappush(queue, (new_distance, neighbour))
+
+        if meeting is None:
+            return []
+
+        # Edges of the route in the hierarchy, with their shortcuts
+        edges = []
+        cell = meeting
+        while cell in forward_parent:
+            edges.append((forward_parent[cell], cell))
+            cell = forward_parent[cell]
+        edges.reverse()
+        cell = meeting
+        while cell in backward_parent:
+            edges.append((cell, backward_parent[cell]))
+            cell = backward_parent[cell]
+
+        path = []
+        stack = edges[::-1]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middle.get((a, b))
+            if middle is None:
+                path.append(self.graph.position(b))
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return path
+
+    def rebuild(self, graph):
+        """
+        Returns the hierarchy of a changed road graph of the same map, contracting it in the order
+        of this one. The order stays good after small changes, and reusing it skips choosing it.
+        """
+        return ContractionHierarchy(graph, self.order)
+
+
+class PackedSuccessors:
+    """
+    Read-only list of successors stored in two flat arrays (see RoadGraph.pack_successors).
+    The arrays can be memoryviews of a memory-mapped file, so nothing is read until it is used.
+    """
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return tuple(self.targets[self.offsets[index]:self.offsets[index + 1]])
+
+    def __iter__(self):
+        offsets, targets = self.offsets, self.targets
+        for index in range(len(offsets) - 1):
+            yield tuple(targets[offsets[index]:offsets[index + 1]])
+
+
+class RouteCache:
+    """
+    Remembers the routes already found on a road graph.
+    Cars only spawn in a few places and go to a few destinations, so most routes repeat.
+    """
+    def __init__(self, graph, search=None):
+        """
+        Creates an empty cache.
+        Args:
+            graph: RoadGraph used to find the routes that are not cached yet
+            search: Function (start, goal) -> route used instead of the A* of the graph (optional)
+        """
+        self.graph = graph
+        self.search = search
+        self.routes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_route(self, start, goal):
+        """
+        Returns the route from start to goal as a tuple of cell indexes, searching it only the first time.
+        The tuple is shared by every car that makes the same trip, cars keep a cursor into it.
+        """
+        route = self.routes.get((start, goal))
+        if route is None:
+            self.misses += 1
+            search = self.search or self.graph.a_star_search
+            index = self.graph.index
+            route = tuple(index(pos) for pos in search(start, goal))
+            self.routes[(start, goal)] = route
+        else:
+            self.hits += 1
+        return route
+
+    def invalidate(self, graph=None, search=None):
+        """
+        Forgets every cached route. Must be called whenever roads or obstacles change.
+        Args:
+            graph: New road graph to use from now on (optional)
+            search: New search function to use from now on (optional)
+        """
+        if graph is not None:
+            self.graph = graph
+        if search is not None:
+            self.search = search
+        self.routes.clear()
+
+
+def backward_search(graph, goal):
+    """
+    Breadth first search from the cell goal following the moves backwards (every move costs 1).
+    Returns the number of moves from each cell of the graph to goal (array of ints), or UNREACHABLE.
+    """
+    predecessors = graph.predecessors
+    distances = array("i", [UNREACHABLE]) * len(predecessors)
+    distances[goal] = 0
+    queue = deque([goal])
+    while queue:
+        current = queue.popleft()
+        distance = distances[current] + 1
+        for previous in predecessors[current]:
+            if distances[previous] == UNREACHABLE:
+                distances[previous] = distance
+                queue.append(previous)
+    return distances
+
+
+class DistanceFields:
+    """
+    For every destination, the number of moves needed to reach it from each cell of the map.
+    A car only has to look at the fields of its neighbours to know where to go next.
+    """
+    def __init__(self, graph):
+        """
+        Computes the field of every destination of the graph.
+        Args:
+            graph: RoadGraph of the map
+        """
+        self.graph = graph
+        self.fields = {goal: backward_search(graph, graph.index(goal)) for goal in graph.destinations}
+
+    def distance(self, pos, goal):
+        """Number of moves from pos to goal, or UNREACHABLE."""
+        return self.fields[goal][self.graph.index(pos)]
+
+    def next_moves(self, pos, goal):
+        """Positions next to pos that are one move closer to goal."""
+        field = self.fields[goal]
+        current = self.graph.index(pos)
+        if field[current] == UNREACHABLE:
+            return []
+        closer = field[current] - 1
+        return [self.graph.position(cell) for cell in self.graph.successors[current] if field[cell] == closer]
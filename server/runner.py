@@ -0,0 +1,115 @@
+# runner.py
+"""
+Background stepping: a thread advances a model at a fixed tick rate (or as fast as it can) and
+publishes a frame after every tick, so the simulation doesn't wait for the browser.
+
+Every viewer reads the last published frame. A viewer that is slower than the simulation skips
+the frames it missed instead of queueing them, so it never holds the runner back, and a frame is
+built once no matter how many viewers there are.
+"""
+
+import threading
+import time
+
+# Seconds a viewer waits for a new frame before it gets None (to send a keep alive)
+KEEPALIVE_INTERVAL = 15
+
+class FrameChannel:
+    """Last frame of a runner, shared by all its viewers."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.closed = False
+
+    def publish(self, frame):
+        """Replaces the last frame and wakes every viewer."""
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """Ends the frames() of every viewer."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def frames(self, keepalive=KEEPALIVE_INTERVAL):
+        """
+        Yields the frames published from now on (starting with the last one, if any) until the
+        channel is closed. Frames published while the viewer was busy are coalesced into the newest
+        one. Yields None when nothing was published in keepalive seconds.
+        """
+        seen = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.sequence != seen, keepalive)
+                if self.closed:
+                    return
+                if self.sequence == seen:
+                    frame = None
+                else:
+                    seen = self.sequence
+                    frame = self.frame
+            yield frame
+
+
+class BackgroundRunner:
+    """
+    Thread that calls advance(steps_per_tick) tick_rate times per second and publishes what it returns.
+    """
+    def __init__(self, advance, tick_rate=None, steps_per_tick=1):
+        """
+        Creates and starts the runner.
+        Args:
+            advance: Function that advances the model a number of steps and returns the frame to publish
+            tick_rate: Ticks per second (None runs as fast as possible)
+            steps_per_tick: Steps the model advances on every tick
+        """
+        self.advance = advance
+        self.tick_rate = tick_rate
+        self.steps_per_tick = steps_per_tick
+        self.channel = FrameChannel()
+        self.ticks = 0
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_tick = time.monotonic()
+        try:
+            while not self.stopped.is_set():
+                self.channel.publish(self.advance(self.steps_per_tick))
+                self.ticks += 1
+                if self.tick_rate:
+                    next_tick += 1 / self.tick_rate
+                    delay = next_tick - time.monotonic()
+                    if delay > 0:
+                        self.stopped.wait(delay)
+                    else:
+                        # Behind schedule: don't run the missed ticks in a burst
+                        next_tick = time.monotonic()
+        except Exception as e:
+            print(e)
+            self.error = e
+        finally:
+            self.stopped.set()
+            self.channel.close()
+
+    @property
+    def running(self):
+        return not self.stopped.is_set()
+
+    def configure(self, tick_rate=None, steps_per_tick=None):
+        """Changes the tick rate (0 or None runs as fast as possible) or the steps per tick of a running runner."""
+        self.tick_rate = tick_rate
+        if steps_per_tick is not None:
+            self.steps_per_tick = steps_per_tick
+
+    def stop(self):
+        """Stops the runner after the current tick and ends the streams of its viewers."""
+        self.stopped.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
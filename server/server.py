@@ -1,93 +1,252 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS, cross_origin
-from model import CityModel, Car, Traffic_Light, Destination, Obstacle, Road
+from sessions import SessionPool, SessionNotFound, TooManySessions, create_model, call_model
+from snapshot import restore_model, load_snapshot, restore_params
+from profiling import Profiler
+from runner import BackgroundRunner
+import atexit
+import itertools
+import json
+import struct
+import threading
 
-# Size of the board:
+# Maximum number of steps that a single /step request can advance
+MAX_STEPS_PER_REQUEST = 1000
+
+# Sessions: worker processes (None = one per core), sessions alive at the same time and seconds before an idle session is evicted
+SESSION_WORKERS = None
+MAX_SESSIONS = 64
+SESSION_IDLE_TIMEOUT = 600
+
+# Model of the clients that don't use sessions
 cityModel = None
+cityModelLock = threading.Lock()
+
+# Pool of worker processes for the sessions, started with the first session
+sessionPool = None
+sessionPoolLock = threading.Lock()
+
+# Background runners (see /run), by session id (None for the global model)
+runners = {}
+runnersLock = threading.Lock()
+
+# Static layers already serialized, by (version, route), so /getMap, /getObstacles and /getDestinations
+# are built once per map and shared by every session and client
+MAX_STATIC_PAYLOADS = 32
+staticPayloads = {}
+staticPayloadsLock = threading.Lock()
+
+# Phase timers of the server itself (model calls and serialization), see /stats.
+# Each request (or frame of a runner) is a step of the profiler, numbered in order.
+serverProfiler = Profiler()
+serverRequests = itertools.count(1)
 
 # This application will be used to interact with WebGL
 app = Flask("Traffic example")
 cors = CORS(app, origins=['http://localhost'])
 
+@app.after_request
+def end_profiled_request(response):
+    serverProfiler.end_step(next(serverRequests))
+    return response
+
+def get_session_pool():
+    global sessionPool
+
+    with sessionPoolLock:
+        if sessionPool is None:
+            sessionPool = SessionPool(SESSION_WORKERS, MAX_SESSIONS, SESSION_IDLE_TIMEOUT)
+            atexit.register(sessionPool.close)
+        return sessionPool
+
+def model_calls(*calls):
+    """
+    Runs method calls (name, *args) on the model of the request and returns their results.
+    Requests with ?session=<id> go to that session, the rest use the global model.
+    """
+    return session_calls(request.args.get('session'), *calls)
+
+def session_calls(session_id, *calls):
+    """Runs method calls (name, *args) on the model of a session (None for the global model)."""
+    with serverProfiler.phase("model_calls"):
+        if session_id is not None:
+            return get_session_pool().call(session_id, *calls)
+        with cityModelLock:
+            return [call_model(cityModel, name, args) for name, *args in calls]
+
+def static_response(route, build):
+    """
+    Answers a route whose content only depends on the static layer of the map. The version of the
+    layer is the ETag: a client that sends it in If-None-Match gets an empty 304, and the payload
+    of every other client is serialized only once per map (build(layer) gives its JSON object).
+    """
+    version, = model_calls(("static_version",))
+    if version in request.if_none_match:
+        response = Response(status=304)
+    else:
+        with staticPayloadsLock:
+            payload = staticPayloads.get((version, route))
+        if payload is None:
+            layer, = model_calls(("static_layer",))
+            with serverProfiler.phase("serialize"):
+                payload = json.dumps(build(layer), separators=(",", ":")).encode()
+            with staticPayloadsLock:
+                if len(staticPayloads) >= MAX_STATIC_PAYLOADS:
+                    # Forget the oldest one
+                    del staticPayloads[next(iter(staticPayloads))]
+                staticPayloads[(version, route)] = payload
+        response = Response(payload, mimetype='application/json')
+    response.set_etag(version)
+    # The client may keep it, but it has to ask if it is still valid (it is, unless the map changed)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def stop_runner(session_id):
+    """Stops and joins the background runner of a session (None for the global model), if there is one."""
+    with runnersLock:
+        runner = runners.pop(session_id, None)
+    if runner is not None:
+        runner.stop()
+    return runner
+
+def replace_global_model(model):
+    """Replaces the model of the clients that don't use sessions, closing the old one (the tiled engine stops its worker processes)."""
+    global cityModel
+
+    with cityModelLock:
+        old, cityModel = cityModel, model
+    if hasattr(old, "close"):
+        old.close()
+
+def session_not_found(e):
+    return jsonify({"message": f"Session {e.args[0]} not found"}), 404
+
+def too_many_sessions(e):
+    # The server is full for now, idle sessions are evicted after SESSION_IDLE_TIMEOUT seconds
+    response = jsonify({"message": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(SESSION_IDLE_TIMEOUT // 4)
+    return response
+
 # This route will be used to send the parameters of the simulation to the server.
 # The servers expects a POST request with the parameters in a.json.
+# With "session": true a new independent simulation is created and its id is returned in "session";
+# the client then sends ?session=<id> in every request. "engine": "numpy" uses the array based model and
+# "engine": "tiled" the multi-process one (only without session, see tiled_model.py).
 @app.route('/init', methods=['POST'])
 @cross_origin()
 def initModel():
-    global cityModel
-
     if request.method == 'POST':
         try:
 
             print(request.json)
 
+            engine = request.json.get("engine", "mesa")
+            if request.json.get("session"):
+                if engine == "tiled":
+                    return jsonify({"message": "The tiled engine can't run in a session"}), 400
+                pool = get_session_pool()
+                session_id = pool.create(engine)
+                width, height = pool.call(session_id, ("width",), ("height",))
+                return jsonify({"message":"Parameters recieved, model initiated.", "session": session_id, "width": width, "height": height})
+
             # Create the model using the parameters sent by the application
-            cityModel = CityModel(5)
+            model = create_model(engine)
+            # The runner of the old model must not keep stepping and streaming it
+            stop_runner(None)
+            replace_global_model(model)
 
             # Return a message to saying that the model was created successfully
-            return jsonify({"message":"Parameters recieved, model initiated.", "width": cityModel.width, "height": cityModel.height})
+            return jsonify({"message":"Parameters recieved, model initiated.", "width": model.width, "height": model.height})
 
+        except TooManySessions as e:
+            return too_many_sessions(e)
         except Exception as e:
             print(e)
             return jsonify({"message":"Erorr initializing the model"}), 500
 
+# This route will be used to end a session
+@app.route('/close', methods=['POST'])
+@cross_origin()
+def closeSession():
+    try:
+        get_session_pool().drop(request.args.get('session'))
+        return jsonify({"message": "Session closed"})
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error closing the session"}), 500
+
 # This route will be used to get the positions of the agents
 @app.route('/getAgents', methods=['GET'])
 @cross_origin()
 def getAgents():
-    global cityModel
-
     if request.method == 'GET':
         # Get the positions of the agents and return them to WebGL in JSON.json.t.
         # Note that the positions are sent as a list of dictionaries, where each dictionary has the id and position of an agent.
         # The y coordinate is set to 1, since the agents are in a 3D world. The z coordinate corresponds to the row (y coordinate) of the grid in mesa.
         try:
-            agentPositions = []
-            for content, (x, z) in cityModel.grid.coord_iter():
-                for agent in content: 
-                    if isinstance(agent, Car):
-                        agentPositions.append({"id": str(agent.unique_id), "x": x, "y": 1, "z": z})
-            return jsonify({'positions': agentPositions})
+            positions, = model_calls(("car_positions",))
+            with serverProfiler.phase("serialize"):
+                agentPositions = []
+                for agent_id, (x, z) in positions:
+                    agentPositions.append({"id": str(agent_id), "x": x, "y": 1, "z": z})
+                return jsonify({'positions': agentPositions})
+        except SessionNotFound as e:
+            return session_not_found(e)
         except Exception as e:
             print(e)
             return jsonify({"message": "Error with agent positions"}), 500
 
 
 
+# This route will be used to get only the cars that changed since the step the client already has.
+# The client sends ?since=<step> (the "step" of its last response) and gets the cars added, moved or removed after it.
+# If "full" is true the client must drop its cars and use "added" as the complete list.
+@app.route('/getAgentChanges', methods=['GET'])
+@cross_origin()
+def getAgentChanges():
+    if request.method == 'GET':
+        try:
+            since = request.args.get('since', type=int)
+            (step, full, added, moved, removed), = model_calls(("car_changes", since))
+            with serverProfiler.phase("serialize"):
+                return jsonify({
+                    'step': step,
+                    'full': full,
+                    'added': [{"id": str(agent_id), "x": x, "y": 1, "z": z} for agent_id, (x, z) in added],
+                    'moved': [{"id": str(agent_id), "x": x, "y": 1, "z": z} for agent_id, (x, z) in moved],
+                    'removed': [str(agent_id) for agent_id in removed]})
+        except SessionNotFound as e:
+            return session_not_found(e)
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Error with agent changes"}), 500
+
 # This route will be used to get the positions of the obstacles
 @app.route('/getObstacles', methods=['GET'])
 @cross_origin()
 def getObstacles():
-    global cityModel
-
     if request.method == 'GET':
         try:
         # Get the positions of the obstacles and return them to WebGL in JSON.json.t.
         # Same as before, the positions are sent as a list of dictionaries, where each dictionary has the id and position of an obstacle.
-            obstaclesPositions = []
-            for a, (x, z) in cityModel.grid.coord_iter(): 
-                for agent in a: 
-                    if isinstance(agent, Obstacle):
-                        obstaclesPositions.append({"id": str(agent.unique_id), "x": x, "y":1, "z":z})
-            return jsonify({'positions':obstaclesPositions})
+            return static_response("obstacles", lambda layer: {'positions': layer["obstacles"]})
+        except SessionNotFound as e:
+            return session_not_found(e)
         except Exception as e:
             print(e)
             return jsonify({"message":"Error with obstacle positions"}), 500
-        
+
 @app.route('/getDestinations', methods=['GET'])
 @cross_origin()
 def getDestinations():
-    global cityModel
-
     if request.method == 'GET':
         try:
-            destinationPositions = []
-            for content, (x, z) in cityModel.grid.coord_iter():
-                for agent in content:
-                    if isinstance(agent, Destination):
-                        destinationPositions.append({
-                            "id": str(agent.unique_id), "x": x, "y": 1, "z": z})
-            return jsonify({'positions': destinationPositions})
+            return static_response("destinations", lambda layer: {'positions': layer["destinations"]})
+        except SessionNotFound as e:
+            return session_not_found(e)
         except Exception as e:
             print(e)
             return jsonify({"message": "Error with destination positions"}), 500
@@ -95,38 +254,296 @@ def getDestinations():
 @app.route('/getTraffic_Light', methods=['GET'])
 @cross_origin()
 def getTraffic_Light():
-    global cityModel
-
     if request.method == 'GET':
         try:
+            lights, = model_calls(("traffic_light_states",))
             traffic_lightPositions = []
-            for content, (x, z) in cityModel.grid.coord_iter():
-                for agent in content:
-                    if isinstance(agent, Traffic_Light):
-                        state = agent.state
-                        traffic_lightPositions.append({
-                            "id": str(agent.unique_id), "x": x, "y": 1, "z": z, "state": state})
+            for agent_id, (x, z), state in lights:
+                traffic_lightPositions.append({
+                    "id": str(agent_id), "x": x, "y": 1, "z": z, "state": state})
             return jsonify({'positions': traffic_lightPositions})
+        except SessionNotFound as e:
+            return session_not_found(e)
         except Exception as e:
             print(e)
             return jsonify({"message": "Error with traffic_light positions"}), 500
-        
+
+# This route will be used to get everything that doesn't change in a single request: the size of the map,
+# the obstacles, the destinations and the traffic lights (without their states, see /getLightStates).
+# The response has an ETag with the version of the map, send it back in If-None-Match to get a 304 if it didn't change.
+@app.route('/getMap', methods=['GET'])
+@cross_origin()
+def getMap():
+    try:
+        return static_response("map", lambda layer: layer)
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error with the map"}), 500
+
+# This route will be used to get the state of every traffic light (1 is green), in the order of the lights of /getMap
+@app.route('/getLightStates', methods=['GET'])
+@cross_origin()
+def getLightStates():
+    try:
+        step, states = model_calls(("step_count",), ("signal_states",))
+        return jsonify({'step': step, 'states': states})
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error with light states"}), 500
+
+# This route will be used to get the queues of the junctions: for each one its lights (indexes in the
+# order of /getTraffic_Light), phase, phase changes, cars queued now, longest queue and delay (car-steps queued)
+@app.route('/getSignalStats', methods=['GET'])
+@cross_origin()
+def getSignalStats():
+    if request.method == 'GET':
+        try:
+            stats, = model_calls(("signal_stats",))
+            return jsonify({'junctions': stats})
+        except SessionNotFound as e:
+            return session_not_found(e)
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Error with signal stats"}), 500
+
+# This route will be used to read the recent telemetry. With ?since=<step> only the steps and trips after it are sent.
+# steps: {step, in_flight, moves, blocked_light, blocked_car, arrivals, spawns}; trips: {car, spawn_step, arrival_step, path_length}
+@app.route('/getTelemetry', methods=['GET'])
+@cross_origin()
+def getTelemetry():
+    if request.method == 'GET':
+        try:
+            window, = model_calls(("telemetry_window", request.args.get('since', type=int)))
+            return jsonify(window)
+        except SessionNotFound as e:
+            return session_not_found(e)
+        except Exception as e:
+            print(e)
+            return jsonify({"message": "Error with telemetry"}), 500
+
 # This route will be used to update the model
 @app.route('/update', methods=['GET'])
 @cross_origin()
 def updateModel():
-    global cityModel
     if request.method == 'GET':
         try:
         # Update the model and return a message to WebGL saying that the model was updated successfully
-            cityModel.step()
+            _, total_arrived = model_calls(("step",), ("total_arrived",))
             return jsonify({'message':f'Model updated',
-                            'total_arrived': cityModel.total_arrived})
+                            'total_arrived': total_arrived})
+        except SessionNotFound as e:
+            return session_not_found(e)
+        except Exception as e:
+            print(e)
+            return jsonify({"message":"Error during step."}), 500
+
+# This route will be used to advance the model and get its state in a single request.
+# Parameters: ?steps=<number of steps, 1 by default>&since=<step>&format=json|binary
+# JSON: {step, total_arrived, full, added, moved, removed, lights}, where the cars are the changes since
+# the given step (like /getAgentChanges) and lights is the list of states in the order of the lights of /getMap.
+# Binary (little endian, whatever the byte order of the server): header "CITY" + uint32 step, total_arrived, cars, lights;
+# then the car serials (uint32), the car positions as x, y, z (float32) and the light states (uint8). Every car is always sent.
+@app.route('/step', methods=['GET'])
+@cross_origin()
+def stepModel():
+    if request.method == 'GET':
+        try:
+            steps = min(max(request.args.get('steps', default=1, type=int), 0), MAX_STEPS_PER_REQUEST)
+
+            if request.args.get('format') == 'binary':
+                _, step, total_arrived, (serials, positions, states) = model_calls(
+                    ("advance", steps), ("step_count",), ("total_arrived",), ("frame_arrays",))
+                with serverProfiler.phase("serialize"):
+                    header = struct.pack('<4sIIII', b'CITY', step, total_arrived, len(serials), len(states))
+                    return Response(header + bytes(serials) + bytes(positions) + bytes(states), mimetype='application/octet-stream')
+
+            _, total_arrived, (step, full, added, moved, removed), lights = model_calls(
+                ("advance", steps), ("total_arrived",), ("car_changes", request.args.get('since', type=int)), ("signal_states",))
+            with serverProfiler.phase("serialize"):
+                return jsonify({
+                    'step': step,
+                    'total_arrived': total_arrived,
+                    'full': full,
+                    'added': [{"id": str(agent_id), "x": x, "y": 1, "z": z} for agent_id, (x, z) in added],
+                    'moved': [{"id": str(agent_id), "x": x, "y": 1, "z": z} for agent_id, (x, z) in moved],
+                    'removed': [str(agent_id) for agent_id in removed],
+                    'lights': [bool(state) for state in lights]})
+        except SessionNotFound as e:
+            return session_not_found(e)
         except Exception as e:
             print(e)
             return jsonify({"message":"Error during step."}), 500
 
+def stream_frame(session_id, steps):
+    """
+    Advances the model of a session (None for the global model) and returns an event of /stream:
+    the JSON of /step with every car in "added".
+    """
+    _, step, total_arrived, positions, lights = session_calls(
+        session_id, ("advance", steps), ("step_count",), ("total_arrived",), ("car_positions",), ("signal_states",))
+    with serverProfiler.phase("serialize"):
+        frame = json.dumps({
+            'step': step,
+            'total_arrived': total_arrived,
+            'full': True,
+            'added': [{"id": str(agent_id), "x": x, "y": 1, "z": z} for agent_id, (x, z) in positions],
+            'moved': [],
+            'removed': [],
+            'lights': [bool(state) for state in lights]}, separators=(",", ":"))
+    # The frames are built in the thread of the runner, not in a request
+    serverProfiler.end_step(next(serverRequests))
+    return f"data: {frame}\n\n"
+
+def runner_status(runner):
+    if runner is None:
+        return {"running": False}
+    return {"running": runner.running, "tick_rate": runner.tick_rate, "steps_per_tick": runner.steps_per_tick, "ticks": runner.ticks}
+
+# This route will be used to run the model in the background, without waiting for /update or /step.
+# POST {"tick_rate": <ticks per second, null = as fast as possible>, "steps_per_tick": 1} starts the runner
+# (or changes its rate if it is already running) and GET returns its status. The frames are read from /stream.
+@app.route('/run', methods=['GET', 'POST'])
+@cross_origin()
+def runModel():
+    session_id = request.args.get('session')
+    try:
+        with runnersLock:
+            runner = runners.get(session_id)
+            if request.method == 'POST':
+                tick_rate = request.json.get("tick_rate")
+                steps_per_tick = min(max(int(request.json.get("steps_per_tick", 1)), 1), MAX_STEPS_PER_REQUEST)
+                if runner is not None and runner.running:
+                    runner.configure(tick_rate, steps_per_tick)
+                else:
+                    # Fails now, instead of in the runner, if the session doesn't exist
+                    model_calls(("step_count",))
+                    runner = runners[session_id] = BackgroundRunner(
+                        lambda steps: stream_frame(session_id, steps), tick_rate, steps_per_tick)
+            return jsonify(runner_status(runner))
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error starting the runner"}), 500
+
+# This route will be used to stop the background runner, the model keeps its state
+@app.route('/pause', methods=['POST'])
+@cross_origin()
+def pauseModel():
+    try:
+        return jsonify(runner_status(stop_runner(request.args.get('session'))))
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error stopping the runner"}), 500
+
+# This route will be used to watch a model run by /run, as Server-Sent Events (EventSource in the browser).
+# Every event is a frame with the JSON of /step and every car. A client slower than the runner gets the
+# newest frame when it is ready, skipping the ones in between, so it never slows the simulation down.
+# The stream ends when the runner is stopped.
+@app.route('/stream', methods=['GET'])
+@cross_origin()
+def streamModel():
+    with runnersLock:
+        runner = runners.get(request.args.get('session'))
+    if runner is None or not runner.running:
+        return jsonify({"message": "The model is not running, start it with /run"}), 404
+
+    def events():
+        for frame in runner.channel.frames():
+            # A comment keeps the connection open while nothing is published
+            yield frame if frame is not None else ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# This route will be used to save the complete state of the model, as a compact binary snapshot
+@app.route('/snapshot', methods=['GET'])
+@cross_origin()
+def snapshotModel():
+    try:
+        snapshot, = model_calls(("snapshot",))
+        return Response(snapshot, mimetype='application/octet-stream',
+                        headers={'Content-Disposition': 'attachment; filename=city.snapshot'})
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error taking the snapshot"}), 500
+
+# This route will be used to continue from a snapshot, sent as the body of the request.
+# Without parameters it replaces the global model, with ?session=<id> the model of that session,
+# and with ?fork=true it creates a new session from the snapshot and returns its id in "session".
+@app.route('/restore', methods=['POST'])
+@cross_origin()
+def restoreModel():
+    try:
+        snapshot = request.get_data()
+        session_id = request.args.get('session')
+        try:
+            # Checked here too, so a bad snapshot is a 400 also when a session worker restores it
+            restore_params(load_snapshot(snapshot))
+        except ValueError as e:
+            return jsonify({"message": f"Invalid snapshot: {e}"}), 400
+        if request.args.get('fork') == 'true':
+            pool = get_session_pool()
+            session_id = pool.create(snapshot=snapshot)
+            step, = pool.call(session_id, ("step_count",))
+            return jsonify({"message": "Model restored", "session": session_id, "step": step})
+        model = None if session_id is not None else restore_model(snapshot)
+        stop_runner(session_id)
+        if session_id is not None:
+            get_session_pool().restore(session_id, snapshot)
+        else:
+            replace_global_model(model)
+        step, = model_calls(("step_count",))
+        return jsonify({"message": "Model restored", "step": step})
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except TooManySessions as e:
+        return too_many_sessions(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error restoring the snapshot"}), 500
+
+# This route will be used to see where the time goes. GET returns the phase times of the model
+# (lights, cars, spawn, routing) and of the server (model_calls, serialize), as totals and per step
+# (for the server, a step is a request or a frame of /run).
+# POST {"enabled": true|false, "sampling": true|false} turns the timers and the sampling profiler on or off.
+@app.route('/stats', methods=['GET', 'POST'])
+@cross_origin()
+def stats():
+    try:
+        if request.method == 'POST':
+            enabled = request.json.get("enabled")
+            if enabled is not None:
+                serverProfiler.enable(enabled)
+            model_calls(("set_profiling", enabled, request.json.get("sampling")))
+        model_stats, = model_calls(("profile_stats",))
+        return jsonify({'model': model_stats, 'server': serverProfiler.stats()})
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error with stats"}), 500
+
+# This route will be used to download the samples of the sampling profiler, in the folded format of flamegraph.pl:
+#     curl localhost:8585/stats/flamegraph > stacks.folded && flamegraph.pl stacks.folded > flamegraph.svg
+@app.route('/stats/flamegraph', methods=['GET'])
+@cross_origin()
+def flamegraph():
+    try:
+        folded, = model_calls(("profile_folded",))
+        return Response(folded, mimetype='text/plain')
+    except SessionNotFound as e:
+        return session_not_found(e)
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Error with flamegraph"}), 500
+
 
 if __name__=='__main__':
     # Run the flask server in port 8585
-    app.run(host="localhost", port=8585, debug=True)
+    app.run(host="localhost", port=8585, debug=True, threaded=True)
@@ -0,0 +1,220 @@
+# sessions.py
+
+import multiprocessing
+import secrets
+import threading
+import time
+from model import CityModel
+from snapshot import restore_model
+
+def create_model(engine="mesa", **kwargs):
+    """
+    Creates a model with the given engine ("mesa", "numpy" or "tiled") and model parameters.
+    Mesa models are created without Road and Obstacle agents, nothing outside the Mesa visualization draws them.
+    """
+    if engine == "numpy":
+        from vector_model import ArrayCityModel  # NumPy is only needed for this engine
+        return ArrayCityModel(5, **kwargs)
+    if engine == "tiled":
+        from tiled_model import TiledCityModel
+        return TiledCityModel(5, **kwargs)
+    kwargs.setdefault("static_agents", False)
+    return CityModel(5, **kwargs)
+
+def call_model(model, name, args):
+    """Calls a method of the model, or reads the attribute if it is not a method."""
+    attribute = getattr(model, name)
+    return attribute(*args) if callable(attribute) else attribute
+
+def _worker_main(conn):
+    """
+    Loop of a worker process. Keeps the models of its sessions and answers the requests
+    (operation, session id, payload) received through the pipe with (ok, result).
+    """
+    models = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        operation, session_id, payload = message
+        try:
+            if operation == "create":
+                models[session_id] = create_model(payload)
+                result = None
+            elif operation == "restore":
+                old = models.get(session_id)
+                models[session_id] = restore_model(payload)
+                if old is not None:
+                    old.close()
+                result = None
+            elif operation == "drop":
+                model = models.pop(session_id, None)
+                if model is not None:
+                    model.close()
+                result = None
+            else:
+                model = models[session_id]
+                result = [call_model(model, name, args) for name, *args in payload]
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, repr(e)))
+
+
+class SessionNotFound(KeyError):
+    """The session doesn't exist or was evicted."""
+
+
+class SessionError(RuntimeError):
+    """The model of a session raised an error."""
+
+
+class TooManySessions(SessionError):
+    """The pool already has max_sessions sessions."""
+
+
+class Worker:
+    """A process that runs the models of some sessions."""
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        # Only one request at a time can use the pipe
+        self.lock = threading.Lock()
+        self.sessions = 0
+
+    def request(self, operation, session_id, payload=None):
+        with self.lock:
+            self.conn.send((operation, session_id, payload))
+            ok, result = self.conn.recv()
+        if not ok:
+            raise SessionError(result)
+        return result
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass  # The process already ended
+        self.process.join(timeout=5)
+
+
+class Session:
+    """A simulation of one client: the worker that runs it, its lock and when it was last used."""
+    def __init__(self, worker):
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class SessionPool:
+    """
+    Runs many independent simulations on a pool of worker processes.
+    Each session lives in one worker, its requests are serialized with a per-session lock,
+    and sessions that are not used for idle_timeout seconds are evicted.
+    """
+    def __init__(self, workers=None, max_sessions=64, idle_timeout=600):
+        """
+        Creates the pool. The worker processes are started right away.
+        Args:
+            workers: Number of worker processes (one per core by default)
+            max_sessions: Maximum number of sessions alive at the same time
+            idle_timeout: Seconds without requests after which a session is evicted
+        """
+        # spawn: forking a process with Flask threads running is not safe
+        context = multiprocessing.get_context("spawn")
+        self.workers = [Worker(context) for _ in range(workers or multiprocessing.cpu_count())]
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        threading.Thread(target=self._evict_loop, daemon=True).start()
+
+    def create(self, engine="mesa", snapshot=None):
+        """
+        Creates a new session in the least busy worker and returns its id.
+        With a snapshot the model of the session is restored from it (and engine is ignored).
+        """
+        self.evict_idle()
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise TooManySessions(f"Too many sessions (maximum {self.max_sessions})")
+            worker = min(self.workers, key=lambda worker: worker.sessions)
+            worker.sessions += 1
+            session_id = secrets.token_hex(8)
+            session = self.sessions[session_id] = Session(worker)
+
+        with session.lock:
+            try:
+                if snapshot is not None:
+                    worker.request("restore", session_id, snapshot)
+                else:
+                    worker.request("create", session_id, engine)
+            except Exception:
+                self._forget(session_id)
+                raise
+        return session_id
+
+    def call(self, session_id, *calls):
+        """
+        Runs method calls (name, *args) on the model of a session, in a single round trip to its worker.
+        Returns the list of results.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        with session.lock:
+            if self.sessions.get(session_id) is not session:
+                raise SessionNotFound(session_id)  # Evicted while waiting for the lock
+            session.last_used = time.monotonic()
+            return session.worker.request("call", session_id, calls)
+
+    def restore(self, session_id, snapshot):
+        """Replaces the model of a session with one restored from a snapshot."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        with session.lock:
+            if self.sessions.get(session_id) is not session:
+                raise SessionNotFound(session_id)
+            session.last_used = time.monotonic()
+            session.worker.request("restore", session_id, snapshot)
+
+    def drop(self, session_id):
+        """Removes a session and its model."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        with session.lock:
+            if self._forget(session_id):
+                session.worker.request("drop", session_id)
+
+    def evict_idle(self):
+        """Removes the sessions that have not been used for idle_timeout seconds."""
+        limit = time.monotonic() - self.idle_timeout
+        for session_id, session in list(self.sessions.items()):
+            # A session that is busy is being used, so it is not idle
+            if session.last_used < limit and session.lock.acquire(blocking=False):
+                try:
+                    if session.last_used < limit and self._forget(session_id):
+                        session.worker.request("drop", session_id)
+                finally:
+                    session.lock.release()
+
+    def _evict_loop(self):
+        while not self.closed.wait(self.idle_timeout / 4):
+            self.evict_idle()
+
+    def _forget(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                session.worker.sessions -= 1
+            return session is not None
+
+    def close(self):
+        """Stops the worker processes."""
+        self.closed.set()
+        for worker in self.workers:
+            worker.close()
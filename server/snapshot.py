@@ -0,0 +1,106 @@
+# snapshot.py
+"""
+Snapshots of a running model, to fork many experiments from one warmed up state or to resume a
+run after a restart:
+
+    data = model.snapshot()
+    model = restore_model(data)  # Continues exactly like the original model would
+
+A snapshot is the state of the model (cars with their remaining paths and destinations, light
+phases and queues, step counters, totals, telemetry and the state of the random numbers) as
+JSON compressed with zlib. JSON is used instead of pickle so that snapshots uploaded to the
+server can't run code. The map is not stored, only its name in city_files, which is loaded again.
+
+Snapshots may come from clients, so the parameters of the model are checked before it is built
+(see restore_params): only the known ones are accepted, the map must be a file of city_files and
+the number of tiles is capped. Files outside city_files, like the telemetry file, are never named
+by a snapshot.
+"""
+
+import json
+import os
+import zlib
+from city_map import CITY_FILES
+
+# 2: cars of the mesa engine are stored as serial, cell, goal and remaining route (no schedule)
+SNAPSHOT_VERSION = 2
+
+# Parameters that a snapshot can set, by engine
+ENGINE_PARAMS = {
+    "mesa": {"routing", "map_file", "spawn_interval", "light_time", "signals", "update", "static_agents"},
+    "numpy": {"map_file", "spawn_interval", "light_time", "signals"},
+    "tiled": {"map_file", "spawn_interval", "light_time", "signals", "tiles"},
+}
+# Most tiles (worker processes) that a snapshot of the tiled engine can ask for
+MAX_TILES = 64
+
+def snapshot_params(params):
+    """Parameters of a model as stored in a snapshot: the map is stored by its name in city_files."""
+    city_files = os.path.realpath(CITY_FILES)
+    map_file = os.path.realpath(params["map_file"])
+    if os.path.dirname(map_file) != city_files:
+        raise ValueError(f"Only the maps of {CITY_FILES} can be stored in a snapshot")
+    return dict(params, map_file=os.path.basename(map_file))
+
+def restore_params(state):
+    """
+    Checks the parameters of a snapshot and returns the keyword arguments of its model.
+    Raises ValueError if a parameter is unknown or out of range, or if the map is not a file of city_files.
+    """
+    allowed = ENGINE_PARAMS.get(state.get("engine"))
+    if allowed is None:
+        raise ValueError(f"Unknown engine {state.get('engine')!r}")
+    params = dict(state["params"])
+    unknown = set(params) - allowed
+    if unknown:
+        raise ValueError(f"Unknown snapshot parameters {sorted(unknown)}")
+
+    name = params.get("map_file")
+    map_file = os.path.join(CITY_FILES, name) if isinstance(name, str) else None
+    if map_file is None or os.path.basename(name) != name or not os.path.isfile(map_file):
+        raise ValueError(f"Unknown map {name!r}")
+    params["map_file"] = map_file
+
+    if not _in_range(params.get("spawn_interval"), 1):
+        raise ValueError(f"Invalid spawn_interval {params.get('spawn_interval')!r}")
+    if params.get("light_time") is not None and not _in_range(params["light_time"], 1):
+        raise ValueError(f"Invalid light_time {params['light_time']!r}")
+    if "tiles" in params and not _in_range(params["tiles"], 1, MAX_TILES):
+        raise ValueError(f"Invalid tiles {params['tiles']!r} (at most {MAX_TILES})")
+    if type(params.get("static_agents", False)) is not bool:
+        raise ValueError(f"Invalid static_agents {params['static_agents']!r}")
+    return params
+
+def _in_range(value, minimum, maximum=None):
+    return type(value) is int and value >= minimum and (maximum is None or value <= maximum)
+
+def dump_snapshot(state):
+    """Compresses the state of a model into a snapshot."""
+    return zlib.compress(json.dumps(dict(state, version=SNAPSHOT_VERSION), separators=(",", ":")).encode())
+
+def load_snapshot(data):
+    """Reads the state of a model from a snapshot. Raises ValueError if it is not a snapshot."""
+    try:
+        state = json.loads(zlib.decompress(data))
+    except zlib.error as e:
+        raise ValueError(f"Not a snapshot ({e})")
+    if not isinstance(state, dict):
+        raise ValueError("Not a snapshot")
+    if state.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {state.get('version')}")
+    return state
+
+def restore_model(data, telemetry_file=None):
+    """
+    Creates a model (of the engine it was taken from) from a snapshot.
+    The telemetry file is not stored in snapshots, models forked from the same one can each have their own.
+    """
+    state = load_snapshot(data)
+    if state["engine"] == "numpy":
+        from vector_model import ArrayCityModel  # NumPy is only needed for this engine
+        return ArrayCityModel.from_state(state, telemetry_file)
+    if state["engine"] == "tiled":
+        from tiled_model import TiledCityModel
+        return TiledCityModel.from_state(state, telemetry_file)
+    from model import CityModel
+    return CityModel.from_state(state, telemetry_file)
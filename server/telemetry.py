@@ -0,0 +1,85 @@
+# telemetry.py
+
+import json
+from collections import deque
+
+# Steps and trips kept in memory
+STEP_HISTORY = 1000
+TRIP_HISTORY = 1000
+# Every how many steps the file is flushed
+FLUSH_INTERVAL = 100
+
+# Fields of the records, in the order they are stored
+STEP_FIELDS = ("step", "in_flight", "moves", "blocked_light", "blocked_car", "arrivals", "spawns")
+TRIP_FIELDS = ("car", "spawn_step", "arrival_step", "path_length")
+
+class Telemetry:
+    """
+    Metrics of a simulation with fixed memory.
+    The model counts what happens in a step (moves, cars blocked by a light or by another car,
+    arrivals, spawns) and closes it with end_step. The last STEP_HISTORY steps and TRIP_HISTORY
+    trips are kept in ring buffers, and every record can also be appended to a JSON lines file.
+    """
+    def __init__(self, path=None, step_history=STEP_HISTORY, trip_history=TRIP_HISTORY):
+        """
+        Creates the telemetry.
+        Args:
+            path: File where every step and trip is appended as a line of JSON (optional)
+            step_history: Steps kept in memory
+            trip_history: Trips kept in memory
+        """
+        self.steps = deque(maxlen=step_history)
+        self.trips = deque(maxlen=trip_history)
+        self.file = open(path, "a") if path else None
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.moves = 0
+        self.blocked_light = 0
+        self.blocked_car = 0
+        self.arrivals = 0
+        self.spawns = 0
+
+    def trip(self, car_id, spawn_step, arrival_step, path_length):
+        """Records a finished trip."""
+        record = (car_id, spawn_step, arrival_step, path_length)
+        self.trips.append(record)
+        if self.file is not None:
+            self.file.write(json.dumps(dict(zip(TRIP_FIELDS, record), type="trip")) + "\n")
+
+    def end_step(self, step, in_flight):
+        """Stores the counters of a step and starts counting the next one."""
+        record = (step, in_flight, self.moves, self.blocked_light, self.blocked_car, self.arrivals, self.spawns)
+        self.steps.append(record)
+        self.reset_counters()
+        if self.file is not None:
+            self.file.write(json.dumps(dict(zip(STEP_FIELDS, record), type="step")) + "\n")
+            if step % FLUSH_INTERVAL == 0:
+                self.file.flush()
+
+    def window(self, since=None):
+        """
+        Returns the steps and trips (as dictionaries) after the step since, or every kept one.
+        """
+        if since is None:
+            since = -1
+        steps = [dict(zip(STEP_FIELDS, record)) for record in self.steps if record[0] > since]
+        trips = [dict(zip(TRIP_FIELDS, record)) for record in self.trips if record[2] > since]
+        return {"steps": steps, "trips": trips}
+
+    def state(self):
+        """Returns the kept steps and trips, for snapshots."""
+        return {"steps": list(self.steps), "trips": list(self.trips)}
+
+    def load_state(self, state):
+        """Replaces the kept steps and trips with the ones returned by state()."""
+        self.steps.clear()
+        self.steps.extend(tuple(record) for record in state["steps"])
+        self.trips.clear()
+        self.trips.extend(tuple(record) for record in state["trips"])
+        self.reset_counters()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
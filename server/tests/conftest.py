@@ -0,0 +1,24 @@
+# conftest.py
+
+import json
+import os
+import sys
+
+import pytest
+
+# The server modules import each other by name, like when they run from server/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from city_map import CityMap, DEFAULT_MAP, DEFAULT_DICTIONARY
+from mapgen import generate_map
+
+@pytest.fixture(scope="session")
+def base_map():
+    """The map the server uses by default."""
+    return CityMap.load(DEFAULT_MAP)
+
+@pytest.fixture(scope="session")
+def synthetic_map():
+    """A generated 40x40 map, big enough for the contraction hierarchy to add shortcuts."""
+    with open(DEFAULT_DICTIONARY) as dictionaryFile:
+        return CityMap(generate_map(40, 40, seed=0), json.load(dictionaryFile))
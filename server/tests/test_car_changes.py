@@ -0,0 +1,63 @@
+# test_car_changes.py
+
+import pytest
+
+from model import CityModel, CHANGE_HISTORY
+
+@pytest.fixture
+def model():
+    model = CityModel(5, seed=2, spawn_interval=2, static_agents=False)
+    yield model
+    model.close()
+
+def apply_changes(cars, changes):
+    """Applies a response of car_changes to the cars {id: pos} of a client, like the web client does."""
+    step, full, added, moved, removed = changes
+    if full:
+        cars.clear()
+    cars.update(added)
+    cars.update(moved)
+    for car_id in removed:
+        del cars[car_id]
+    return step
+
+def test_incremental_changes_rebuild_the_cars(model):
+    cars = {}
+    since = apply_changes(cars, model.car_changes())
+    removed = 0
+    for _ in range(200):
+        model.step()
+        changes = model.car_changes(since)
+        assert not changes[1]
+        removed += len(changes[4])
+        since = apply_changes(cars, changes)
+        assert cars == dict(model.car_positions())
+    # Cars arrived during the test, so removals were checked too
+    assert removed > 0
+
+def test_no_changes_since_the_current_step(model):
+    model.advance(10)
+    assert model.car_changes(model.step_count) == (model.step_count, False, [], [], [])
+
+def test_full_without_since(model):
+    model.advance(10)
+    step, full, added, moved, removed = model.car_changes()
+    assert (step, full, moved, removed) == (model.step_count, True, [], [])
+    assert added == model.car_positions()
+
+def test_full_when_since_is_older_than_the_history(model):
+    model.advance(CHANGE_HISTORY + 20)
+    step, full, added, _, _ = model.car_changes(1)
+    assert full
+    assert added == model.car_positions()
+
+def test_full_when_since_is_ahead_of_the_model(model):
+    # A client of a model that was restored to an earlier step (or initialized again)
+    model.advance(30)
+    restored = CityModel.restore(model.snapshot())
+    model.advance(20)
+    step, full, added, _, _ = restored.car_changes(model.step_count)
+    assert full
+    assert step == restored.step_count
+    assert added == restored.car_positions()
+    restored.close()
@@ -0,0 +1,43 @@
+# test_city_map.py
+
+import pytest
+
+from city_map import CityMap, CompiledCityMap
+from model import CityModel
+
+@pytest.fixture(params=["base", "synthetic"])
+def text_map(request):
+    return request.getfixturevalue(f"{request.param}_map")
+
+def test_compiled_map_round_trip(text_map, tmp_path):
+    path = str(tmp_path / "city.cmap")
+    text_map.save_compiled(path)
+    compiled = CityMap.load(path)
+
+    assert isinstance(compiled, CompiledCityMap)
+    assert (compiled.width, compiled.height) == (text_map.width, text_map.height)
+    assert compiled.lights == text_map.lights
+    assert compiled.light_groups == text_map.light_groups
+    assert compiled.destinations == text_map.destinations
+    assert compiled.obstacles == text_map.obstacles
+    assert compiled.roads == text_map.roads
+    for x in range(text_map.width):
+        for y in range(text_map.height):
+            assert compiled.kind_at((x, y)) == text_map.kind_at((x, y))
+            assert compiled.direction_at((x, y)) == text_map.direction_at((x, y))
+
+    text_graph = text_map.road_graph()
+    compiled_graph = compiled.road_graph()
+    assert compiled_graph.destinations == text_graph.destinations
+    assert [tuple(successors) for successors in compiled_graph.successors] == list(text_graph.successors)
+    assert compiled.static_layer == text_map.static_layer
+
+def test_model_runs_the_same_on_a_compiled_map(base_map, tmp_path):
+    path = str(tmp_path / "city.cmap")
+    base_map.save_compiled(path)
+    text_model = CityModel(5, seed=4, static_agents=False)
+    compiled_model = CityModel(5, map_file=path, seed=4, static_agents=False)
+    text_model.advance(100)
+    compiled_model.advance(100)
+    assert compiled_model.car_positions() == text_model.car_positions()
+    assert compiled_model.total_arrived == text_model.total_arrived
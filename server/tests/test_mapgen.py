@@ -0,0 +1,36 @@
+# test_mapgen.py
+
+import json
+
+import pytest
+
+from city_map import CityMap, DEFAULT_DICTIONARY
+from mapgen import generate_map
+from routing import DistanceFields, UNREACHABLE
+
+@pytest.fixture(scope="module")
+def dictionary():
+    with open(DEFAULT_DICTIONARY) as dictionaryFile:
+        return json.load(dictionaryFile)
+
+@pytest.mark.parametrize("width, height, seed", [(30, 30, 0), (60, 45, 1), (45, 80, 2)])
+def test_generated_maps_parse_and_every_destination_is_reachable(dictionary, width, height, seed):
+    lines = generate_map(width, height, seed=seed)
+    assert len(lines) == height
+    assert all(len(line) == width and set(line) <= set("<>^vSsD#") for line in lines)
+
+    city_map = CityMap(lines, dictionary)
+    assert city_map.destinations and city_map.lights
+    graph = city_map.road_graph()
+    fields = DistanceFields(graph)
+    corners = [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]
+    for _, pos in city_map.destinations:
+        assert any(fields.distance(corner, pos) != UNREACHABLE for corner in corners)
+
+def test_same_seed_same_map():
+    assert generate_map(50, 50, seed=3) == generate_map(50, 50, seed=3)
+    assert generate_map(50, 50, seed=3) != generate_map(50, 50, seed=4)
+
+def test_too_small_maps_are_rejected():
+    with pytest.raises(ValueError):
+        generate_map(5, 5)
@@ -0,0 +1,155 @@
+# test_routing.py
+
+import json
+import random
+from collections import deque
+
+import pytest
+
+from city_map import CityMap, DEFAULT_MAP, DEFAULT_DICTIONARY
+from model import CityModel
+from routing import ContractionHierarchy, DistanceFields, RouteCache, UNREACHABLE
+
+def bfs_distances(graph, start):
+    """Moves from the cell start to every cell it can reach."""
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        for successor in graph.successors[cell]:
+            if successor not in distances:
+                distances[successor] = distances[cell] + 1
+                queue.append(successor)
+    return distances
+
+def corners(graph):
+    return [(0, 0), (graph.width - 1, 0), (0, graph.height - 1), (graph.width - 1, graph.height - 1)]
+
+def sample_starts(graph, count=20, seed=0):
+    """The corners and some random cells with moves."""
+    cells = [cell for cell, successors in enumerate(graph.successors) if successors]
+    return corners(graph) + [graph.position(cell) for cell in random.Random(seed).sample(cells, count)]
+
+def check_path(graph, start, path):
+    """Checks that every position of the path is one move from the one before."""
+    previous = graph.index(start)
+    for pos in path:
+        cell = graph.index(pos)
+        assert cell in graph.successors[previous]
+        previous = cell
+
+@pytest.fixture(scope="module", params=["base", "synthetic"])
+def graph(request):
+    return request.getfixturevalue(f"{request.param}_map").road_graph()
+
+def test_a_star_routes_are_valid(graph):
+    for start in sample_starts(graph):
+        distances = bfs_distances(graph, graph.index(start))
+        for goal in graph.destinations:
+            path = graph.a_star_search(start, goal)
+            distance = distances.get(graph.index(goal))
+            if distance is None:
+                assert path == []
+            else:
+                # The Manhattan heuristic can overestimate with diagonal moves, so A* may take a longer route
+                assert len(path) >= distance
+                assert path[-1] == goal
+                check_path(graph, start, path)
+
+def test_a_star_is_shortest_from_the_corners_of_the_base_map(base_map):
+    graph = base_map.road_graph()
+    for start in corners(graph):
+        distances = bfs_distances(graph, graph.index(start))
+        for goal in graph.destinations:
+            assert len(graph.a_star_search(start, goal)) == distances.get(graph.index(goal), 0)
+
+def check_hierarchy(hierarchy, graph):
+    """Checks the routes of the hierarchy against a BFS, to the destinations and some random cells."""
+    cells = [cell for cell, successors in enumerate(graph.successors) if successors]
+    goals = graph.destinations + [graph.position(cell) for cell in random.Random(1).sample(cells, 20)]
+    for start in sample_starts(graph):
+        distances = bfs_distances(graph, graph.index(start))
+        for goal in goals:
+            if goal == start:
+                continue
+            path = hierarchy.shortest_path(start, goal)
+            distance = distances.get(graph.index(goal))
+            if distance is None:
+                assert path == []
+            else:
+                assert len(path) == distance
+                assert path[-1] == goal
+                check_path(graph, start, path)
+
+def test_contraction_hierarchy_matches_bfs(graph):
+    check_hierarchy(ContractionHierarchy(graph), graph)
+
+def test_rebuilt_hierarchy_matches_bfs(base_map):
+    hierarchy = ContractionHierarchy(base_map.road_graph())
+    # Block the first step of a route, so the routes change
+    graph = base_map.road_graph()
+    blocked = graph.a_star_search((0, 0), graph.destinations[0])[0]
+    edited = edit_base_map(blocked, "#").road_graph()
+    check_hierarchy(hierarchy.rebuild(edited), edited)
+
+def test_distance_fields_match_bfs(graph):
+    fields = DistanceFields(graph)
+    starts = sample_starts(graph)
+    reaches = {start: bfs_distances(graph, graph.index(start)) for start in starts}
+    for goal in graph.destinations:
+        for start in starts:
+            expected = reaches[start].get(graph.index(goal), UNREACHABLE)
+            assert fields.distance(start, goal) == expected
+
+def test_next_moves_go_one_move_closer(base_map):
+    graph = base_map.road_graph()
+    fields = DistanceFields(graph)
+    goal = graph.destinations[0]
+    for start in sample_starts(graph):
+        distance = fields.distance(start, goal)
+        for pos in fields.next_moves(start, goal):
+            assert graph.index(pos) in graph.successors[graph.index(start)]
+            assert fields.distance(pos, goal) == distance - 1
+
+def test_route_cache_shares_routes(base_map):
+    graph = base_map.road_graph()
+    cache = RouteCache(graph)
+    goal = graph.destinations[0]
+    route = cache.get_route((0, 0), goal)
+    assert route == tuple(graph.index(pos) for pos in graph.a_star_search((0, 0), goal))
+    assert cache.get_route((0, 0), goal) is route
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def edit_base_map(pos, char):
+    """The default map with the character of one cell replaced."""
+    with open(DEFAULT_MAP) as mapFile:
+        lines = mapFile.read().splitlines()
+    with open(DEFAULT_DICTIONARY) as dictionaryFile:
+        dictionary = json.load(dictionaryFile)
+    x, y = pos
+    row = len(lines) - y - 1
+    lines[row] = lines[row][:x] + char + lines[row][x + 1:]
+    return CityMap(lines, dictionary)
+
+def test_invalidate_routes_reroutes_the_cars(base_map):
+    model = CityModel(5, seed=3, static_agents=False)
+    model.advance(40)
+    cars = model.cars
+    slot = next(slot for slot in cars.slots.values() if len(cars.route_left(slot)) > 1)
+    blocked = cars.route_left(slot)[0]
+    model.invalidate_routes(edit_base_map(model.road_graph.position(blocked), "#"))
+
+    for slot in cars.slots.values():
+        assert blocked not in cars.route_left(slot)
+    for _ in range(100):
+        model.step()
+        assert not model.occupied[blocked]
+    model.close()
+
+def test_invalidate_routes_rejects_other_destinations(base_map):
+    model = CityModel(5, seed=3, static_agents=False)
+    _, destination = base_map.destinations[0]
+    with pytest.raises(ValueError):
+        model.invalidate_routes(edit_base_map(destination, "#"))
+    assert model.city_map.destinations == base_map.destinations
+    model.close()
@@ -0,0 +1,46 @@
+# test_runner.py
+
+import threading
+
+from runner import BackgroundRunner, FrameChannel
+
+def test_slow_viewers_get_the_newest_frame():
+    channel = FrameChannel()
+    channel.publish("frame 1")
+    frames = channel.frames(keepalive=0.05)
+    assert next(frames) == "frame 1"
+
+    # Published while the viewer was busy: only the newest one is seen
+    for number in (2, 3, 4):
+        channel.publish(f"frame {number}")
+    assert next(frames) == "frame 4"
+    # Nothing new: a keep alive
+    assert next(frames) is None
+
+    channel.close()
+    assert list(frames) == []
+
+def test_every_viewer_gets_the_same_frame():
+    channel = FrameChannel()
+    viewers = [channel.frames(keepalive=1) for _ in range(3)]
+    channel.publish("frame")
+    assert [next(frames) for frames in viewers] == ["frame"] * 3
+
+def test_runner_publishes_until_stopped():
+    ticked = threading.Event()
+    steps = []
+
+    def advance(count):
+        steps.append(count)
+        if len(steps) == 3:
+            ticked.set()
+        return len(steps)
+
+    runner = BackgroundRunner(advance, tick_rate=None, steps_per_tick=2)
+    frames = runner.channel.frames(keepalive=1)
+    assert ticked.wait(5)
+    assert next(frames) >= 3
+    runner.stop()
+    assert not runner.running
+    assert list(frames) == []
+    assert set(steps) == {2}
@@ -0,0 +1,60 @@
+# test_sessions.py
+
+import time
+
+import pytest
+
+import server
+from sessions import SessionNotFound, SessionPool, TooManySessions
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SessionPool(workers=1, max_sessions=2, idle_timeout=600)
+    yield pool
+    pool.close()
+
+def test_sessions_have_their_own_model(pool):
+    first = pool.create()
+    second = pool.create()
+    try:
+        pool.call(first, ("advance", 20))
+        assert pool.call(first, ("step_count",), ("width",)) == [20, 30]
+        assert pool.call(second, ("step_count",)) == [0]
+    finally:
+        pool.drop(first)
+        pool.drop(second)
+
+def test_full_pool_and_idle_eviction(pool):
+    first = pool.create()
+    second = pool.create()
+    with pytest.raises(TooManySessions):
+        pool.create()
+
+    # The first session was not used for longer than idle_timeout
+    pool.sessions[first].last_used = time.monotonic() - 601
+    third = pool.create()
+    with pytest.raises(SessionNotFound):
+        pool.call(first, ("step_count",))
+    assert pool.call(second, ("step_count",)) == [0]
+    pool.drop(second)
+    pool.drop(third)
+
+def test_server_answers_503_when_full(monkeypatch):
+    monkeypatch.setattr(server, "SESSION_WORKERS", 1)
+    monkeypatch.setattr(server, "MAX_SESSIONS", 1)
+    monkeypatch.setattr(server, "sessionPool", None)
+    client = server.app.test_client()
+    try:
+        response = client.post("/init", json={"session": True})
+        assert response.status_code == 200
+        session_id = response.json["session"]
+
+        response = client.post("/init", json={"session": True})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) > 0
+
+        assert client.get(f"/step?session={session_id}&steps=3").json["step"] == 3
+        assert client.post(f"/close?session={session_id}").status_code == 200
+        assert client.get(f"/step?session={session_id}").status_code == 404
+    finally:
+        server.sessionPool.close()
@@ -0,0 +1,109 @@
+# test_snapshot.py
+
+import json
+import zlib
+
+import pytest
+
+import server
+from model import CityModel
+from snapshot import MAX_TILES, SNAPSHOT_VERSION, dump_snapshot, load_snapshot, restore_model
+
+def check_continues(model, warmup=60, steps=60):
+    """Takes a snapshot after warmup steps and checks that the restored model continues exactly like the original."""
+    model.advance(warmup)
+    data = model.snapshot()
+    restored = restore_model(data)
+    try:
+        assert type(restored) is type(model)
+        assert restored.step_count == model.step_count
+        model.advance(steps)
+        restored.advance(steps)
+        assert restored.car_positions() == model.car_positions()
+        assert restored.total_arrived == model.total_arrived
+        assert restored.signal_states() == model.signal_states()
+        # Same state down to the random numbers and the telemetry
+        assert load_snapshot(restored.snapshot()) == load_snapshot(model.snapshot())
+    finally:
+        restored.close()
+
+@pytest.mark.parametrize("routing", ["astar", "ch", "field"])
+@pytest.mark.parametrize("update", ["random", "synchronous"])
+@pytest.mark.parametrize("signals", ["fixed", "adaptive"])
+def test_mesa_snapshot_continues(routing, update, signals):
+    model = CityModel(5, routing=routing, update=update, signals=signals, seed=7, spawn_interval=3, static_agents=False)
+    check_continues(model)
+    model.close()
+
+def test_numpy_snapshot_continues():
+    pytest.importorskip("numpy")
+    from vector_model import ArrayCityModel
+    model = ArrayCityModel(5, seed=7, spawn_interval=3, signals="adaptive")
+    check_continues(model)
+    model.close()
+
+def test_tiled_snapshot_continues():
+    pytest.importorskip("numpy")
+    from tiled_model import TiledCityModel
+    model = TiledCityModel(5, seed=7, spawn_interval=3, tiles=2)
+    try:
+        check_continues(model, warmup=30, steps=30)
+    finally:
+        model.close()
+
+def test_old_snapshot_versions_are_rejected():
+    data = dump_snapshot({"engine": "mesa"})
+    state = load_snapshot(data)
+    assert state["version"] == SNAPSHOT_VERSION
+    state["version"] = SNAPSHOT_VERSION - 1
+    with pytest.raises(ValueError):
+        load_snapshot(zlib.compress(json.dumps(state).encode()))
+
+def test_garbage_is_not_a_snapshot():
+    with pytest.raises(ValueError):
+        load_snapshot(b"not a snapshot")
+
+def edited_snapshot(**params):
+    """Snapshot of a new model with some parameters changed (None removes one)."""
+    model = CityModel(5, seed=1, static_agents=False)
+    state = load_snapshot(model.snapshot())
+    model.close()
+    state["params"].update(params)
+    state["params"] = {name: value for name, value in state["params"].items() if value is not None}
+    return dump_snapshot(state)
+
+@pytest.mark.parametrize("params", [
+    {"telemetry_file": "/tmp/written_by_a_snapshot"},
+    {"map_file": "/etc/passwd"},
+    {"map_file": "../server.py"},
+    {"map_file": None},
+    {"spawn_interval": 0},
+    {"light_time": "10"},
+    {"static_agents": "yes"},
+])
+def test_bad_parameters_are_rejected(params):
+    data = edited_snapshot(**params)
+    with pytest.raises(ValueError):
+        restore_model(data)
+    response = server.app.test_client().post("/restore", data=data)
+    assert response.status_code == 400
+
+def test_tiles_are_capped():
+    state = load_snapshot(edited_snapshot())
+    state.update(engine="tiled", params={"map_file": state["params"]["map_file"], "spawn_interval": 10,
+                                         "light_time": None, "signals": "fixed", "tiles": MAX_TILES + 1})
+    with pytest.raises(ValueError):
+        restore_model(dump_snapshot(state))
+
+def test_telemetry_file_is_not_stored(tmp_path):
+    model = CityModel(5, seed=1, static_agents=False, telemetry_file=str(tmp_path / "original.jsonl"))
+    model.advance(5)
+    state = load_snapshot(model.snapshot())
+    model.close()
+    assert "telemetry_file" not in state["params"]
+    assert state["params"]["map_file"] == "2024_base.txt"
+
+    restored = restore_model(dump_snapshot(state), telemetry_file=str(tmp_path / "restored.jsonl"))
+    restored.advance(5)
+    restored.close()
+    assert (tmp_path / "restored.jsonl").stat().st_size > 0
@@ -0,0 +1,30 @@
+# test_static_layer.py
+
+import pytest
+
+import server
+
+@pytest.fixture(scope="module")
+def client():
+    client = server.app.test_client()
+    assert client.post("/init", json={}).status_code == 200
+    return client
+
+@pytest.mark.parametrize("route", ["/getMap", "/getObstacles", "/getDestinations"])
+def test_matching_etag_gets_304(client, route):
+    response = client.get(route)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.json
+
+    cached = client.get(route, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.headers["ETag"] == etag
+
+    assert client.get(route, headers={"If-None-Match": '"other"'}).status_code == 200
+
+def test_routes_share_the_static_layer(client):
+    layer = server.cityModel.static_layer()
+    assert client.get("/getObstacles").json == {"positions": layer["obstacles"]}
+    assert client.get("/getDestinations").json == {"positions": layer["destinations"]}
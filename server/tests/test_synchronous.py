@@ -0,0 +1,45 @@
+# test_synchronous.py
+
+import pytest
+
+from model import CityModel
+
+@pytest.fixture
+def model():
+    # No new cars after the first ones, the tests place their own
+    model = CityModel(5, seed=1, update="synchronous", spawn_interval=1000, static_agents=False)
+    yield model
+    model.close()
+
+def free_cells(model, count):
+    """Road cells without cars nor lights, far from the corners."""
+    cells = [model.road_graph.index(pos) for _, pos, _ in model.city_map.roads if 5 <= pos[0] < model.width - 5]
+    return [cell for cell in cells if not model.occupied[cell] and cell not in model.light_cells][:count]
+
+def test_same_seed_same_run():
+    models = [CityModel(5, seed=5, update="synchronous", spawn_interval=2, static_agents=False) for _ in range(2)]
+    for model in models:
+        model.advance(200)
+    first, second = models
+    assert first.car_positions() == second.car_positions()
+    assert first.total_arrived == second.total_arrived
+    assert first.snapshot() == second.snapshot()
+    for model in models:
+        model.close()
+
+def test_a_queue_advances_together(model):
+    # The longest stretch of a route without lights nor cars
+    route = model.route_cache.get_route((0, 0), model.city_map.destinations[0][1])
+    start = next(i for i in range(3, len(route) - 5)
+                 if not any(model.occupied[cell] or cell in model.light_cells for cell in route[i:i + 5]))
+    slots = [model.place_car(route[start + k], 0, route[start + k + 1:]) for k in range(4)]
+    model.step()
+    assert [model.cars.cells[slot] for slot in slots] == list(route[start + 1:start + 5])
+
+def test_a_ring_rotates_but_two_cars_cannot_swap(model):
+    a, b, c, d, e = free_cells(model, 5)
+    ring = [model.place_car(a, 0, (b, a)), model.place_car(b, 0, (c, b)), model.place_car(c, 0, (a, c))]
+    swap = [model.place_car(d, 0, (e, d)), model.place_car(e, 0, (d, e))]
+    model.step()
+    assert [model.cars.cells[slot] for slot in ring] == [b, c, a]
+    assert [model.cars.cells[slot] for slot in swap] == [d, e]
@@ -0,0 +1,32 @@
+# test_tiled_model.py
+
+import os
+
+import numpy as np
+import pytest
+
+from tiled_model import TiledCityModel
+
+@pytest.fixture(scope="module")
+def model():
+    model = TiledCityModel(5, seed=3, spawn_interval=2, tiles=4)
+    yield model
+    model.close()
+
+def test_cars_are_not_lost_nor_duplicated(model):
+    for _ in range(60):
+        model.step()
+        ids, cells = model.car_arrays()
+        assert len(ids) == model.in_flight
+        assert len(np.unique(ids)) == len(ids)
+        assert len(np.unique(cells)) == len(cells)
+    assert model.total_arrived > 0
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="shared memory is not listed in /dev/shm")
+def test_shared_arrays_are_removed_on_close():
+    before = set(os.listdir("/dev/shm"))
+    model = TiledCityModel(5, seed=3, tiles=2)
+    assert set(os.listdir("/dev/shm")) > before
+    model.advance(5)
+    model.close()
+    assert set(os.listdir("/dev/shm")) == before
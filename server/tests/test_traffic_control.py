@@ -0,0 +1,79 @@
+# test_traffic_control.py
+
+import pytest
+
+from model import CityModel
+from routing import backward_search
+from traffic_control import MAX_GREEN_FACTOR, SignalController
+
+def green_starts(controller, steps):
+    """Steps at which every light turns green."""
+    starts = [set() for _ in controller.states]
+    for tick in range(steps):
+        for light in controller.step(tick):
+            if controller.states[light]:
+                starts[light].add(tick)
+    return starts
+
+@pytest.mark.parametrize("city", ["base", "synthetic"])
+def test_green_wave_offsets(request, city):
+    city_map = request.getfixturevalue(f"{city}_map")
+    graph = city_map.road_graph()
+    controller = SignalController(city_map, road_graph=graph, mode="green_wave")
+    junctions = controller.junctions
+    cells = [graph.index(pos) for pos in controller.light_positions]
+    starts = green_starts(controller, 4 * max(junction.cycle for junction in junctions))
+
+    # The wave starts at the lights of the first junction that turn green with its first change (step 0)
+    first = junctions[0]
+    assert first.offset == 0
+    sources = [light for light in first.lights if 0 in starts[light]]
+    reached = {}
+    for light, cell in enumerate(cells):
+        field = backward_search(graph, cell)
+        moves = [field[cells[source]] for source in sources if field[cells[source]] >= 0]
+        if moves:
+            reached[light] = min(moves)
+
+    waved = [junction for junction in junctions[1:] if any(light in reached for light in junction.lights)]
+    assert waved
+    for junction in waved:
+        # A car that left with the wave finds one of the lights of the junction turning green
+        assert any((reached[light] - start) % junction.cycle == 0
+                   for light in junction.lights if light in reached for start in starts[light])
+
+def test_fixed_lights_keep_the_map_offsets(base_map):
+    controller = SignalController(base_map)
+    assert all(junction.offset == 0 for junction in controller.junctions)
+
+def recount_queues(model):
+    """Queues of every light counted from the occupied cells."""
+    controller = model.signal_controller
+    queues = [0] * len(controller.states)
+    for cell, occupied in enumerate(model.occupied):
+        if occupied:
+            light = controller.approach_light.get(cell, controller.crossing_light.get(cell))
+            if light is not None:
+                queues[light] += 1
+    return queues
+
+def test_queues_follow_the_cars():
+    model = CityModel(5, seed=3, spawn_interval=2, signals="adaptive", static_agents=False)
+    for _ in range(150):
+        model.step()
+        assert model.signal_controller.queues == recount_queues(model)
+    model.close()
+
+def test_adaptive_greens_can_be_extended():
+    model = CityModel(5, seed=2, spawn_interval=2, signals="adaptive", static_agents=False)
+    junctions = model.signal_controller.junctions
+    started = [junction.phase_started for junction in junctions]
+    longest = 0
+    for _ in range(400):
+        model.step()
+        for index, junction in enumerate(junctions):
+            if junction.phase_started != started[index]:
+                longest = max(longest, (junction.phase_started - started[index]) / junction.durations[0])
+                started[index] = junction.phase_started
+    assert 1 < longest <= MAX_GREEN_FACTOR
+    model.close()
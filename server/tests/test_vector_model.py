@@ -0,0 +1,26 @@
+# test_vector_model.py
+
+import numpy as np
+from routing import DistanceFields
+from vector_model import ArrayCityModel, movement_arrays
+
+def test_movement_arrays_match_the_distance_fields(base_map):
+    graph = base_map.road_graph()
+    fields = DistanceFields(graph)
+    successors, distances = movement_arrays(graph)
+    assert distances.dtype == np.int32
+    for goal, pos in enumerate(graph.destinations):
+        assert distances[goal, :-1].tolist() == list(fields.fields[pos])
+    for cell, cells in enumerate(graph.successors):
+        assert sorted(successors[cell][successors[cell] >= 0].tolist()) == sorted(cells)
+
+def test_distances_are_computed_for_the_goals_of_the_cars():
+    model = ArrayCityModel(5, seed=1, spawn_interval=2)
+    _, distances = movement_arrays(model.road_graph)
+    # Only the destinations of the first cars
+    assert model.has_distances.sum() <= len(model.car_goals) < len(distances)
+    model.advance(50)
+    assert model.has_distances[model.car_goals].all()
+    computed = np.flatnonzero(model.has_distances)
+    assert (model.distances[computed] == distances[computed]).all()
+    model.close()
@@ -0,0 +1,577 @@
+# tiled_model.py
+"""
+Multi-process version of ArrayCityModel for big maps: the map is split into a grid of tiles and
+the cars of each tile are stepped by their own worker process.
+
+The model (the coordinator) keeps the traffic lights, the telemetry and the totals, and every
+step is done in three rounds of messages, sent to every worker before waiting for any answer:
+
+    propose: each tile applies the light changes and the halo (the occupancy of the cells of the
+             other tiles next to its own, at the end of the previous step; the cells themselves are
+             sent only once, when the tile is created), removes its arrived cars
+             and picks the next cell of every car. Claims on cells of other tiles are returned.
+    resolve: each tile decides every claim on its own cells, both its own cars and the claims of
+             the other tiles, with the random key of each claim: the highest key wins. It moves its
+             winners and adopts the cars of other tiles that won.
+    commit:  each tile removes the cars that moved to other tiles, spawns cars in its corners and
+             returns the occupancy of its border cells, which is the halo of its neighbours.
+
+Cars move like in ArrayCityModel (distance fields, free and green cells at the start of the step,
+random winner per cell), so the outputs are the same, but the random numbers are drawn per tile.
+The successors and the distance fields are computed once by the model and shared read-only with
+the workers (multiprocessing.shared_memory), instead of every tile loading the map again.
+Worker processes can't be started from a daemon process, so this engine can't run in a session.
+"""
+
+import math
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from city_map import CityMap, DEFAULT_MAP
+from traffic_control import SignalController
+from telemetry import Telemetry
+from profiling import Profiler
+from snapshot import dump_snapshot, snapshot_params, restore_params
+from model_base import CityModelMixin
+from vector_model import movement_arrays
+
+CAR_FIELDS = ("ids", "cells", "goals", "spawn_steps", "travelled")
+
+def share_array(array):
+    """Copies an array to a new block of shared memory. Returns the block and the spec to attach it (see attach_array)."""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """Returns the block and a read-only view of an array shared with share_array."""
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+def tile_grid(tiles):
+    """Splits a number of tiles into the most square grid (columns, rows)."""
+    columns = int(math.sqrt(tiles))
+    while tiles % columns:
+        columns -= 1
+    return tiles // columns, columns
+
+
+class Tile:
+    """
+    Cars of one tile of the map, in NumPy arrays like ArrayCityModel. Lives in a worker process.
+    Cell indexes are the ones of the whole map, only the cells of the tile and its halo are used.
+    """
+    def __init__(self, index, n_tiles, arrays, height, bounds, halo, border, signal_cells, red_cells, corner_cells,
+                 spawn_interval, seed):
+        """
+        Creates a tile.
+        Args:
+            index: Index of the tile, cars get the ids index, index + n_tiles, index + 2 * n_tiles...
+            n_tiles: Number of tiles of the model
+            arrays: Specs of the shared successors and distances (see movement_arrays and attach_array)
+            height: Height of the map
+            bounds: (x0, x1, y0, y1), the tile has the cells x0 <= x < x1, y0 <= y < y1
+            halo: Cells of other tiles where the cars of the tile can move, their occupancy comes with propose
+            border: Cells of the tile that are in the halo of other tiles
+            signal_cells: Cells of the lights and their approaches, whose cars are reported to the controller
+            red_cells: Cells of the lights that start in red
+            corner_cells: Cells of the four corners of the map
+            spawn_interval: Every how many steps new cars are created in the corners
+            seed: Seed (or SeedSequence) of the random numbers of the tile
+        """
+        self.index = index
+        self.n_tiles = n_tiles
+        self.spawn_interval = spawn_interval
+        self.rng = np.random.default_rng(seed)
+
+        # The blocks are kept so the views stay valid
+        self.blocks = []
+        for name, spec in zip(("successors", "distances"), arrays):
+            block, array = attach_array(spec)
+            self.blocks.append(block)
+            setattr(self, name, array)
+        self.height = height
+        n_cells = len(self.successors)
+
+        x0, x1, y0, y1 = bounds
+        x, y = np.divmod(np.arange(n_cells), self.height)
+        self.own = (x0 <= x) & (x < x1) & (y0 <= y) & (y < y1)
+        self.halo = np.asarray(halo, dtype=np.int64)
+        self.border = np.asarray(border, dtype=np.int64)
+        self.signal_cells = np.zeros(n_cells, dtype=bool)
+        self.signal_cells[np.asarray(signal_cells, dtype=np.int64)] = True
+
+        self.red = np.zeros(n_cells, dtype=bool)
+        self.red[np.asarray(red_cells, dtype=np.int64)] = True
+        self.occupied = np.zeros(n_cells, dtype=bool)
+        corner_cells = np.asarray(corner_cells, dtype=np.int64)
+        self.corner_cells = corner_cells[self.own[corner_cells]]
+
+        self.cars = {name: np.zeros(0, dtype=np.int64) for name in CAR_FIELDS}
+        self.next_car = 0
+        self.step_count = 0
+        self.reset_report()
+
+    def reset_report(self):
+        """Starts counting what happens in a step."""
+        self.report = {"moves": 0, "blocked_light": 0, "blocked_car": 0, "arrivals": 0, "spawns": 0,
+                       "travel_time": 0, "trips": [], "left": [], "entered": []}
+
+    def signal_events(self, cells, entered):
+        cells = cells[self.signal_cells[cells]]
+        if len(cells):
+            self.report["entered" if entered else "left"].append(cells)
+
+    def keep_cars(self, keep):
+        for name in CAR_FIELDS:
+            self.cars[name] = self.cars[name][keep]
+
+    def add_cars(self, cars):
+        for name in CAR_FIELDS:
+            self.cars[name] = np.concatenate([self.cars[name], cars[name]])
+
+    def propose(self, step_count, light_cells, light_states, halo_occupied):
+        """
+        First round of a step: applies the light changes and the halo, removes the arrived cars and picks
+        the next cell of every car. Returns the claims on cells of other tiles (car fields, "targets", "keys").
+        """
+        self.step_count = step_count
+        self.red[light_cells] = ~light_states
+        self.occupied[self.halo] = halo_occupied
+        cars = self.cars
+
+        arrived = self.distances[cars["goals"], cars["cells"]] <= 0
+        if arrived.any():
+            self.occupied[cars["cells"][arrived]] = False
+            self.signal_events(cars["cells"][arrived], entered=False)
+            self.report["arrivals"] += int(arrived.sum())
+            self.report["travel_time"] += int((step_count - cars["spawn_steps"][arrived]).sum())
+            self.report["trips"] += [(f"car_{car_id}", spawn_step, step_count, travelled) for car_id, spawn_step, travelled
+                                     in zip(cars["ids"][arrived].tolist(), cars["spawn_steps"][arrived].tolist(),
+                                            cars["travelled"][arrived].tolist())]
+            self.keep_cars(~arrived)
+            cars = self.cars
+
+        # Same choice as ArrayCityModel.move_cars, the conflicts are solved in resolve
+        cells, goals = cars["cells"], cars["goals"]
+        options = self.successors[cells]
+        closer = self.distances[goals, cells] - 1
+        option_distances = self.distances[goals[:, None], options]
+        closer_options = (options >= 0) & (option_distances == closer[:, None])
+        valid = closer_options & ~self.occupied[options] & ~self.red[options]
+        self.car_in_the_way = valid.any(axis=1) | (closer_options & self.occupied[options]).any(axis=1)
+
+        keys = np.where(valid, self.rng.random(valid.shape), -1.0)
+        choice = keys.argmax(axis=1)
+        self.moving = np.flatnonzero(valid.any(axis=1))
+        self.targets = options[self.moving, choice[self.moving]]
+        self.keys = self.rng.random(len(self.moving))
+        self.n_cars = len(cells)
+
+        foreign = ~self.own[self.targets]
+        self.outgoing = self.moving[foreign]
+        claims = {name: cars[name][self.outgoing] for name in CAR_FIELDS}
+        claims["targets"] = self.targets[foreign]
+        claims["keys"] = self.keys[foreign]
+        return claims
+
+    def resolve(self, claims):
+        """
+        Second round: decides every claim on the cells of the tile (the ones of its cars and the ones
+        of other tiles), moves the winners and adopts the cars of other tiles that won.
+        Returns which of the claims of other tiles won.
+        """
+        local = self.own[self.targets]
+        local_cars = self.moving[local]
+        local_targets = self.targets[local]
+        targets = np.concatenate([local_targets, claims["targets"]])
+        keys = np.concatenate([self.keys[local], claims["keys"]])
+
+        # The highest key wins each cell
+        order = np.argsort(-keys, kind="stable")
+        _, first = np.unique(targets[order], return_index=True)
+        winners = order[first]
+        local_winners = winners[winners < len(local_cars)]
+        cars = local_cars[local_winners]
+        new_cells = local_targets[local_winners]
+
+        cells = self.cars["cells"]
+        self.occupied[cells[cars]] = False
+        self.occupied[new_cells] = True
+        self.signal_events(cells[cars], entered=False)
+        self.signal_events(new_cells, entered=True)
+        cells[cars] = new_cells
+        self.cars["travelled"][cars] += 1
+        self.moved = np.zeros(self.n_cars, dtype=bool)
+        self.moved[cars] = True
+
+        won = np.zeros(len(claims["targets"]), dtype=bool)
+        won[winners[winners >= len(local_cars)] - len(local_cars)] = True
+        if won.any():
+            adopted = {name: claims[name][won] for name in CAR_FIELDS}
+            adopted["cells"] = claims["targets"][won]
+            adopted["travelled"] = adopted["travelled"] + 1
+            self.occupied[adopted["cells"]] = True
+            self.signal_events(adopted["cells"], entered=True)
+            # Adopted cars go after the cars of the step, so the indexes of moving and moved still hold
+            self.add_cars(adopted)
+        return won
+
+    def commit(self, won):
+        """
+        Last round: removes the cars whose claims on other tiles won and spawns cars on spawn steps.
+        Returns the report of the step and the occupancy of the border cells.
+        """
+        leaving = self.outgoing[won]
+        self.moved[leaving] = True
+        self.report["moves"] += int(self.moved.sum())
+        in_the_way = self.car_in_the_way
+        self.report["blocked_car"] += int((~self.moved & in_the_way).sum())
+        self.report["blocked_light"] += int((~self.moved & ~in_the_way).sum())
+
+        if len(leaving):
+            cells = self.cars["cells"][leaving]
+            self.occupied[cells] = False
+            self.signal_events(cells, entered=False)
+            keep = np.ones(len(self.cars["ids"]), dtype=bool)
+            keep[leaving] = False
+            self.keep_cars(keep)
+
+        if self.step_count % self.spawn_interval == 0:
+            self.spawn()
+        return self.finish_report()
+
+    def spawn(self):
+        """Creates a new car in each free corner of the tile."""
+        free = self.corner_cells[~self.occupied[self.corner_cells]]
+        if len(free) == 0 or len(self.distances) == 0:
+            return
+        serials = np.arange(self.next_car, self.next_car + len(free))
+        self.add_cars({
+            "ids": serials * self.n_tiles + self.index,
+            "cells": free,
+            "goals": self.rng.integers(0, len(self.distances), len(free)),
+            "spawn_steps": np.full(len(free), self.step_count),
+            "travelled": np.zeros(len(free), dtype=np.int64)})
+        self.occupied[free] = True
+        self.signal_events(free, entered=True)
+        self.report["spawns"] += len(free)
+        self.next_car += len(free)
+
+    def finish_report(self):
+        report = self.report
+        for name in ("left", "entered"):
+            report[name] = np.concatenate(report[name]) if report[name] else np.zeros(0, dtype=np.int64)
+        report["in_flight"] = len(self.cars["ids"])
+        report["border_occupied"] = self.occupied[self.border]
+        self.reset_report()
+        return report
+
+    def start(self):
+        """Spawns the first cars and returns the report (like commit)."""
+        self.spawn()
+        return self.finish_report()
+
+    def positions(self):
+        """Returns the ids and cells of the cars."""
+        return self.cars["ids"], self.cars["cells"]
+
+    def state(self):
+        """Returns the cars, the car counter and the random numbers of the tile, for snapshots."""
+        return {"cars": {name: values.tolist() for name, values in self.cars.items()},
+                "next_car": self.next_car, "random": self.rng.bit_generator.state}
+
+    def load_state(self, state, step_count, light_cells, light_states):
+        """Replaces the cars with the ones of state(), sets the states of the lights and returns the report (like commit)."""
+        self.red[light_cells] = ~light_states
+        self.cars = {name: np.array(values, dtype=np.int64) for name, values in state["cars"].items()}
+        self.next_car = state["next_car"]
+        self.rng.bit_generator.state = state["random"]
+        self.step_count = step_count
+        self.occupied[self.own] = False
+        self.occupied[self.cars["cells"]] = True
+        self.reset_report()
+        return self.finish_report()
+
+
+def _tile_main(conn):
+    """
+    Loop of a worker process. The first message (None, args) creates its tile, the next ones
+    (method, args) call a method of the tile and are answered with (ok, result).
+    """
+    tile = None
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, args = message
+        try:
+            if method is None:
+                tile = Tile(*args)
+                result = None
+            else:
+                result = getattr(tile, method)(*args)
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, repr(e)))
+
+
+def _close_workers(connections, processes, blocks):
+    for conn in connections:
+        try:
+            conn.send(None)
+        except OSError:
+            pass  # The process already ended
+    for process in processes:
+        process.join(timeout=5)
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class TiledCityModel(CityModelMixin):
+    """
+        Version of ArrayCityModel that steps the tiles of the map in parallel worker processes
+        (see the description of tiled_model.py). It has the same methods, so the server can use it
+        like any other model.
+
+        Args:
+            N: Number of agents in the simulation (no se usa actualmente)
+            map_file: Path of the map file (text or compiled .cmap)
+            spawn_interval: Every how many steps new cars are created in the corners
+            light_time: timeToChange of every traffic light (None keeps the one from mapDictionary.json)
+            seed: Seed for the random numbers
+            signals: How traffic lights are switched, "fixed", "green_wave" or "adaptive" (see CityModel)
+            telemetry_file: File where the telemetry of every step and trip is appended (optional, not kept in snapshots)
+            tiles: Number of tiles (and worker processes), None for one per core
+    """
+    def __init__(self, N, map_file=DEFAULT_MAP, spawn_interval=10, light_time=None, seed=None, signals="fixed",
+                 telemetry_file=None, tiles=None):
+        tiles = tiles or multiprocessing.cpu_count()
+        # Parameters needed to build the same model again (see snapshot)
+        self.params = {"map_file": map_file, "spawn_interval": spawn_interval, "light_time": light_time,
+                       "signals": signals, "tiles": tiles}
+        self.spawn_interval = spawn_interval
+        self.total_arrived = 0
+        # Sum of the steps that the arrived cars took to reach their destination
+        self.total_travel_time = 0
+
+        self.city_map = CityMap.load(map_file)
+        self.width = self.city_map.width
+        self.height = self.city_map.height
+        self.road_graph = self.city_map.road_graph()
+        n_cells = self.width * self.height
+
+        self.light_ids = [light_id for light_id, _, _, _ in self.city_map.lights]
+        self.light_cells = np.array([self.road_graph.index(pos) for _, pos, _, _ in self.city_map.lights], dtype=np.int64)
+        self.signal_controller = SignalController(self.city_map, light_time, self.road_graph, signals)
+        signal_cells = sorted(set(self.signal_controller.approach_light) | set(self.signal_controller.light_of_cell))
+
+        # Tiles: a grid of columns x rows, owner[i] is the tile of cell i
+        columns, rows = tile_grid(tiles)
+        columns, rows = min(columns, self.width), min(rows, self.height)
+        x_edges = np.linspace(0, self.width, columns + 1).astype(np.int64)
+        y_edges = np.linspace(0, self.height, rows + 1).astype(np.int64)
+        x, y = np.divmod(np.arange(n_cells), self.height)
+        self.owner = (np.searchsorted(x_edges, x, side="right") - 1) * rows + np.searchsorted(y_edges, y, side="right") - 1
+        self.n_tiles = columns * rows
+
+        # The halo of a tile are the cells of other tiles where its cars can move
+        self.halos = []
+        in_halo = np.zeros(n_cells, dtype=bool)
+        for tile in range(self.n_tiles):
+            own_cells = np.flatnonzero(self.owner == tile)
+            reachable = np.array([successor for cell in own_cells.tolist() for successor in self.road_graph.successors[cell]], dtype=np.int64)
+            halo = np.unique(reachable[self.owner[reachable] != tile]) if len(reachable) else np.zeros(0, dtype=np.int64)
+            self.halos.append(halo)
+            in_halo[halo] = True
+        self.borders = [np.flatnonzero(in_halo & (self.owner == tile)) for tile in range(self.n_tiles)]
+        self.border_occupied = np.zeros(n_cells, dtype=bool)
+
+        # The arrays that the cars follow are the same for every tile, they are computed once and shared
+        blocks, array_specs = [], []
+        for array in movement_arrays(self.road_graph):
+            block, spec = share_array(array)
+            blocks.append(block)
+            array_specs.append(spec)
+        red_cells = self.light_cells[[not state for _, _, state, _ in self.city_map.lights]]
+        self.corners = [(0, 0), (self.width - 1, 0), (0, self.height - 1), (self.width - 1, self.height - 1)]
+        corner_cells = [self.road_graph.index(corner) for corner in self.corners]
+
+        # spawn: forking a process with Flask threads running is not safe
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        processes = []
+        seeds = np.random.SeedSequence(seed).spawn(self.n_tiles)
+        for tile in range(self.n_tiles):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_tile_main, args=(child_conn,), daemon=True)
+            process.start()
+            self.connections.append(conn)
+            processes.append(process)
+        self._finalizer = weakref.finalize(self, _close_workers, self.connections, processes, blocks)
+
+        args = []
+        for tile in range(self.n_tiles):
+            column, row = divmod(tile, rows)
+            bounds = (x_edges[column], x_edges[column + 1], y_edges[row], y_edges[row + 1])
+            args.append((tile, self.n_tiles, array_specs, self.height, [int(value) for value in bounds], self.halos[tile],
+                         self.borders[tile], signal_cells, red_cells, corner_cells, spawn_interval, seeds[tile]))
+        self.call_tiles(None, args)
+
+        # Initialize step counters
+        self.steps = 0
+        self.step_count = 0
+        self.in_flight = 0
+        self.telemetry = Telemetry(telemetry_file)
+        self.profiler = Profiler()
+
+        # Create a car in each corner at the start
+        self.apply_reports(self.call_tiles("start", [()] * self.n_tiles))
+        self.running = True
+
+    def call_tiles(self, method, args):
+        """Calls a method on every tile with its own arguments (args[i] for tile i), in parallel, and returns the results."""
+        for conn, tile_args in zip(self.connections, args):
+            conn.send((method, tile_args))
+        results = []
+        for conn in self.connections:
+            ok, result = conn.recv()
+            if not ok:
+                raise RuntimeError(result)
+            results.append(result)
+        return results
+
+    def close(self):
+        """Stops the worker processes and closes the telemetry file."""
+        self._finalizer()
+        super().close()
+
+    def step(self):
+        '''Advance the model by one step.'''
+        # Same counters as CityModel: step_count is increased first, steps (used by the lights) at the end
+        self.step_count += 1
+        profiler = self.profiler
+        with profiler.phase("lights"):
+            changed = self.signal_controller.step(self.steps) if self.signal_controller.next_change <= self.steps else []
+            light_cells = self.light_cells[changed]
+            light_states = np.array([self.signal_controller.states[light] for light in changed], dtype=bool)
+
+        with profiler.phase("propose"):
+            claims = self.call_tiles("propose", [
+                (self.step_count, light_cells, light_states, self.border_occupied[halo]) for halo in self.halos])
+
+        with profiler.phase("resolve"):
+            # Every claim goes to the tile that owns its cell
+            incoming = [[] for _ in range(self.n_tiles)]
+            for source, tile_claims in enumerate(claims):
+                owners = self.owner[tile_claims["targets"]]
+                for target in np.unique(owners).tolist():
+                    indexes = np.flatnonzero(owners == target)
+                    incoming[target].append((source, indexes, {name: values[indexes] for name, values in tile_claims.items()}))
+            args = []
+            for tile_claims in incoming:
+                names = list(claims[0])
+                args.append(({name: np.concatenate([claim[name] for _, _, claim in tile_claims]) if tile_claims
+                              else np.zeros(0, dtype=np.float64 if name == "keys" else np.int64) for name in names},))
+            results = self.call_tiles("resolve", args)
+
+        with profiler.phase("commit"):
+            # Results go back to the tile of every claim
+            won = [np.zeros(len(tile_claims["targets"]), dtype=bool) for tile_claims in claims]
+            for target, tile_claims in enumerate(incoming):
+                start = 0
+                for source, indexes, _ in tile_claims:
+                    won[source][indexes] = results[target][start:start + len(indexes)]
+                    start += len(indexes)
+            self.apply_reports(self.call_tiles("commit", [(tile_won,) for tile_won in won]))
+        self.steps += 1
+
+        self.telemetry.end_step(self.step_count, self.in_flight)
+        profiler.end_step(self.step_count)
+
+    def apply_reports(self, reports):
+        """Adds what happened in the tiles to the totals, the telemetry, the signal controller and the halos."""
+        telemetry = self.telemetry
+        self.in_flight = 0
+        for tile, report in enumerate(reports):
+            self.total_arrived += report["arrivals"]
+            self.total_travel_time += report["travel_time"]
+            telemetry.moves += report["moves"]
+            telemetry.blocked_light += report["blocked_light"]
+            telemetry.blocked_car += report["blocked_car"]
+            telemetry.arrivals += report["arrivals"]
+            telemetry.spawns += report["spawns"]
+            for trip in report["trips"]:
+                telemetry.trip(*trip)
+            for cell in report["left"].tolist():
+                self.signal_controller.car_left(cell, self.step_count)
+            for cell in report["entered"].tolist():
+                self.signal_controller.car_entered(cell, self.step_count)
+            self.border_occupied[self.borders[tile]] = report["border_occupied"]
+            self.in_flight += report["in_flight"]
+
+    def car_arrays(self):
+        """Returns the ids and cells of every car, gathered from the tiles."""
+        positions = self.call_tiles("positions", [()] * self.n_tiles)
+        return np.concatenate([ids for ids, _ in positions]), np.concatenate([cells for _, cells in positions])
+
+    def car_positions(self):
+        """Returns (id, pos) for every car."""
+        ids, cells = self.car_arrays()
+        return [(f"car_{car_id}", self.road_graph.position(cell)) for car_id, cell in zip(ids.tolist(), cells.tolist())]
+
+    def car_changes(self, since=None):
+        """Same interface as CityModel.car_changes, but changes are not tracked: every car is always sent."""
+        return self.step_count, True, self.car_positions(), [], []
+
+    def frame_arrays(self):
+        """Same as CityModel.frame_arrays."""
+        ids, cells = self.car_arrays()
+        x, z = np.divmod(cells, self.height)
+        positions = np.column_stack([x, np.ones_like(x), z]).astype("<f4")
+        return ids.astype("<u4"), positions, np.frombuffer(bytes(self.signal_controller.states), dtype=np.uint8)
+
+    def traffic_light_states(self):
+        """Returns (id, pos, state) for every traffic light."""
+        return [(light_id, self.road_graph.position(cell), bool(state))
+                for light_id, cell, state in zip(self.light_ids, self.light_cells.tolist(), self.signal_controller.states)]
+
+    def snapshot(self):
+        """Returns the complete state of the model as a compact snapshot (see snapshot.py and CityModel.snapshot)."""
+        return dump_snapshot({
+            "engine": "tiled",
+            "params": snapshot_params(self.params),
+            "step_count": self.step_count,
+            "steps": self.steps,
+            "total_arrived": self.total_arrived,
+            "total_travel_time": self.total_travel_time,
+            "tiles": self.call_tiles("state", [()] * self.n_tiles),
+            "signals": self.signal_controller.state(),
+            "telemetry": self.telemetry.state()})
+
+    @classmethod
+    def from_state(cls, state, telemetry_file=None):
+        """Creates a model from the state of a snapshot (already read with load_snapshot, see CityModel.from_state)."""
+        model = cls(5, **restore_params(state), telemetry_file=telemetry_file)
+        model.step_count = state["step_count"]
+        model.steps = state["steps"]
+        model.signal_controller.load_state(state["signals"])
+        model.telemetry.load_state(state["telemetry"])
+        # The tiles start with the lights of the map, they get the ones of the snapshot
+        light_states = np.array(model.signal_controller.states, dtype=bool)
+        reports = model.call_tiles("load_state", [(tile_state, model.step_count, model.light_cells, light_states)
+                                                  for tile_state in state["tiles"]])
+        model.border_occupied[:] = False
+        for tile, report in enumerate(reports):
+            model.border_occupied[model.borders[tile]] = report["border_occupied"]
+        model.in_flight = sum(report["in_flight"] for report in reports)
+        model.total_arrived = state["total_arrived"]
+        model.total_travel_time = state["total_travel_time"]
+        return model
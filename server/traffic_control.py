@@ -0,0 +1,333 @@
+# traffic_control.py
+
+import heapq
+from collections import deque
+
+# Cells before a light that count as its approach (where its queue is counted)
+APPROACH_LENGTH = 5
+# Adaptive signals: shortest green, longest green (times the phase duration) and steps added to a green that still has cars
+MIN_GREEN = 2
+MAX_GREEN_FACTOR = 2
+EXTENSION = 1
+
+class Junction:
+    """
+    Traffic lights of one junction, switched together following a phase table.
+    """
+    def __init__(self, lights, phases, durations, offset=0):
+        """
+        Creates a junction.
+        Args:
+            lights: Indexes of the lights of the junction (in the order of CityMap.lights)
+            phases: phases[p] holds the state of every light of the junction during phase p
+            durations: durations[p] is the number of steps that phase p lasts
+            offset: Step of the first phase change
+        """
+        self.lights = lights
+        self.phases = phases
+        self.durations = durations
+        self.offset = offset
+        # Phase 0 holds the states of the map, until the first change
+        self.phase = 0
+        self.phase_started = 0
+        self.changes = 0
+
+    @property
+    def cycle(self):
+        """Steps to go through every phase."""
+        return sum(self.durations)
+
+    def green_phase(self, light):
+        """First phase where a light of the junction is green, or None if it never is."""
+        position = self.lights.index(light)
+        for phase, states in enumerate(self.phases):
+            if states[position]:
+                return phase
+        return None
+
+    def green_lights(self):
+        """Lights that are green in the current phase."""
+        return [light for light, state in zip(self.lights, self.phases[self.phase]) if state]
+
+    def phase_start(self, phase):
+        """Steps from the offset until the phase starts for the first time (the first change enters phase 1)."""
+        ticks = 0
+        current = 1 % len(self.phases)
+        while current != phase:
+            ticks += self.durations[current]
+            current = (current + 1) % len(self.phases)
+        return ticks
+
+
+class SignalController:
+    """
+    Switches every traffic light of the map.
+    The lights of each junction (CityMap.light_groups) change together on the steps of its phase
+    table, which are kept in a heap, so a step without changes costs a single comparison.
+    By default every junction has two phases (the states of the map and the opposite ones) of
+    timeToChange steps each, changing on the steps multiple of timeToChange.
+
+    With a road graph, the controller also counts the cars queued on the approach of every light.
+    The model reports every car that enters or leaves a cell (car_entered, car_left), so the
+    counters are never recomputed from the grid.
+    """
+    def __init__(self, city_map, light_time=None, road_graph=None, mode="fixed"):
+        """
+        Creates the controller.
+        Args:
+            city_map: CityMap with the lights and their groups
+            light_time: Steps of every phase (None keeps the timeToChange of the map)
+            road_graph: RoadGraph of the map, needed for the queues and the green wave
+            mode: "fixed" (the phase table as it is), "green_wave" (offsets that make green waves, see
+                plan_green_wave) or "adaptive" (greens extended or cut by the queues, see should_change)
+        """
+        if mode not in ("fixed", "green_wave", "adaptive"):
+            raise ValueError(f"Unknown signal mode {mode!r}")
+        if mode != "fixed" and road_graph is None:
+            raise ValueError(f"Signal mode {mode!r} needs the road graph")
+        self.mode = mode
+        # State of every light, in the order of city_map.lights
+        self.states = bytearray(state for _, _, state, _ in city_map.lights)
+        self.light_positions = [pos for _, pos, _, _ in city_map.lights]
+
+        lights_by_group = {}
+        for light, group in enumerate(city_map.light_groups):
+            lights_by_group.setdefault(group, []).append(light)
+
+        self.junctions = []
+        for lights in lights_by_group.values():
+            states = tuple(self.states[light] for light in lights)
+            # Each junction takes the timeToChange of its first light
+            duration = light_time or city_map.lights[lights[0]][3]
+            self.junctions.append(Junction(lights, [states, tuple(1 - state for state in states)], [duration, duration]))
+
+        # Queues: cars on the approach of every light, and the car-steps they spent there (delay)
+        self.light_of_cell = {road_graph.index(pos): light for light, pos in enumerate(self.light_positions)} if road_graph is not None else {}
+        self.approach_light = self.find_approaches(road_graph) if road_graph is not None else {}
+        self.crossing_light = self.find_crossings(road_graph) if road_graph is not None else {}
+        self.queues = [0] * len(self.states)
+        self.max_queues = [0] * len(self.states)
+        self.delays = [0] * len(self.states)
+        self.queue_since = [0] * len(self.states)
+        # Last step a car entered each light
+        self.last_crossing = [-1] * len(self.states)
+
+        if mode == "green_wave":
+            self.plan_green_wave(road_graph)
+        self.schedule_changes()
+
+    def schedule_changes(self):
+        """Builds the heap of (step, junction) of the next phase change of every junction."""
+        self.changes = [(junction.offset, index) for index, junction in enumerate(self.junctions)]
+        heapq.heapify(self.changes)
+
+    @property
+    def next_change(self):
+        """Step of the next phase change (infinite if the map has no lights)."""
+        return self.changes[0][0] if self.changes else float("inf")
+
+    def step(self, tick):
+        """
+        Applies the phase changes due at tick and returns the indexes of the lights that changed.
+        """
+        changed = []
+        changes = self.changes
+        while changes and changes[0][0] <= tick:
+            _, index = heapq.heappop(changes)
+            junction = self.junctions[index]
+            if self.mode == "adaptive" and not self.should_change(junction, tick):
+                heapq.heappush(changes, (tick + EXTENSION, index))
+                continue
+            junction.phase = (junction.phase + 1) % len(junction.phases)
+            junction.phase_started = tick
+            junction.changes += 1
+            for light, state in zip(junction.lights, junction.phases[junction.phase]):
+                if self.states[light] != state:
+                    self.states[light] = state
+                    changed.append(light)
+            duration = junction.durations[junction.phase]
+            if self.mode == "adaptive":
+                duration = min(MIN_GREEN, duration)
+            heapq.heappush(changes, (tick + duration, index))
+        return changed
+
+    def state(self):
+        """Returns what changes while the simulation runs (light states, phases and queues), for snapshots."""
+        return {
+            "states": list(self.states),
+            "junctions": [[junction.phase, junction.phase_started, junction.changes, junction.offset, junction.durations]
+                          for junction in self.junctions],
+            "changes": self.changes,
+            "queues": self.queues,
+            "max_queues": self.max_queues,
+            "delays": self.delays,
+            "queue_since": self.queue_since,
+            "last_crossing": self.last_crossing}
+
+    def load_state(self, state):
+        """Sets the state returned by state() on a controller of the same map."""
+        self.states[:] = bytes(state["states"])
+        for junction, (phase, phase_started, changes, offset, durations) in zip(self.junctions, state["junctions"]):
+            junction.phase = phase
+            junction.phase_started = phase_started
+            junction.changes = changes
+            junction.offset = offset
+            junction.durations = durations
+        # A list that was a heap is still a heap
+        self.changes = [tuple(change) for change in state["changes"]]
+        self.queues = list(state["queues"])
+        self.max_queues = list(state["max_queues"])
+        self.delays = list(state["delays"])
+        self.queue_since = list(state["queue_since"])
+        self.last_crossing = list(state["last_crossing"])
+
+    def should_change(self, junction, tick):
+        """
+        Adaptive signals: decides if a junction whose green lasted at least MIN_GREEN steps changes
+        phase now. The green goes on while nobody waits on red, or while its approaches have more
+        cars than the red ones and they are still crossing (a car entered a green light in the last
+        EXTENSION steps), so a flowing approach can keep its green past the fixed duration, up to
+        MAX_GREEN_FACTOR times it. Otherwise the green is cut as soon as somebody waits on red.
+        """
+        if tick - junction.phase_started >= MAX_GREEN_FACTOR * junction.durations[junction.phase]:
+            return True
+        green = junction.green_lights()
+        green_queue = sum(self.queues[light] for light in green)
+        waiting = sum(self.queues[light] for light in junction.lights) - green_queue
+        if waiting == 0:
+            return False
+        flowing = any(tick - self.last_crossing[light] <= EXTENSION for light in green)
+        return not (flowing and green_queue > waiting)
+
+    def find_approaches(self, road_graph):
+        """
+        Assigns to its closest light every cell up to APPROACH_LENGTH moves before a light.
+        Returns {cell index: light index}.
+        """
+        approach_light = {}
+        distance = {cell: 0 for cell in self.light_of_cell}
+        queue = deque(self.light_of_cell.items())
+        while queue:
+            cell, light = queue.popleft()
+            if distance[cell] == APPROACH_LENGTH:
+                continue
+            for previous in road_graph.predecessors[cell]:
+                if previous in distance:
+                    continue
+                distance[previous] = distance[cell] + 1
+                approach_light[previous] = light
+                queue.append((previous, light))
+        return approach_light
+
+    def find_crossings(self, road_graph):
+        """
+        Finds the light cells that lead into a light of the same junction that is green in other phases.
+        A car on one of them is inside the junction, but it waits for that light like the cars of its
+        approach, so it is counted in its queue. Returns {cell index: light index}.
+        """
+        phase_of_light = {}
+        for junction in self.junctions:
+            for light in junction.lights:
+                phase_of_light[light] = (junction, junction.green_phase(light))
+        crossing_light = {}
+        for cell, light in self.light_of_cell.items():
+            for previous in road_graph.predecessors[cell]:
+                other = self.light_of_cell.get(previous)
+                if other is None or previous in crossing_light:
+                    continue
+                junction, phase = phase_of_light[light]
+                other_junction, other_phase = phase_of_light[other]
+                if junction is other_junction and phase != other_phase:
+                    crossing_light[previous] = light
+        return crossing_light
+
+    def car_entered(self, cell, tick):
+        """A car entered the cell (index) at tick."""
+        light = self.approach_light.get(cell)
+        if light is not None:
+            self._count(light, tick, 1)
+        else:
+            light = self.light_of_cell.get(cell)
+            if light is not None:
+                self.last_crossing[light] = tick
+                light = self.crossing_light.get(cell)
+                if light is not None:
+                    self._count(light, tick, 1)
+
+    def car_left(self, cell, tick):
+        """A car left the cell (index) at tick."""
+        light = self.approach_light.get(cell, self.crossing_light.get(cell))
+        if light is not None:
+            self._count(light, tick, -1)
+
+    def _count(self, light, tick, change):
+        # The delay grows with the cars that were in the queue since its last change
+        self.delays[light] += self.queues[light] * (tick - self.queue_since[light])
+        self.queue_since[light] = tick
+        self.queues[light] += change
+        if self.queues[light] > self.max_queues[light]:
+            self.max_queues[light] = self.queues[light]
+
+    def junction_stats(self, tick):
+        """
+        Returns a dictionary per junction with its lights, current phase and number of phase changes,
+        and its queues: cars in the approaches now, the longest queue one of its lights has had,
+        and the delay (car-steps spent in the approaches) up to tick.
+        """
+        stats = []
+        for index, junction in enumerate(self.junctions):
+            delay = sum(self.delays[light] + self.queues[light] * (tick - self.queue_since[light]) for light in junction.lights)
+            stats.append({
+                "junction": index,
+                "lights": list(junction.lights),
+                "phase": junction.phase,
+                "changes": junction.changes,
+                "queue": sum(self.queues[light] for light in junction.lights),
+                "max_queue": max(self.max_queues[light] for light in junction.lights),
+                "delay": delay,
+                "mean_queue": delay / tick if tick else 0})
+        return stats
+
+    def plan_green_wave(self, road_graph):
+        """
+        Sets the offsets of the junctions to make green waves: a car that crosses a junction when
+        it turns green and drives one cell per step finds the next junction on its way turning green too.
+        Junctions are timed in the order a breadth-first search over the road graph reaches them,
+        starting at the lights of an untimed junction that turn green with its first change.
+        """
+        light_of_cell = {road_graph.index(pos): light for light, pos in enumerate(self.light_positions)}
+        junction_of_light = {}
+        for index, junction in enumerate(self.junctions):
+            for light in junction.lights:
+                junction_of_light[light] = index
+
+        timed = [False] * len(self.junctions)
+        for root, junction in enumerate(self.junctions):
+            if timed[root]:
+                continue
+            timed[root] = True
+            junction.offset = 0
+            first_phase = 1 % len(junction.phases)
+            sources = [road_graph.index(self.light_positions[light])
+                       for light, state in zip(junction.lights, junction.phases[first_phase]) if state]
+
+            # Steps after the root turns green at which a car reaches each cell
+            reached = {cell: 0 for cell in sources}
+            queue = deque(sources)
+            while queue:
+                cell = queue.popleft()
+                for successor in road_graph.successors[cell]:
+                    if successor in reached:
+                        continue
+                    reached[successor] = reached[cell] + 1
+                    queue.append(successor)
+
+                    light = light_of_cell.get(successor)
+                    if light is None or timed[junction_of_light[light]]:
+                        continue
+                    other = self.junctions[junction_of_light[light]]
+                    phase = other.green_phase(light)
+                    if phase is None:
+                        continue
+                    timed[junction_of_light[light]] = True
+                    other.offset = (reached[successor] - other.phase_start(phase)) % other.cycle
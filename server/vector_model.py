@@ -0,0 +1,327 @@
+# vector_model.py
+
+import numpy as np
+from routing import backward_search, UNREACHABLE
+from city_map import CityMap, DEFAULT_MAP
+from traffic_control import SignalController
+from telemetry import Telemetry
+from profiling import Profiler
+from snapshot import dump_snapshot, snapshot_params, restore_params
+from model_base import CityModelMixin
+
+def successor_array(road_graph):
+    """successors[i] holds up to 8 cells a car can move to from cell i (-1 means none)."""
+    successors = np.full((road_graph.width * road_graph.height, 8), -1, dtype=np.int32)
+    for cell, cells in enumerate(road_graph.successors):
+        successors[cell, :len(cells)] = cells
+    return successors
+
+
+def empty_distances(road_graph):
+    """
+    Returns the array for the distance fields, not computed yet (see fill_distances):
+    distances[d, i] will be the number of moves from cell i to destination d (in the order of road_graph.destinations).
+    The rows are only written when they are filled, so the ones that are never used don't take memory.
+    """
+    n_cells = road_graph.width * road_graph.height
+    distances = np.empty((len(road_graph.destinations), n_cells + 1), dtype=np.int32)
+    # Cells outside the map (-1 successors) are sent to an extra column that is never closer
+    distances[:, n_cells] = UNREACHABLE
+    return distances
+
+
+def fill_distances(road_graph, distances, goals):
+    """Computes the rows of distances of the destinations goals (indexes in road_graph.destinations)."""
+    n_cells = road_graph.width * road_graph.height
+    for goal in goals:
+        field = backward_search(road_graph, road_graph.index(road_graph.destinations[goal]))
+        distances[goal, :n_cells] = np.frombuffer(field, dtype=np.int32)
+
+
+def movement_arrays(road_graph):
+    """
+    Returns the arrays that the cars follow, (successors, distances), with the field of every destination computed.
+    See successor_array and empty_distances.
+    """
+    distances = empty_distances(road_graph)
+    fill_distances(road_graph, distances, range(len(distances)))
+    return successor_array(road_graph), distances
+
+
+class ArrayCityModel(CityModelMixin):
+    """
+        Array based version of CityModel.
+        The map, the traffic lights and the cars live in NumPy arrays and every step is computed
+        for all the cars at once, instead of calling step() on one agent at a time.
+        Cars are routed with the distance fields of their destinations (like routing="field"),
+        computed the first time a car goes to each destination.
+
+        Args:
+            N: Number of agents in the simulation (no se usa actualmente)
+            map_file: Path of the map file (text or compiled .cmap)
+            spawn_interval: Every how many steps new cars are created in the corners
+            light_time: timeToChange of every traffic light (None keeps the one from mapDictionary.json)
+            seed: Seed for the random numbers
+            signals: How traffic lights are switched, "fixed", "green_wave" or "adaptive" (see CityModel)
+            telemetry_file: File where the telemetry of every step and trip is appended (optional, not kept in snapshots)
+    """
+    def __init__(self, N, map_file=DEFAULT_MAP, spawn_interval=10, light_time=None, seed=None, signals="fixed",
+                 telemetry_file=None):
+        self.rng = np.random.default_rng(seed)
+        # Parameters needed to build the same model again (see snapshot)
+        self.params = {"map_file": map_file, "spawn_interval": spawn_interval, "light_time": light_time, "signals": signals}
+        self.spawn_interval = spawn_interval
+
+        self.total_arrived = 0
+        # Sum of the steps that the arrived cars took to reach their destination
+        self.total_travel_time = 0
+
+        # Load the map file into the static layer. Each character represents a cell.
+        self.city_map = CityMap.load(map_file)
+        self.width = self.city_map.width
+        self.height = self.city_map.height
+
+        self.road_graph = self.city_map.road_graph()
+        n_cells = self.width * self.height
+
+        light_ids = [light_id for light_id, _, _, _ in self.city_map.lights]
+        light_cells = [self.road_graph.index(pos) for _, pos, _, _ in self.city_map.lights]
+        light_states = [state for _, _, state, _ in self.city_map.lights]
+
+        self.light_ids = light_ids
+        self.light_cells = np.array(light_cells, dtype=np.int64)
+        self.light_states = np.array(light_states, dtype=bool)
+        self.red = np.zeros(n_cells, dtype=bool)
+        self.red[self.light_cells] = ~self.light_states
+        self.signal_controller = SignalController(self.city_map, light_time, self.road_graph, signals)
+        # Cells of the lights and their approaches, to report only the moves the controller counts
+        self.signal_cells = np.zeros(n_cells, dtype=bool)
+        self.signal_cells[list(self.signal_controller.approach_light)] = True
+        self.signal_cells[list(self.signal_controller.light_of_cell)] = True
+
+        self.successors = successor_array(self.road_graph)
+        self.distances = empty_distances(self.road_graph)
+        # Destinations whose row of distances is already computed
+        self.has_distances = np.zeros(len(self.distances), dtype=bool)
+
+        # Cars: one entry per car in each array
+        self.car_ids = np.zeros(0, dtype=np.int64)
+        self.car_cells = np.zeros(0, dtype=np.int64)
+        self.car_goals = np.zeros(0, dtype=np.int64)
+        self.car_spawn_steps = np.zeros(0, dtype=np.int64)
+        self.car_travelled = np.zeros(0, dtype=np.int64)
+        self.occupied = np.zeros(n_cells, dtype=bool)
+        self.next_car_id = 0
+
+        # Define the coordinates of the four corners
+        self.corners = [
+            (0, 0),  # Bottom Left
+            (self.width - 1, 0),  # Bottom Right
+            (0, self.height - 1),  # Top Left
+            (self.width - 1, self.height - 1)  # Top Right
+        ]
+        self.corner_cells = np.array([self.road_graph.index(corner) for corner in self.corners], dtype=np.int64)
+
+        # Initialize step counters
+        self.steps = 0
+        self.step_count = 0
+        self.telemetry = Telemetry(telemetry_file)
+        self.profiler = Profiler()
+
+        # Create a car in each corner at the start
+        self.create_cars_in_corners()
+
+        self.running = True
+
+    def step(self):
+        '''Advance the model by one step.'''
+        # Same counters as CityModel: step_count is increased first, steps (used by the lights) at the end
+        self.step_count += 1
+        profiler = self.profiler
+        with profiler.phase("lights"):
+            self.update_traffic_lights()
+        with profiler.phase("arrivals"):
+            self.remove_arrived_cars()
+        with profiler.phase("cars"):
+            self.move_cars()
+        self.steps += 1
+
+        # Every spawn_interval steps, create a new car in each available corner
+        if self.step_count % self.spawn_interval == 0:
+            with profiler.phase("spawn"):
+                self.create_cars_in_corners()
+
+        self.telemetry.end_step(self.step_count, len(self.car_ids))
+        profiler.end_step(self.step_count)
+
+    def update_traffic_lights(self):
+        """Applies the phase changes of this step."""
+        if self.signal_controller.next_change > self.steps:
+            return
+        changed = np.array(self.signal_controller.step(self.steps), dtype=np.int64)
+        if len(changed):
+            self.light_states[changed] = ~self.light_states[changed]
+            self.red[self.light_cells[changed]] = ~self.light_states[changed]
+
+    def remove_arrived_cars(self):
+        """Removes the cars that are on their destination (or can't reach it anymore)."""
+        distances = self.distances[self.car_goals, self.car_cells]
+        arrived = distances <= 0
+        if arrived.any():
+            self.occupied[self.car_cells[arrived]] = False
+            self.count_queues(self.car_cells[arrived], entered=False)
+            self.total_arrived += int(arrived.sum())
+            self.total_travel_time += int((self.step_count - self.car_spawn_steps[arrived]).sum())
+            self.telemetry.arrivals += int(arrived.sum())
+            for car_id, spawn_step, travelled in zip(self.car_ids[arrived].tolist(), self.car_spawn_steps[arrived].tolist(),
+                                                     self.car_travelled[arrived].tolist()):
+                self.telemetry.trip(f"car_{car_id}", spawn_step, self.step_count, travelled)
+            keep = ~arrived
+            self.car_ids = self.car_ids[keep]
+            self.car_cells = self.car_cells[keep]
+            self.car_goals = self.car_goals[keep]
+            self.car_spawn_steps = self.car_spawn_steps[keep]
+            self.car_travelled = self.car_travelled[keep]
+
+    def move_cars(self):
+        """
+        Moves every car one cell closer to its destination.
+        Cars only move to cells that were free and green at the start of the step, and when
+        several cars want the same cell one of them is chosen at random.
+        """
+        n_cars = len(self.car_ids)
+        if n_cars == 0:
+            return
+
+        options = self.successors[self.car_cells]
+        closer = self.distances[self.car_goals, self.car_cells] - 1
+        option_distances = self.distances[self.car_goals[:, None], options]
+        closer_options = (options >= 0) & (option_distances == closer[:, None])
+        valid = closer_options & ~self.occupied[options] & ~self.red[options]
+        # Cars that could be blocked by another car: they may lose a free cell, or a car is on the way
+        car_in_the_way = valid.any(axis=1) | (closer_options & self.occupied[options]).any(axis=1)
+
+        # Pick one of the valid options of each car at random
+        keys = np.where(valid, self.rng.random(valid.shape), -1.0)
+        choice = keys.argmax(axis=1)
+        moving = np.flatnonzero(valid.any(axis=1))
+        if len(moving) == 0:
+            self.count_blocked(np.zeros(n_cars, dtype=bool), car_in_the_way)
+            return
+        targets = options[moving, choice[moving]]
+
+        # Solve conflicts: a random car wins each cell
+        order = self.rng.permutation(len(moving))
+        _, first = np.unique(targets[order], return_index=True)
+        winners = order[first]
+        cars = moving[winners]
+        targets = targets[winners]
+
+        moved = np.zeros(n_cars, dtype=bool)
+        moved[cars] = True
+        self.count_blocked(moved, car_in_the_way)
+        self.telemetry.moves += len(cars)
+        self.car_travelled[cars] += 1
+
+        self.occupied[self.car_cells[cars]] = False
+        self.occupied[targets] = True
+        self.count_queues(self.car_cells[cars], entered=False)
+        self.count_queues(targets, entered=True)
+        self.car_cells[cars] = targets
+
+    def count_blocked(self, moved, car_in_the_way):
+        """Counts the cars that didn't move, as blocked by a car or (if no car was in the way) by a light."""
+        self.telemetry.blocked_car += int((~moved & car_in_the_way).sum())
+        self.telemetry.blocked_light += int((~moved & ~car_in_the_way).sum())
+
+    def count_queues(self, cells, entered):
+        """Reports to the signal controller the cars that entered (or left) the light and approach cells among cells."""
+        report = self.signal_controller.car_entered if entered else self.signal_controller.car_left
+        for cell in cells[self.signal_cells[cells]].tolist():
+            report(cell, self.step_count)
+
+    def create_cars_in_corners(self):
+        """
+        Creates a new car in each available corner.
+        """
+        free = self.corner_cells[~self.occupied[self.corner_cells]]
+        if len(free) == 0 or len(self.distances) == 0:
+            return
+        self.car_ids = np.concatenate([self.car_ids, np.arange(self.next_car_id, self.next_car_id + len(free))])
+        self.car_cells = np.concatenate([self.car_cells, free])
+        goals = self.rng.integers(0, len(self.distances), len(free))
+        self.add_distances(goals)
+        self.car_goals = np.concatenate([self.car_goals, goals])
+        self.car_spawn_steps = np.concatenate([self.car_spawn_steps, np.full(len(free), self.step_count)])
+        self.car_travelled = np.concatenate([self.car_travelled, np.zeros(len(free), dtype=np.int64)])
+        self.telemetry.spawns += len(free)
+        self.occupied[free] = True
+        self.count_queues(free, entered=True)
+        self.next_car_id += len(free)
+
+    def add_distances(self, goals):
+        """Computes the distance fields of the destinations goals that are not computed yet."""
+        missing = np.unique(goals)
+        missing = missing[~self.has_distances[missing]]
+        if len(missing):
+            fill_distances(self.road_graph, self.distances, missing.tolist())
+            self.has_distances[missing] = True
+
+    def car_positions(self):
+        """Returns (id, pos) for every car."""
+        return [(f"car_{car_id}", self.road_graph.position(cell)) for car_id, cell in zip(self.car_ids.tolist(), self.car_cells.tolist())]
+
+    def car_changes(self, since=None):
+        """Same interface as CityModel.car_changes, but changes are not tracked: every car is always sent."""
+        return self.step_count, True, self.car_positions(), [], []
+
+    def frame_arrays(self):
+        """Same as CityModel.frame_arrays, taken straight from the arrays of the model."""
+        x, z = np.divmod(self.car_cells, self.height)
+        positions = np.column_stack([x, np.ones_like(x), z]).astype("<f4")
+        return self.car_ids.astype("<u4"), positions, self.light_states.astype(np.uint8)
+
+    def snapshot(self):
+        """Returns the complete state of the model as a compact snapshot (see snapshot.py and CityModel.snapshot)."""
+        return dump_snapshot({
+            "engine": "numpy",
+            "params": snapshot_params(self.params),
+            "step_count": self.step_count,
+            "steps": self.steps,
+            "total_arrived": self.total_arrived,
+            "total_travel_time": self.total_travel_time,
+            "next_car_id": self.next_car_id,
+            "random": self.rng.bit_generator.state,
+            "cars": {name: getattr(self, name).tolist()
+                     for name in ("car_ids", "car_cells", "car_goals", "car_spawn_steps", "car_travelled")},
+            "signals": self.signal_controller.state(),
+            "telemetry": self.telemetry.state()})
+
+    @classmethod
+    def from_state(cls, state, telemetry_file=None):
+        """Creates a model from the state of a snapshot (already read with load_snapshot, see CityModel.from_state)."""
+        model = cls(5, **restore_params(state), telemetry_file=telemetry_file)
+        model.step_count = state["step_count"]
+        model.steps = state["steps"]
+        model.total_arrived = state["total_arrived"]
+        model.total_travel_time = state["total_travel_time"]
+        model.next_car_id = state["next_car_id"]
+
+        for name, values in state["cars"].items():
+            setattr(model, name, np.array(values, dtype=np.int64))
+        model.add_distances(model.car_goals)
+        model.occupied[:] = False
+        model.occupied[model.car_cells] = True
+
+        model.signal_controller.load_state(state["signals"])
+        model.light_states = np.array(model.signal_controller.states, dtype=bool)
+        model.red[model.light_cells] = ~model.light_states
+        model.telemetry.load_state(state["telemetry"])
+
+        model.rng.bit_generator.state = state["random"]
+        return model
+
+    def traffic_light_states(self):
+        """Returns (id, pos, state) for every traffic light."""
+        return [(light_id, self.road_graph.position(cell), state)
+                for light_id, cell, state in zip(self.light_ids, self.light_cells.tolist(), self.light_states.tolist())]
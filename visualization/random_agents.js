@@ -67,6 +67,21 @@ updateMatrix() {
 // Define the agent server URI
 const agent_server_uri = "http://localhost:8585/";
 
+// Id of our simulation in the server, returned by /init
+let sessionId = null;
+
+/*
+ * Builds the URL of a server route for our session, with extra query parameters.
+ */
+function serverUrl(route, params = {}) {
+  const query = new URLSearchParams(params);
+  if (sessionId !== null) {
+    query.set("session", sessionId);
+  }
+  const queryString = query.toString();
+  return agent_server_uri + route + (queryString ? "?" + queryString : "");
+}
+
 // Initialize arrays to store agents and obstacles
 const agents = [];
 const obstacles = [];
@@ -82,8 +97,17 @@ let cameraPosition = {x:0, y: 40, z: 0};
 // Initialize the frame count
 let frameCount = 0;
 
+// Last step of the cars received from the server (null until the first request)
+let lastAgentsStep = null;
+
+// Ticks per second of the server-driven mode: the server runs the model and pushes the frames over /stream.
+// null keeps the client in control, stepping the model every 30 frames with /step. Infinity runs as fast as possible.
+const streamTickRate = null;
+let stream = null;
+
 // Define the data object
 let data = {
+  session: true,
   NAgents: 500,
   width: 100,
   height: 100
@@ -135,9 +159,12 @@ async function main() {
 
   // Get the agents and obstacles
   await getAgents();
-  await getObstacles();
-  await getDestinations();
-  await getTraffic_Light();
+  await getMap();
+  await getLightStates();
+
+  if (streamTickRate !== null) {
+    await startStream();
+  }
 
   // Draw the scene
   await drawScene(gl, programInfo, agentsVao, agentsBufferInfo, obstaclesVao, obstaclesBufferInfo, destinationsVao, destinationsBufferInfo, trafficLightsVao, trafficLightsBufferInfo);
@@ -162,8 +189,11 @@ async function initAgentsModel() {
       // Parse the response as JSON and log the message
       let result = await response.json()
       // console.log(result)
+      sessionId = result.session
       data.width = result.width
       data.height = result.height
+      // A new model: the step of the cars we had means nothing for it
+      lastAgentsStep = null
     }
       
   } catch (error) {
@@ -173,101 +203,114 @@ async function initAgentsModel() {
 }
 
 /*
- * Retrieves the current positions of all agents from the agent server.
+ * Retrieves the cars that changed since the last call from the agent server.
  */
 async function getAgents() {
   try {
-    // Send a GET request to the agent server to retrieve the agent positions
-    let response = await fetch(agent_server_uri + "getAgents");
+    // Only ask for the cars added, moved or removed after the last step we received
+    const params = lastAgentsStep === null ? {} : {since: lastAgentsStep};
+    let response = await fetch(serverUrl("getAgentChanges", params));
 
     // Check if the response was successful
     if (response.ok) {
       // Parse the response as JSON
-      let result = await response.json();
-      //  agents=[];
-      
-
-      // Check if the agents array is empty
-      if (agents.length === 0) {
-        // Create new agents and add them to the agents array
-        result.positions.forEach (agent => {
-          const color = [0.0, 1.0, 0.0, 1.0]; // Verde claro para agentes
-          const newAgent = new Object3D(agent.id, [agent.x, agent.y, agent.z], [0, 0, 0], [0.5, 0.5, 0.5], color);
-          agents.push(newAgent);
-        })
-      } else {
-        // Update the positions of existing agents
-        for (const agent of result.positions) {
-          const current_agent = agents.find((object3d) => object3d.id === agent.id);
-
-          // Check if the agent exists in the agents array
-          if (current_agent !== undefined) {
-            // Update the agent's position
-            const newPosition = [agent.x, agent.y, agent.z];
-            current_agent.position = newPosition;
-
-            // Calculate direction and update rotation
-            current_agent.updatePosition(newPosition); // Update rotation based on movement
-          } else {
-            // Si es un nuevo agente, añadirlo con color
-            const color = [Math.random(), Math.random(), Math.random(), 1.0]; // Color aleatorio
-            const newAgent = new Object3D(agent.id, [agent.x, agent.y, agent.z], [0, 0, 0], [0.5, 0.5, 0.5], color);
-            agents.push(newAgent);
-          }
-        }
-      }
+      applyAgentChanges(await response.json());
     }
 
-    
   } catch (error) {
     // Log any errors that occur during the request
     console.log("Error fetching agents:", error);
   }
 }
 
-            const color = [Math.random(), Math.random(), Math.random(), 1.0]; // Color aleatorio
+/*
+ * Applies the car changes sent by the agent server (/getAgentChanges or /step).
+ */
+function applyAgentChanges(result) {
+  lastAgentsStep = result.step;
+
+  // A full response has every car, so the old ones are dropped
+  if (result.full) {
+    agents.length = 0;
+  }
+
+  for (const agent of result.added) {
+    // Color aleatorio para cada coche nuevo
+    const color = [Math.random(), Math.random(), Math.random(), 1.0];
+    const newAgent = new Object3D(agent.id, [agent.x, agent.y, agent.z], [0, 0, 0], [0.5, 0.5, 0.5], color);
+    agents.push(newAgent);
+  }
+
+  for (const agent of result.moved) {
+    const current_agent = agents.find((object3d) => object3d.id === agent.id);
+
+    // Check if the agent exists in the agents array
+    if (current_agent !== undefined) {
+      // Update the position and the rotation based on the movement
+      current_agent.updatePosition([agent.x, agent.y, agent.z]);
+    }
+  }
+
+  // Remove the cars that arrived to their destination
+  if (result.removed.length > 0) {
+    const removed = new Set(result.removed);
+    const remaining = agents.filter((object3d) => !removed.has(object3d.id));
+    agents.length = 0;
+    agents.push(...remaining);
+  }
+}
 
 /*
- * Retrieves the current positions of all obstacles from the agent server.
+ * Retrieves everything that doesn't change (obstacles, destinations and traffic lights) with a single request.
+ * The browser keeps the response and the server answers 304 while the map is the same.
  */
-async function getObstacles() {
+async function getMap() {
   try {
-    const response = await fetch(agent_server_uri + "getObstacles");
+    const response = await fetch(serverUrl("getMap"));
 
     if (response.ok) {
       const result = await response.json();
       obstacles.length = 0; // Limpia el arreglo para evitar duplicados
+      destinations.length = 0;
+      trafficLights.length = 0;
 
-      for (const obstacle of result.positions) {
+      for (const obstacle of result.obstacles) {
         const color = [0.96, 0.96, 0.86, 1.0]; // Beige (F5F5DC)
-        const newObstacle = new Object3D(obstacle.id, [obstacle.x, obstacle.y, obstacle.z], [0, 0, 0], [1, 1, 1], color);
-        obstacles.push(newObstacle);
+        obstacles.push(new Object3D(obstacle.id, [obstacle.x, obstacle.y, obstacle.z], [0, 0, 0], [1, 1, 1], color));
+      }
+
+      for (const destination of result.destinations) {
+        const color = [1.0, 0.71, 0.76, 1.0]; // Rosa claro
+        destinations.push(new Object3D(destination.id, [destination.x, destination.y, destination.z], [0, 0, 0], [1, 1, 1], color));
+      }
+
+      // The lights are drawn red until their states arrive
+      for (const trafficLight of result.lights) {
+        trafficLights.push(new Object3D(trafficLight.id, [trafficLight.x, trafficLight.y, trafficLight.z], [0, 0, 0], [1, 1, 1], getTrafficLightColor(false)));
       }
-      // console.log("Obstacles:", obstacles);
     }
   } catch (error) {
-    console.log("Error fetching obstacles:", error);
+    console.log("Error fetching the map:", error);
   }
 }
 
-
-async function getDestinations() {
+/*
+ * Retrieves the state of every traffic light, in the order of the lights of the map.
+ */
+async function getLightStates() {
   try {
-    const response = await fetch(agent_server_uri + "getDestinations");
+    const response = await fetch(serverUrl("getLightStates"));
 
     if (response.ok) {
       const result = await response.json();
-      destinations.length = 0; // Limpia el arreglo para evitar duplicados
-
-      for (const destination of result.positions) {
-        const color = [1.0, 0.71, 0.76, 1.0]; // Rosa claro
-        const newDestination = new Object3D(destination.id, [destination.x, destination.y, destination.z], [0, 0, 0], [1, 1, 1], color);
-        destinations.push(newDestination);
-      }
-      // console.log("Destinations:", destinations);
+      result.states.forEach((state, i) => {
+        if (trafficLights[i] !== undefined) {
+          trafficLights[i].color = getTrafficLightColor(state);
+        }
+      });
     }
   } catch (error) {
-    console.error("Error fetching destinations:", error);
+    console.log("Error fetching trafficLights:", error);
   }
 }
 
@@ -276,65 +319,65 @@ function getTrafficLightColor(state) {
   return state ? [0.0, 1.0, 0.0, 1.0] : [1.0, 0.0, 0.0, 1.0]; // RGB para verde y rojo con alfa 1.0
 }
 
-async function getTraffic_Light() {
+/*
+ * Advances the model one step and updates the cars and traffic lights with a single request.
+ */
+async function update() {
   try {
-    const response = await fetch(agent_server_uri + "getTraffic_Light");
+    // The server answers with the cars that changed since our last step and the state of every light
+    const params = lastAgentsStep === null ? {steps: 1} : {steps: 1, since: lastAgentsStep};
+    let response = await fetch(serverUrl("step", params))
 
-    if (response.ok) {
-      const result = await response.json();
-      trafficLights.length = 0; // Limpia el arreglo para evitar duplicados
-
-      for (const trafficLight of result.positions) {
-        // Obtener el color del semáforo basado en su estado
-        const color = getTrafficLightColor(trafficLight.state);
-
-        // Crear un nuevo Object3D para cada semáforo
-        const newtrafficLight = new Object3D(
-          trafficLight.id, // ID único
-          [trafficLight.x, trafficLight.y, trafficLight.z], // Posición
-          [0, 0, 0], // Rotación (puedes ajustarlo si es necesario)
-          [1, 1, 1], // Escala (ajustar si es necesario)
-          color // Color basado en el estado del semáforo
-        );
-
-        // Agregar el semáforo al arreglo de semáforos
-        trafficLights.push(newtrafficLight);
-      }
+    // Check if the response was successful
+    if(response.ok){
+      applyFrame(await response.json())
     }
+
   } catch (error) {
-    console.log("Error fetching trafficLights:", error);
+    // Log any errors that occur during the request
+    console.log(error) 
   }
 }
 
+/*
+ * Applies a frame of /step or /stream: the cars, the traffic lights and the counters.
+ */
+function applyFrame(result) {
+  applyAgentChanges(result)
+
+  // The lights come in the same order as in getMap
+  result.lights.forEach((state, i) => {
+    if (trafficLights[i] !== undefined) {
+      trafficLights[i].color = getTrafficLightColor(state);
+    }
+  })
+
+  const arrivedP = document.querySelector("#arrived")
+  const currentP = document.querySelector("#current")
+  arrivedP.textContent= result.total_arrived
+  currentP.textContent= agents.length
+}
 
 /*
- * Updates the agent positions by sending a request to the agent server.
+ * Starts the model in the server and listens to its frames. The server skips the frames
+ * we are too slow to receive, so every event has the complete state.
  */
-async function update() {
+async function startStream() {
   try {
-    // Send a request to the agent server to update the agent positions
-    let response = await fetch(agent_server_uri + "update")
-    let result = await response.json()
-    const arrivedP = document.querySelector("#arrived")
-    const currentP = document.querySelector("#current")
-    arrivedP.textContent= result.total_arrived
-    currentP.textContent= agents.length
-  
-
-    console.log(result) 
+    const tickRate = Number.isFinite(streamTickRate) ? streamTickRate : null;
+    let response = await fetch(serverUrl("run"), {
+      method: 'POST',
+      headers: { 'Content-Type':'application/json' },
+      body: JSON.stringify({tick_rate: tickRate})
+    })
 
-    // Check if the response was successful
-    if(response.ok){
-      // Retrieve the updated agent positions
-      await getAgents()
-      await getTraffic_Light()
-      // Log a message indicating that the agents have been updated
-      // console.log("Updated agents")
+    if (response.ok) {
+      stream = new EventSource(serverUrl("stream"));
+      stream.onmessage = (event) => applyFrame(JSON.parse(event.data));
     }
 
   } catch (error) {
-    // Log any errors that occur during the request
-    console.log(error) 
+    console.log(error)
   }
 }
 
@@ -373,8 +416,8 @@ async function drawScene(gl, programInfo, agentsVao, agentsBufferInfo, obstacles
     // Increment the frame count
     frameCount++
 
-    // Update the scene every 30 frames
-    if(frameCount%30 == 0){
+    // Update the scene every 30 frames (in the server-driven mode the frames arrive by themselves)
+    if(frameCount%30 == 0 && stream === null){
       frameCount = 0
       await update()
     } 